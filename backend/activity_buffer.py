@@ -0,0 +1,158 @@
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+import asyncio
+import time
+
+# Write-behind buffer for gamification activity events.
+# The track endpoint puts events on an in-process queue and answers straight away; a background
+# flusher hands them to flush_handler in batches, every FLUSH_INTERVAL_MS or as soon as
+# MAX_BATCH_SIZE events are waiting, whichever comes first.
+# A failed batch is retried whole, so events must carry an event_id the handler deduplicates on
+# (track_activity_batch ignores event_ids already logged, see sql/005_activity_idempotency.sql).
+# Callers that need the written state (e.g. the UI refreshing stats and badges) use submit_and_wait,
+# which resolves with flush_handler's result once the event's batch is written.
+FLUSH_INTERVAL_MS = 200
+MAX_BATCH_SIZE = 100
+MAX_QUEUE_SIZE = 10000
+MAX_FLUSH_ATTEMPTS = 3
+SHUTDOWN_DRAIN_TIMEOUT_SECONDS = 10
+FLUSH_WAIT_TIMEOUT_SECONDS = 5
+
+class ActivityBuffer:
+    def __init__(
+        self,
+        flush_handler: Callable[[List[dict]], Awaitable[Any]],
+        flush_interval_ms: int = FLUSH_INTERVAL_MS,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_queue_size: int = MAX_QUEUE_SIZE
+    ):
+        self.flush_handler = flush_handler
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.flusher: Optional[asyncio.Task] = None
+        self.metrics = {
+            "events_enqueued": 0,
+            "events_flushed": 0,
+            "events_dropped": 0,
+            "flushes": 0,
+            "flush_failures": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0
+        }
+
+    @property
+    def running(self) -> bool:
+        return self.flusher is not None and not self.flusher.done()
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.flusher = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = SHUTDOWN_DRAIN_TIMEOUT_SECONDS):
+        """
+        Stop accepting events and flush everything still queued
+        """
+        if not self.running:
+            return
+
+        queue = self.queue
+        self.queue = None # submit() now refuses new events
+        try:
+            await asyncio.wait_for(queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Activity buffer shutdown: {queue.qsize()} event(s) not flushed")
+        self.flusher.cancel()
+
+    def submit(self, event: dict, waiter: Optional[asyncio.Future] = None) -> bool:
+        """
+        Queue an event. Returns False when the buffer is not running or full, so the caller can write directly.
+        """
+        if self.queue is None:
+            return False
+        try:
+            self.queue.put_nowait((event, waiter))
+        except asyncio.QueueFull:
+            return False
+        self.metrics["events_enqueued"] += 1
+        return True
+
+    async def submit_and_wait(self, event: dict, timeout: float = FLUSH_WAIT_TIMEOUT_SECONDS) -> Tuple[bool, bool, Any]:
+        """
+        Queue an event and wait for its batch to be written.
+        Returns (queued, flushed, flush_handler result). Not queued: write directly as with submit.
+        Not flushed: the batch was dropped or took longer than timeout (it is still written in the background).
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        if not self.submit(event, waiter):
+            return False, False, None
+        try:
+            # shield: a timed out or cancelled request must not cancel the waiter the flusher resolves
+            flushed, result = await asyncio.wait_for(asyncio.shield(waiter), timeout=timeout)
+        except asyncio.TimeoutError:
+            return True, False, None
+        return True, flushed, result
+
+    def get_metrics(self) -> dict:
+        flushes = self.metrics["flushes"]
+        return {
+            **self.metrics,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "avg_flush_ms": round(self.metrics["total_flush_ms"] / flushes, 2) if flushes else 0.0,
+            "running": self.running
+        }
+
+    async def _collect_batch(self, queue: asyncio.Queue) -> List[tuple]:
+        # Wait for the first event, then keep collecting until the interval elapses or the batch is full
+        batch = [await queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    @staticmethod
+    def _resolve_waiters(batch: List[tuple], flushed: bool, result: Any = None):
+        for _, waiter in batch:
+            if waiter is not None and not waiter.done():
+                waiter.set_result((flushed, result))
+
+    async def _flush(self, batch: List[tuple]):
+        events = [event for event, _ in batch]
+        for attempt in range(1, MAX_FLUSH_ATTEMPTS + 1):
+            started = time.perf_counter()
+            try:
+                result = await self.flush_handler(events)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.metrics["flushes"] += 1
+                self.metrics["events_flushed"] += len(batch)
+                self.metrics["last_flush_ms"] = round(elapsed_ms, 2)
+                self.metrics["max_flush_ms"] = round(max(self.metrics["max_flush_ms"], elapsed_ms), 2)
+                self.metrics["total_flush_ms"] += elapsed_ms
+                self._resolve_waiters(batch, True, result)
+                return
+            except Exception as e:
+                self.metrics["flush_failures"] += 1
+                print(f"Error flushing activity batch (attempt {attempt}): {e}")
+                if attempt < MAX_FLUSH_ATTEMPTS:
+                    await asyncio.sleep(0.5 * attempt)
+
+        self.metrics["events_dropped"] += len(batch)
+        print(f"Dropped {len(batch)} activity event(s) after {MAX_FLUSH_ATTEMPTS} attempts")
+        self._resolve_waiters(batch, False)
+
+    async def _run(self):
+        queue = self.queue
+        while True:
+            batch = await self._collect_batch(queue)
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
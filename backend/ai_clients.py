@@ -0,0 +1,57 @@
+from dotenv import load_dotenv
+from typing import TYPE_CHECKING, Optional
+import os
+
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+    from openai import AsyncOpenAI
+
+# OpenAI and Chroma Cloud clients, created once by the app lifespan (main.py) with init_ai_clients.
+# langchain_chroma (and chromadb under it), langchain_openai and openai are imported there rather than at
+# module import, and the Chroma Cloud client is built there too (it calls the server when created), so
+# importing main stays fast and does no network I/O.
+load_dotenv()
+openai_api_key = os.getenv("OPENAI_API_KEY")
+chroma_api_key = os.getenv("CHROMA_API_KEY")
+chroma_tenant = os.getenv("CHROMA_TENANT")
+chroma_database = os.getenv("CHROMA_DATABASE")
+
+CHROMA_COLLECTION_NAME = "company_documents"
+
+_async_openai_client: Optional["AsyncOpenAI"] = None
+_chroma_client: Optional["Chroma"] = None
+
+def init_ai_clients():
+    """
+    Create the OpenAI and Chroma clients (called once from the app lifespan, in a thread)
+    """
+    global _async_openai_client, _chroma_client
+    from langchain_chroma import Chroma
+    from langchain_openai import OpenAIEmbeddings
+    from openai import AsyncOpenAI
+
+    _async_openai_client = AsyncOpenAI(api_key=openai_api_key)
+    _chroma_client = Chroma(
+        collection_name=CHROMA_COLLECTION_NAME,
+        embedding_function=OpenAIEmbeddings(api_key=openai_api_key),
+        chroma_cloud_api_key=chroma_api_key,
+        tenant=chroma_tenant,
+        database=chroma_database
+    )
+
+async def close_ai_clients():
+    global _async_openai_client, _chroma_client
+    if _async_openai_client is not None:
+        await _async_openai_client.close()
+    _async_openai_client = None
+    _chroma_client = None
+
+def get_openai_client() -> "AsyncOpenAI":
+    if _async_openai_client is None:
+        raise RuntimeError("OpenAI client not initialised, it is created by the app lifespan")
+    return _async_openai_client
+
+def get_chroma_client() -> "Chroma":
+    if _chroma_client is None:
+        raise RuntimeError("Chroma client not initialised, it is created by the app lifespan")
+    return _chroma_client
@@ -1,27 +1,45 @@
-from fastapi import APIRouter, HTTPException, Depends
-from supabase import create_client, Client
+from fastapi import APIRouter, HTTPException, Depends, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any
-import os
+from typing import List, Dict, Any, Awaitable, Callable, Tuple, Optional
+import time
+import asyncio
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
 from auth import UserContext, get_current_user
-from bson import ObjectId
-from pymongo import MongoClient
+from functools import partial
+from pymongo.asynchronous.database import AsyncDatabase
+from leaderboard import leaderboard
+from response_cache import StaleWhileRevalidateCache
+from document_stats import DOCUMENT_STATS_COLLECTION, get_document_stats_async
+from exports import EXPORT_DATASETS, EXPORT_FORMATS, iter_export
+from latency_metrics import LATENCY_SNAPSHOT_COLLECTION, latency_metrics, get_snapshots
+from tracing import traced
+from mongo import get_async_db
+from supabase import AsyncClient
+from supabase_client import get_supabase
 
 load_dotenv()
 router = APIRouter()
 
-# Supabase client setup
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_secret_key = os.getenv("SUPABASE_SECRET_KEY")
-supabase: Client = create_client(supabase_url, supabase_secret_key)
+# Upper bound for all of an endpoint's queries together
+ANALYTICS_QUERY_TIMEOUT_SECONDS = 20
 
-# Mongodb
-mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
-mongodb_client = MongoClient(mongodb_uri, tls=True, tlsAllowInvalidCertificates=True)
-db = mongodb_client["els_db"]
-company_documents_collection = db["company_documents"]
+# Analytics responses are served from cache for 5 minutes, then served stale for up to 30 minutes while refreshed in the background
+# Entries are (DashboardResponse, query timings), shared across workers through the "analytics" cache namespace
+ANALYTICS_CACHE_FRESH_SECONDS = 300
+ANALYTICS_CACHE_STALE_SECONDS = 1800
+analytics_cache = StaleWhileRevalidateCache(
+    "analytics",
+    fresh_seconds=ANALYTICS_CACHE_FRESH_SECONDS,
+    stale_seconds=ANALYTICS_CACHE_STALE_SECONDS,
+    dump=lambda value: {"result": value[0].model_dump(mode="json"), "timings": value[1]},
+    load=lambda data: (DashboardResponse.model_validate(data["result"]), data["timings"])
+)
+
+# Supabase: shared async client created by the app lifespan (see supabase_client.py)
+
+# Mongodb: shared async client created by the app lifespan (see mongo.py)
 
 # Pydantic models for analytics
 class OverviewKPIResponse(BaseModel):
@@ -103,6 +121,31 @@ class UserActivityResponse(BaseModel):
     most_active_users: List[UserActivityMostActiveUser]
     role_distribution: List[UserActivityRoleDistribution]
 
+class LatencyPercentiles(BaseModel):
+    name: str
+    count: int
+    mean_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    max_ms: float
+
+class LatencySnapshot(BaseModel):
+    timestamp: datetime
+    interval_started_at: datetime
+    metrics: List[LatencyPercentiles]
+
+class LatencyAnalyticsResponse(BaseModel):
+    since: datetime
+    current: List[LatencyPercentiles]
+    trend: List[LatencySnapshot]
+
+class DashboardResponse(BaseModel):
+    overview: OverviewResponse
+    search_analytics: SearchAnalyticsResponse
+    document_analytics: DocumentAnalyticsResponse
+    user_activity: UserActivityResponse
+
 # Helper function to get date range
 def get_date_range(days: int):
     end_date = datetime.utcnow().date() + timedelta(days=1)
@@ -123,195 +166,510 @@ def format_response_time(ms: float) -> str:
 def format_bytes_to_mb(bytes_value: int) -> float:
     return round(bytes_value / (1024 ** 2), 2)
 
-# Endpoint to get overview data
-@router.get("/api/analytics/overview", response_model=OverviewResponse)
-async def get_overview_analytics(user_role: str = "all", time_range: int = 30, current_user: UserContext = Depends(get_current_user)):
-    try:
-        # Only admin can view analytics
-        if current_user.role not in ["admin"]:
-            raise HTTPException(status_code=403, detail="Insufficient permissions")
-        
-        start_date, end_date = get_date_range(time_range)
-        role_filter = get_role_filter(user_role)
-        prev_start_date = start_date - timedelta(days=time_range)
-        prev_end_date = start_date - timedelta(days=1)
-
-        print(f"Fetching analytics from {start_date} to {end_date} for role: {user_role}")
-
-        # KPIS ==========================================================================================
-        # Build query for current period
-        query = supabase.table("daily_analytics").select("*").gte("date", start_date.isoformat()).lte("date", end_date.isoformat())
-        if role_filter:
-            query = query.eq("user_role", role_filter)
-        current_data = query.execute()
-
-        users_query = supabase.table("profiles").select("id", count="exact").gte("created_at", start_date.isoformat()).lte("created_at", end_date.isoformat())
-        if role_filter:
-            users_query = users_query.eq("role", role_filter)
-        users_data = users_query.execute()
-
-        # Build query for previous period
-        prev_query = supabase.table("daily_analytics").select("*").gte("date", prev_start_date.isoformat()).lte("date", prev_end_date.isoformat())
-        if role_filter:
-            prev_query = prev_query.eq("user_role", role_filter)
-        previous_data = prev_query.execute()
-
-        prev_users_query = supabase.table("profiles").select("id", count="exact").gte("created_at", prev_start_date.isoformat()).lte("created_at", prev_end_date.isoformat())
-        if role_filter:
-            prev_users_query = prev_users_query.eq("role", role_filter)
-        previous_users_data = prev_users_query.execute()
-
-        # Aggregate current period KPIs
-        total_questions = sum(row["total_questions"] for row in current_data.data)
-        documents_viewed = sum(row["total_documents_viewed"] for row in current_data.data)
-        total_users = users_data.count or 0
-
-        # Aggregate previous period KPIs
-        previous_total_questions = sum(row["total_questions"] for row in previous_data.data)
-        previous_documents_viewed = sum(row["total_documents_viewed"] for row in previous_data.data)
-        previous_total_users = previous_users_data.count or 0
-
-        # Build KPI response
-        kpis = OverviewKPIResponse(
-            total_questions=total_questions,
-            documents_viewed=documents_viewed,
-            total_users=total_users,
-            previous_total_questions=previous_total_questions,
-            previous_documents_viewed=previous_documents_viewed,
-            previous_total_users=previous_total_users
-        )
+# Helper function to run independent queries concurrently (async Supabase and MongoDB calls on the event loop)
+# End-to-end latency becomes that of the slowest query
+async def run_queries(queries: Dict[str, Callable[[], Awaitable[Any]]], timeout: float = ANALYTICS_QUERY_TIMEOUT_SECONDS) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    timings = {}
 
-        # DAILY USAGE TRENDS ==========================================================================================
-        # Initialise counters for each day of week (0=Monday, 6=Sunday)
-        day_of_week_aggregates = {
-            i: {"searches": 0, "documentViews": 0, "activeUsers": 0}
-            for i in range(7)
-        }
-
-        # Aggregate all data from chosen timeRange, by day of week
-        for row in current_data.data:
-            date_obj = datetime.fromisoformat(row["date"]).date()
-            day_of_week = date_obj.weekday()
-
-            day_of_week_aggregates[day_of_week]["searches"] += row["total_questions"]
-            day_of_week_aggregates[day_of_week]["documentViews"] += row["total_documents_viewed"]
-            day_of_week_aggregates[day_of_week]["activeUsers"] += row["active_users"]
-        
-        # Build daily usage trends response
-        daily_trends = []
-        day_labels = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-        
-        for day_index, label in enumerate(day_labels):
-            daily_trends.append(OverviewDailyTrendData(
-                label=label,
-                searches=day_of_week_aggregates[day_index]["searches"],
-                documentViews=day_of_week_aggregates[day_index]["documentViews"],
-                activeUsers=day_of_week_aggregates[day_index]["activeUsers"]
-            ))
-
-        return OverviewResponse(kpis=kpis, daily_trends=daily_trends)
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Analytics error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to fetch analytics data")
+    async def timed(name: str, query: Callable[[], Awaitable[Any]]):
+        started = time.perf_counter()
+        try:
+            with traced("analytics.query", {"els.query_name": name}):
+                return await query()
+        finally:
+            timings[name] = round((time.perf_counter() - started) * 1000, 1)
 
-# Endpoint to get overview data
-@router.get("/api/analytics/search-analytics", response_model=SearchAnalyticsResponse)
-async def get_search_analytics(user_role: str = "all", time_range: int = 30, current_user: UserContext = Depends(get_current_user)):
+    names = list(queries)
     try:
-        # Only admin can view analytics
-        if current_user.role not in ["admin"]:
-            raise HTTPException(status_code=403, detail="Insufficient permissions")
-        
-        start_date, end_date = get_date_range(time_range)
-        role_filter = get_role_filter(user_role)
-        prev_start_date = start_date - timedelta(days=time_range)
-        prev_end_date = start_date - timedelta(days=1)
-
-        print(f"Fetching search analytics from {start_date} to {end_date} for role: {user_role}")
+        results = await asyncio.wait_for(
+            asyncio.gather(*(timed(name, queries[name]) for name in names)),
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        print(f"Analytics queries timed out after {timeout}s, finished: {timings}")
+        raise HTTPException(status_code=504, detail="Analytics queries timed out")
+    
+    return dict(zip(names, results)), timings
+
+# Helper function to expose per-query timings as a Server-Timing header (visible in browser dev tools)
+def set_query_timings(response: Response, timings: Dict[str, float]):
+    response.headers["Server-Timing"] = ", ".join(f"{name};dur={duration}" for name, duration in timings.items())
+    print(f"Analytics query timings (ms): {timings}")
+
+# Helper function to serve an analytics section through the cache
+# Keyed by (section, role filter, time range, UTC date) so windows roll over at midnight UTC
+async def get_cached_analytics(response: Response, section: str, user_role: str, time_range: int, compute: Callable):
+    cache_key = (section, user_role, time_range, datetime.utcnow().date().isoformat())
+
+    async def run():
+        query_timings = {}
+        result = await compute(user_role, time_range, query_timings)
+        return result, query_timings
+
+    (result, query_timings), cache_status = await analytics_cache.get_or_compute(cache_key, run)
+
+    response.headers["X-Cache"] = cache_status
+    if cache_status == "MISS":
+        set_query_timings(response, query_timings)
+    return result
+
+# QUERY PLAN ==========================================================================================
+# Every query the report sections need, keyed by name. Sections declare which ones they read, so a
+# request for several sections runs the union once and shares the results (the daily_analytics
+# summary is read by overview and user-activity, for example).
+def build_analytics_queries(user_role: str, time_range: int) -> Dict[str, Callable[[], Awaitable[Any]]]:
+    supabase = get_supabase()
+    start_date, end_date = get_date_range(time_range)
+    role_filter = get_role_filter(user_role)
+    prev_start_date = start_date - timedelta(days=time_range)
+    prev_end_date = start_date - timedelta(days=1)
+
+    # New users for the current and previous period
+    current_users_query = supabase.table("profiles").select("id", count="exact").gte("created_at", start_date.isoformat()).lte("created_at", end_date.isoformat())
+    if role_filter:
+        current_users_query = current_users_query.eq("role", role_filter)
+
+    previous_users_query = supabase.table("profiles").select("id", count="exact").gte("created_at", prev_start_date.isoformat()).lte("created_at", prev_end_date.isoformat())
+    if role_filter:
+        previous_users_query = previous_users_query.eq("role", role_filter)
+
+    # Per-user summary
+    user_summary_query = supabase.table("user_activity_summary").select("*")
+    if role_filter:
+        user_summary_query = user_summary_query.eq("role", role_filter)
+
+    def period_rpc(name: str, range_start, range_end):
+        return lambda: supabase.rpc(
+            name,
+            {
+                "start_date": range_start.isoformat(),
+                "end_date": range_end.isoformat(),
+                "user_role": role_filter
+            }
+        ).execute()
 
-        # KPIS ==========================================================================================
-        # Current period
-        kpis_result = supabase.rpc(
-            "get_search_analytics_kpis",
+    return {
+        # daily_analytics totals for both periods and weekday buckets, aggregated in Postgres (sql/004_daily_analytics_summary.sql)
+        "daily_summary": lambda: supabase.rpc(
+            "get_daily_analytics_summary",
             {
                 "start_date": start_date.isoformat(),
                 "end_date": end_date.isoformat(),
+                "prev_start_date": prev_start_date.isoformat(),
+                "prev_end_date": prev_end_date.isoformat(),
                 "user_role": role_filter
             }
+        ).execute(),
+        "current_users": current_users_query.execute,
+        "previous_users": previous_users_query.execute,
+        "user_summary": user_summary_query.execute,
+        "current_search_kpis": period_rpc("get_search_analytics_kpis", start_date, end_date),
+        "previous_search_kpis": period_rpc("get_search_analytics_kpis", prev_start_date, prev_end_date),
+        "daily_search_trends": period_rpc("get_daily_search_trends", start_date, end_date),
+        "current_retention": period_rpc("calculate_user_retention", start_date, end_date),
+        "previous_retention": period_rpc("calculate_user_retention", prev_start_date, prev_end_date),
+        # Totals, tag counts and upload histogram maintained by document_stats.py
+        "document_stats": partial(get_document_stats_async, get_async_db()[DOCUMENT_STATS_COLLECTION]),
+        # Whole database size for the storage quota KPI (one cheap command, and the dashboard result is cached)
+        "database_stats": partial(get_async_db().command, "dbStats"),
+        "most_viewed": lambda: supabase.rpc(
+            "get_most_viewed_documents",
+            {
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat(),
+                "user_role": role_filter,
+                "limit_count": 5
+            }
         ).execute()
+    }
+
+# Function to build overview data from the query results
+def build_overview_analytics(results: Dict[str, Any], user_role: str, time_range: int) -> OverviewResponse:
+    daily_summary = results["daily_summary"].data
+    users_data = results["current_users"]
+    previous_users_data = results["previous_users"]
+
+    # KPIS ==========================================================================================
+    # Current period KPIs
+    total_questions = daily_summary["current"]["total_questions"]
+    documents_viewed = daily_summary["current"]["total_documents_viewed"]
+    total_users = users_data.count or 0
+
+    # Previous period KPIs
+    previous_total_questions = daily_summary["previous"]["total_questions"]
+    previous_documents_viewed = daily_summary["previous"]["total_documents_viewed"]
+    previous_total_users = previous_users_data.count or 0
+
+    # Build KPI response
+    kpis = OverviewKPIResponse(
+        total_questions=total_questions,
+        documents_viewed=documents_viewed,
+        total_users=total_users,
+        previous_total_questions=previous_total_questions,
+        previous_documents_viewed=previous_documents_viewed,
+        previous_total_users=previous_total_users
+    )
+
+    # DAILY USAGE TRENDS ==========================================================================================
+    # Initialise counters for each day of week (0=Monday, 6=Sunday)
+    day_of_week_aggregates = {
+        i: {"searches": 0, "documentViews": 0, "activeUsers": 0}
+        for i in range(7)
+    }
+
+    # Fill in the day of week buckets aggregated by the RPC (days without data are omitted)
+    for bucket in daily_summary["weekdays"]:
+        day_of_week = bucket["day_of_week"]
+
+        day_of_week_aggregates[day_of_week]["searches"] = bucket["total_questions"]
+        day_of_week_aggregates[day_of_week]["documentViews"] = bucket["total_documents_viewed"]
+        day_of_week_aggregates[day_of_week]["activeUsers"] = bucket["active_users"]
+    
+    # Build daily usage trends response
+    daily_trends = []
+    day_labels = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+    
+    for day_index, label in enumerate(day_labels):
+        daily_trends.append(OverviewDailyTrendData(
+            label=label,
+            searches=day_of_week_aggregates[day_index]["searches"],
+            documentViews=day_of_week_aggregates[day_index]["documentViews"],
+            activeUsers=day_of_week_aggregates[day_index]["activeUsers"]
+        ))
+
+    return OverviewResponse(kpis=kpis, daily_trends=daily_trends)
+
+# Function to build search-analytics data from the query results
+def build_search_analytics(results: Dict[str, Any], user_role: str, time_range: int) -> SearchAnalyticsResponse:
+    kpis_result = results["current_search_kpis"]
+    prev_kpis_result = results["previous_search_kpis"]
+    trends_result = results["daily_search_trends"]
+
+    if not kpis_result.data or len(kpis_result.data) == 0:
+        kpis = SearchAnalyticsKPIResponse(
+            avg_response_time_ms=0.0,
+            avg_response_time_display="0ms",
+            search_success_rate=0.0,
+            zero_results_rate=0.0,
+            previous_avg_response_time_ms=0.0,
+            previous_search_success_rate=0.0,
+            previous_zero_results_rate=0.0
+        )
+        daily_trends = []
 
-        if not kpis_result.data or len(kpis_result.data) == 0:
-            kpis = SearchAnalyticsKPIResponse(
-                avg_response_time_ms=0.0,
-                avg_response_time_display="0ms",
-                search_success_rate=0.0,
-                zero_results_rate=0.0,
-                previous_avg_response_time_ms=0.0,
-                previous_search_success_rate=0.0,
-                previous_zero_results_rate=0.0
+        return SearchAnalyticsResponse(kpis=kpis, daily_trends=daily_trends)
+    
+    # KPIS ==========================================================================================
+    current_kpis = kpis_result.data[0]
+
+    avg_response_time_ms = float(current_kpis.get("avg_response_time_ms") or 0)
+    search_success_rate = float(current_kpis.get("success_rate") or 0)
+    zero_results_rate = float(current_kpis.get("zero_results_rate") or 0)
+
+    # Previous period
+    if prev_kpis_result.data and len(prev_kpis_result.data) > 0:
+        prev_kpis = prev_kpis_result.data[0]
+        previous_avg_response_time_ms = float(prev_kpis.get("avg_response_time_ms") or 0)
+        previous_search_success_rate = float(prev_kpis.get("success_rate") or 0)
+        previous_zero_results_rate = float(prev_kpis.get("zero_results_rate") or 0)
+    else:
+        previous_avg_response_time_ms = 0.0
+        previous_search_success_rate = 0.0
+        previous_zero_results_rate = 0.0
+    
+    # Build KPI response
+    kpis = SearchAnalyticsKPIResponse(
+        avg_response_time_ms=avg_response_time_ms,
+        avg_response_time_display=format_response_time(avg_response_time_ms),
+        search_success_rate=search_success_rate,
+        zero_results_rate=zero_results_rate,
+        previous_avg_response_time_ms=previous_avg_response_time_ms,
+        previous_search_success_rate=previous_search_success_rate,
+        previous_zero_results_rate=previous_zero_results_rate
+    )
+
+    # DAILY SEARCH TRENDS ==========================================================================================
+    daily_trends = []
+    for row in trends_result.data:
+        daily_trends.append(SearchAnalyticsDailySearchTrend(
+            label=row["day_label"],
+            totalSearches=int(row["total_searches"]),
+            successfulSearches=int(row["successful_searches"])
+        ))
+    
+    return SearchAnalyticsResponse(kpis=kpis, daily_trends=daily_trends)
+
+# Function to build document-analytics data from the query results
+def build_document_analytics(results: Dict[str, Any], user_role: str, time_range: int) -> DocumentAnalyticsResponse:
+    start_date, end_date = get_date_range(time_range)
+    document_stats = results["document_stats"]
+
+    # KPI 1: TOTAL DOCUMENTS (MONGODB) ==========================================================================================
+    total_documents = document_stats["total_documents"]
+
+    # Documents that existed before the period: total minus uploads since its start
+    start_day = start_date.strftime("%Y-%m-%d")
+    uploaded_in_period = sum(count for day, count in document_stats["uploads_by_day"].items() if day >= start_day and day != "unknown")
+    previous_total_documents = total_documents - uploaded_in_period
+
+    # # KPI 2: % DOCUMENTS ACCESSED (SUPABASE) ==========================================================================================
+    # # Current period
+    # unique_docs_result = supabase.rpc(
+    #     "count_unique_documents_accessed",
+    #     {
+    #         "start_date": start_date.isoformat(),
+    #         "end_date": end_date.isoformat(),
+    #         "user_role": role_filter
+    #     }
+    # ).execute()
+
+    # unique_documents_accessed = unique_docs_result.data[0]["unique_documents_accessed"] if unique_docs_result.data else 0
+
+    # documents_accessed_percentage = round((unique_documents_accessed / total_documents * 100) if total_documents > 0 else 0, 2)
+
+    # # Previous period
+    # prev_unique_docs_result = supabase.rpc(
+    #     "count_unique_documents_accessed",
+    #     {
+    #         "start_date": prev_start_date.isoformat(),
+    #         "end_date": prev_end_date.isoformat(),
+    #         "user_role": role_filter
+    #     }
+    # ).execute()
+
+    # prev_unique_documents_accessed = prev_unique_docs_result.data[0]["unique_documents_accessed"] if prev_unique_docs_result.data else 0
+
+    # previous_documents_accessed_percentage = round((prev_unique_documents_accessed / previous_total_documents * 100) if previous_total_documents > 0 else 0, 2)
+
+    # KPI 3: STORAGE USED (MONGODB) ==========================================================================================
+    # Data plus indexes of the whole database, which is what the cluster quota counts
+    # (PDFs, page images, activity, outbox, snapshots...), not only the document files
+    database_stats = results["database_stats"]
+    storage_used_mb = format_bytes_to_mb(database_stats.get("dataSize", 0) + database_stats.get("indexSize", 0))
+
+    storage_limit_mb = 512.00
+
+    # Build KPI response
+    kpis = DocumentAnalyticsKPIResponse(
+        total_documents=total_documents,
+        # documents_accessed_percentage=documents_accessed_percentage,
+        storage_used_mb=storage_used_mb,
+        storage_limit_mb=storage_limit_mb,
+        previous_total_documents=previous_total_documents,
+        # previous_documents_accessed_percentage=previous_documents_accessed_percentage
+    )
+
+    # MOST VIEWED DOCUMENTS (SUPABASE) ==========================================================================================
+    most_viewed_result = results["most_viewed"]
+
+    most_viewed_documents = []
+    for row in most_viewed_result.data:
+        most_viewed_documents.append(DocumentAnalyticsMostViewedDocument(
+            filename=row["filename"] or "Unknown",
+            total_views=int(row["total_views"])
+        ))
+    
+    # CATEGORY DISTRIBUTION (MONGODB) ==========================================================================================
+    # Top 10 tags by document count
+    top_tags = sorted(document_stats["tags"].items(), key=lambda item: item[1], reverse=True)[:10]
+
+    category_distribution = []
+    for tag, count in top_tags:
+        category_distribution.append(DocumentAnalyticsCategoryDistribution(
+            category=tag,
+            count=count
+        ))
+
+    return DocumentAnalyticsResponse(kpis=kpis, most_viewed_documents=most_viewed_documents, category_distribution=category_distribution)
+
+# Helper function to average active users per day from a daily_analytics period summary
+def get_daily_active_users(period_summary: dict) -> float:
+    num_days = period_summary["days"]
+    return round(period_summary["active_users"] / num_days, 1) if num_days > 0 else 0
+
+# Function to build user-activity data from the query results
+def build_user_activity_analytics(results: Dict[str, Any], user_role: str, time_range: int) -> UserActivityResponse:
+    role_filter = get_role_filter(user_role)
+
+    # KPI 1: DAILY ACTIVE USERS ==========================================================================================
+    daily_summary = results["daily_summary"].data
+    daily_active_users = get_daily_active_users(daily_summary["current"])
+    previous_daily_active_users = get_daily_active_users(daily_summary["previous"])
+    
+    # KPI 2: AVERAGE BADGES PER USER ==========================================================================================
+    users_data = results["user_summary"]
+
+    users = users_data.data or []
+    total_users_count = len(users)
+
+    if total_users_count > 0:
+        total_badges = sum(user.get("badges_earned", 0) for user in users)
+        average_badges_per_user = round(total_badges / total_users_count)
+    else:
+        average_badges_per_user = 0
+    
+    # KPI 3: USER RETENTION RATE ==========================================================================================
+    # Current period
+    retention_result = results["current_retention"]
+
+    if retention_result.data and len(retention_result.data) > 0:
+        user_retention_rate = round(float(retention_result.data[0]["retention_rate"] or 0), 1)
+    else:
+        user_retention_rate = 0.0
+    
+    # Previous period
+    prev_retention_result = results["previous_retention"]
+
+    if prev_retention_result.data and len(prev_retention_result.data) > 0:
+        previous_user_retention_rate = float(prev_retention_result.data[0]["retention_rate"] or 0)
+    else:
+        previous_user_retention_rate = 0.0
+    
+    # Build KPI response
+    kpis = UserActivityKPIResponse(
+        daily_active_users=daily_active_users,
+        average_badges_per_user=average_badges_per_user,
+        user_retention_rate=user_retention_rate,
+        previous_daily_active_users=previous_daily_active_users,
+        previous_user_retention_rate=previous_user_retention_rate
+    )
+    
+    # MOST ACTIVE USERS ==========================================================================================
+    # Served from the in-memory leaderboard, sorting the summary rows only until it has loaded
+    if leaderboard.loaded:
+        most_active_users = [
+            UserActivityMostActiveUser(
+                user_id=entry["user_id"],
+                name=entry["name"],
+                role=entry["role"],
+                total_exp=entry["total_exp"]
             )
-            daily_trends = []
+            for entry in leaderboard.top(5, role_filter)
+        ]
+    else:
+        most_active_users = [
+            UserActivityMostActiveUser(
+                user_id=user["user_id"],
+                name=f"{user.get('first_name', '')} {user.get('last_name', '')}".strip() or "Unknown User",
+                role=user.get("role", "Unknown"),
+                total_exp=user.get("total_exp", 0)
+            )
+            for user in sorted(
+                users,
+                key=lambda u: u.get("total_exp", 0),
+                reverse=True
+            )[:5]
+        ]
 
-            return SearchAnalyticsResponse(kpis=kpis, daily_trends=daily_trends)
+    # ROLE DISTRIBUTION ==========================================================================================
+    if role_filter:
+        role_distribution = [
+            UserActivityRoleDistribution(
+                role=role_filter,
+                count=total_users_count
+            )
+        ]
+    else:
+        role_counts = {}
+        for user in users:
+            role = user.get("role", "Unknown")
+            role_counts[role] = role_counts.get(role, 0) + 1
         
-        current_kpis = kpis_result.data[0]
-
-        avg_response_time_ms = float(current_kpis.get("avg_response_time_ms") or 0)
-        search_success_rate = float(current_kpis.get("success_rate") or 0)
-        zero_results_rate = float(current_kpis.get("zero_results_rate") or 0)
+        role_distribution = sorted(
+            [
+                UserActivityRoleDistribution(
+                    role=role,
+                    count=count
+                )
+                for role, count in role_counts.items()
+            ],
+            key=lambda x:x.count,
+            reverse=True
+        )
 
-        # Previous period
-        prev_kpis_result = supabase.rpc(
-            "get_search_analytics_kpis",
-            {
-                "start_date": prev_start_date.isoformat(),
-                "end_date": prev_end_date.isoformat(),
-                "user_role": role_filter
-            }
-        ).execute()
-        
-        if prev_kpis_result.data and len(prev_kpis_result.data) > 0:
-            prev_kpis = prev_kpis_result.data[0]
-            previous_avg_response_time_ms = float(prev_kpis.get("avg_response_time_ms") or 0)
-            previous_search_success_rate = float(prev_kpis.get("success_rate") or 0)
-            previous_zero_results_rate = float(prev_kpis.get("zero_results_rate") or 0)
-        else:
-            previous_avg_response_time_ms = 0.0
-            previous_search_success_rate = 0.0
-            previous_zero_results_rate = 0.0
+    return UserActivityResponse(kpis=kpis, most_active_users=most_active_users, role_distribution=role_distribution)
+
+# Queries each section reads, and the function that builds it from their results
+ANALYTICS_SECTIONS: Dict[str, Tuple[List[str], Callable[[Dict[str, Any], str, int], BaseModel]]] = {
+    "overview": (
+        ["daily_summary", "current_users", "previous_users"],
+        build_overview_analytics
+    ),
+    "search_analytics": (
+        ["current_search_kpis", "previous_search_kpis", "daily_search_trends"],
+        build_search_analytics
+    ),
+    "document_analytics": (
+        ["document_stats", "database_stats", "most_viewed"],
+        build_document_analytics
+    ),
+    "user_activity": (
+        ["daily_summary", "user_summary", "current_retention", "previous_retention"],
+        build_user_activity_analytics
+    )
+}
+
+# Function to compute several sections at once: runs the union of their queries concurrently, once
+async def compute_analytics_sections(sections: List[str], user_role: str, time_range: int, query_timings: Dict[str, float]) -> Dict[str, BaseModel]:
+    start_date, end_date = get_date_range(time_range)
+    print(f"Fetching analytics {sections} from {start_date} to {end_date} for role: {user_role}")
+
+    queries = build_analytics_queries(user_role, time_range)
+    planned = {name for section in sections for name in ANALYTICS_SECTIONS[section][0]}
+
+    results, timings = await run_queries({name: queries[name] for name in queries if name in planned})
+    query_timings.update(timings)
+
+    return {section: ANALYTICS_SECTIONS[section][1](results, user_role, time_range) for section in sections}
+
+# Function to compute the whole dashboard (called through the analytics cache)
+async def compute_dashboard_analytics(user_role: str, time_range: int, query_timings: Dict[str, float]) -> DashboardResponse:
+    sections = await compute_analytics_sections(list(ANALYTICS_SECTIONS), user_role, time_range, query_timings)
+    return DashboardResponse(**sections)
+
+# Helper function to get the (cached) dashboard that all report endpoints are served from
+async def get_dashboard(response: Response, user_role: str, time_range: int) -> DashboardResponse:
+    return await get_cached_analytics(response, "dashboard", user_role, time_range, compute_dashboard_analytics)
+
+# Endpoint to get all report sections in one request
+@router.get("/api/analytics/dashboard", response_model=DashboardResponse)
+async def get_dashboard_analytics(response: Response, user_role: str = "all", time_range: int = 30, current_user: UserContext = Depends(get_current_user)):
+    try:
+        # Only admin can view analytics
+        if current_user.role not in ["admin"]:
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
         
-        # Build KPI response
-        kpis = SearchAnalyticsKPIResponse(
-            avg_response_time_ms=avg_response_time_ms,
-            avg_response_time_display=format_response_time(avg_response_time_ms),
-            search_success_rate=search_success_rate,
-            zero_results_rate=zero_results_rate,
-            previous_avg_response_time_ms=previous_avg_response_time_ms,
-            previous_search_success_rate=previous_search_success_rate,
-            previous_zero_results_rate=previous_zero_results_rate
-        )
+        return await get_dashboard(response, user_role, time_range)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Dashboard analytics error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch dashboard analytics data")
 
-        # DAILY SEARCH TRENDS ==========================================================================================
-        trends_result = supabase.rpc(
-            "get_daily_search_trends",
-            {
-                "start_date": start_date.isoformat(),
-                "end_date": end_date.isoformat(),
-                "user_role": role_filter
-            }
-        ).execute()
+# Endpoint to get overview data
+@router.get("/api/analytics/overview", response_model=OverviewResponse)
+async def get_overview_analytics(response: Response, user_role: str = "all", time_range: int = 30, current_user: UserContext = Depends(get_current_user)):
+    try:
+        # Only admin can view analytics
+        if current_user.role not in ["admin"]:
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
         
-        daily_trends = []
-        for row in trends_result.data:
-            daily_trends.append(SearchAnalyticsDailySearchTrend(
-                label=row["day_label"],
-                totalSearches=int(row["total_searches"]),
-                successfulSearches=int(row["successful_searches"])
-            ))
+        return (await get_dashboard(response, user_role, time_range)).overview
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Analytics error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch analytics data")
+
+# Endpoint to get search analytics data
+@router.get("/api/analytics/search-analytics", response_model=SearchAnalyticsResponse)
+async def get_search_analytics(response: Response, user_role: str = "all", time_range: int = 30, current_user: UserContext = Depends(get_current_user)):
+    try:
+        # Only admin can view analytics
+        if current_user.role not in ["admin"]:
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
         
-        return SearchAnalyticsResponse(kpis=kpis, daily_trends=daily_trends)
+        return (await get_dashboard(response, user_role, time_range)).search_analytics
     except HTTPException:
         raise
     except Exception as e:
@@ -320,113 +678,13 @@ async def get_search_analytics(user_role: str = "all", time_range: int = 30, cur
 
 # Endpoint to get document analytics data
 @router.get("/api/analytics/document-analytics", response_model=DocumentAnalyticsResponse)
-async def get_document_analytics(user_role: str = "all", time_range: int = 30, current_user: UserContext = Depends(get_current_user)):
+async def get_document_analytics(response: Response, user_role: str = "all", time_range: int = 30, current_user: UserContext = Depends(get_current_user)):
     try:
         # Only admin can view analytics
         if current_user.role not in ["admin"]:
             raise HTTPException(status_code=403, detail="Insufficient permissions")
         
-        start_date, end_date = get_date_range(time_range)
-        role_filter = get_role_filter(user_role)
-        prev_start_date = start_date - timedelta(days=time_range)
-        prev_end_date = start_date - timedelta(days=1)
-
-        print(f"Fetching document analytics from {start_date} to {end_date} for role: {user_role}")
-
-        # KPI 1: TOTAL DOCUMENTS (MONGODB) ==========================================================================================
-        total_documents = company_documents_collection.count_documents({})
-
-        previous_total_documents = company_documents_collection.count_documents({
-            "upload_date": {"$lt": start_date.isoformat()}
-        })
-
-        # # KPI 2: % DOCUMENTS ACCESSED (SUPABASE) ==========================================================================================
-        # # Current period
-        # unique_docs_result = supabase.rpc(
-        #     "count_unique_documents_accessed",
-        #     {
-        #         "start_date": start_date.isoformat(),
-        #         "end_date": end_date.isoformat(),
-        #         "user_role": role_filter
-        #     }
-        # ).execute()
-
-        # unique_documents_accessed = unique_docs_result.data[0]["unique_documents_accessed"] if unique_docs_result.data else 0
-
-        # documents_accessed_percentage = round((unique_documents_accessed / total_documents * 100) if total_documents > 0 else 0, 2)
-
-        # # Previous period
-        # prev_unique_docs_result = supabase.rpc(
-        #     "count_unique_documents_accessed",
-        #     {
-        #         "start_date": prev_start_date.isoformat(),
-        #         "end_date": prev_end_date.isoformat(),
-        #         "user_role": role_filter
-        #     }
-        # ).execute()
-
-        # prev_unique_documents_accessed = prev_unique_docs_result.data[0]["unique_documents_accessed"] if prev_unique_docs_result.data else 0
-
-        # previous_documents_accessed_percentage = round((prev_unique_documents_accessed / previous_total_documents * 100) if previous_total_documents > 0 else 0, 2)
-
-        # KPI 3: STORAGE USED (MONGODB) ==========================================================================================
-        db_stats = db.command("dbStats")
-        #print(db_stats)
-        storage_used_bytes = db_stats.get("dataSize", 0) + db_stats.get("indexSize", 0)
-        storage_used_mb = format_bytes_to_mb(storage_used_bytes)
-
-        storage_limit_mb = 512.00
-
-        # Build KPI response
-        kpis = DocumentAnalyticsKPIResponse(
-            total_documents=total_documents,
-            # documents_accessed_percentage=documents_accessed_percentage,
-            storage_used_mb=storage_used_mb,
-            storage_limit_mb=storage_limit_mb,
-            previous_total_documents=previous_total_documents,
-            # previous_documents_accessed_percentage=previous_documents_accessed_percentage
-        )
-
-        # MOST VIEWED DOCUMENTS (SUPABASE) ==========================================================================================
-        most_viewed_result = supabase.rpc(
-            "get_most_viewed_documents",
-            {
-                "start_date": start_date.isoformat(),
-                "end_date": end_date.isoformat(),
-                "user_role": role_filter,
-                "limit_count": 5
-            }
-        ).execute()
-
-        most_viewed_documents = []
-        for row in most_viewed_result.data:
-            most_viewed_documents.append(DocumentAnalyticsMostViewedDocument(
-                filename=row["filename"] or "Unknown",
-                total_views=int(row["total_views"])
-            ))
-        
-        # CATEGORY DISTRIBUTION (MONGODB) ==========================================================================================
-        # Aggregate documents by tags
-        pipeline = [
-            {"$unwind": "$tags"},
-            {"$group": {
-                "_id": "$tags",
-                "count": {"$sum": 1}
-            }},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
-        ]
-
-        category_aggregation = list(company_documents_collection.aggregate(pipeline))
-
-        category_distribution = []
-        for cat in category_aggregation:
-            category_distribution.append(DocumentAnalyticsCategoryDistribution(
-                category=cat["_id"],
-                count=cat["count"]
-            ))
-
-        return DocumentAnalyticsResponse(kpis=kpis, most_viewed_documents=most_viewed_documents, category_distribution=category_distribution)
+        return (await get_dashboard(response, user_role, time_range)).document_analytics
     except HTTPException:
         raise
     except Exception as e:
@@ -435,146 +693,86 @@ async def get_document_analytics(user_role: str = "all", time_range: int = 30, c
 
 # Endpoint to get user activity data
 @router.get("/api/analytics/user-activity", response_model=UserActivityResponse)
-async def get_user_activity_analytics(user_role: str = "all", time_range: int = 30, current_user: UserContext = Depends(get_current_user)):
+async def get_user_activity_analytics(response: Response, user_role: str = "all", time_range: int = 30, current_user: UserContext = Depends(get_current_user)):
     try:
         # Only admin can view analytics
         if current_user.role not in ["admin"]:
             raise HTTPException(status_code=403, detail="Insufficient permissions")
         
-        start_date, end_date = get_date_range(time_range)
-        role_filter = get_role_filter(user_role)
-
-        print(f"Fetching user activity analytics from {start_date} to {end_date} for role: {user_role}")
-
-        # KPI 1: DAILY ACTIVE USERS ==========================================================================================
-        # Current period
-        dau_query = supabase.table("daily_analytics").select("active_users, date").gte("date", start_date.isoformat()).lte("date", end_date.isoformat())
-        if role_filter:
-            dau_query = dau_query.eq("user_role", role_filter)
-        dau_data = dau_query.execute()
-
-        if dau_data.data:
-            total_active = sum(row["active_users"] for row in dau_data.data)
-            num_days = len(set(row["date"] for row in dau_data.data))
-            daily_active_users = round(total_active / num_days, 1) if num_days > 0 else 0
-        else:
-            daily_active_users = 0
-
-        # Previous period
-        prev_start_date = start_date - timedelta(days=time_range)
-        prev_end_date = start_date - timedelta(days=1)
-
-        prev_dau_query = supabase.table("daily_analytics").select("active_users, date").gte("date", prev_start_date.isoformat()).lte("date", prev_end_date.isoformat())
-        if role_filter:
-            prev_dau_query = prev_dau_query.eq("user_role", role_filter)
-        previous_dau_data = prev_dau_query.execute()
-
-        if previous_dau_data.data:
-            prev_total_active = sum(row["active_users"] for row in previous_dau_data.data)
-            prev_num_days = len(set(row["date"] for row in previous_dau_data.data))
-            previous_daily_active_users = round(prev_total_active / prev_num_days, 1) if prev_num_days > 0 else 0
-        else:
-            previous_daily_active_users = 0
-        
-        # KPI 2: AVERAGE BADGES PER USER ==========================================================================================
-        users_query = supabase.table("user_activity_summary").select("*")
-        if role_filter:
-            users_query = users_query.eq("role", role_filter)
-        users_data = users_query.execute()
-
-        users = users_data.data or []
-        total_users_count = len(users)
-
-        if total_users_count > 0:
-            total_badges = sum(user.get("badges_earned", 0) for user in users)
-            average_badges_per_user = round(total_badges / total_users_count)
-        else:
-            average_badges_per_user = 0
-        
-        # KPI 3: USER RETENTION RATE ==========================================================================================
-        # Current period
-        retention_result = supabase.rpc(
-            "calculate_user_retention",
-            {
-                "start_date": start_date.isoformat(),
-                "end_date": end_date.isoformat(),
-                "user_role": role_filter
-            }
-        ).execute()
+        return (await get_dashboard(response, user_role, time_range)).user_activity
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"User activity analytics error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch user activity analytics data")
 
-        if retention_result.data and len(retention_result.data) > 0:
-            user_retention_rate = round(float(retention_result.data[0]["retention_rate"] or 0), 1)
-        else:
-            user_retention_rate = 0.0
+# Endpoint to get latency percentiles of endpoints and chat pipeline stages
+# current: since this process started, trend: persisted interval snapshots over the last time_range days
+@router.get("/api/analytics/latency", response_model=LatencyAnalyticsResponse)
+async def get_latency_analytics(time_range: int = 1, current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db)):
+    try:
+        # Only admin can view analytics
+        if current_user.role not in ["admin"]:
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
         
-        # Previous period
-        prev_retention_result = supabase.rpc(
-            "calculate_user_retention",
-            {
-                "start_date": prev_start_date.isoformat(),
-                "end_date": prev_end_date.isoformat(),
-                "user_role": role_filter
-            }
-        ).execute()
+        snapshots = await get_snapshots(db[LATENCY_SNAPSHOT_COLLECTION], datetime.now() - timedelta(days=time_range))
 
-        if prev_retention_result.data and len(prev_retention_result.data) > 0:
-            previous_user_retention_rate = float(prev_retention_result.data[0]["retention_rate"] or 0)
-        else:
-            previous_user_retention_rate = 0.0
-        
-        # Build KPI response
-        kpis = UserActivityKPIResponse(
-            daily_active_users=daily_active_users,
-            average_badges_per_user=average_badges_per_user,
-            user_retention_rate=user_retention_rate,
-            previous_daily_active_users=previous_daily_active_users,
-            previous_user_retention_rate=previous_user_retention_rate
+        return LatencyAnalyticsResponse(
+            since=latency_metrics.started_at,
+            current=[LatencyPercentiles(**metric) for metric in latency_metrics.get_summary()],
+            trend=[LatencySnapshot(**snapshot) for snapshot in snapshots]
         )
-        
-        # MOST ACTIVE USERS ==========================================================================================
-        most_active_users = [
-            UserActivityMostActiveUser(
-                user_id=user["user_id"],
-                name=f"{user.get('first_name', '')} {user.get('last_name', '')}".strip() or "Unknown User",
-                role=user.get("role", "Unknown"),
-                total_exp=user.get("total_exp", 0)
-            )
-            for user in sorted(
-                users,
-                key=lambda u: u.get("total_exp", 0),
-                reverse=True
-            )[:5]
-        ]
-
-        # ROLE DISTRIBUTION ==========================================================================================
-        if role_filter:
-            role_distribution = [
-                UserActivityRoleDistribution(
-                    role=role_filter,
-                    count=total_users_count
-                )
-            ]
-        else:
-            role_counts = {}
-            for user in users:
-                role = user.get("role", "Unknown")
-                role_counts[role] = role_counts.get(role, 0) + 1
-            
-            role_distribution = sorted(
-                [
-                    UserActivityRoleDistribution(
-                        role=role,
-                        count=count
-                    )
-                    for role, count in role_counts.items()
-                ],
-                key=lambda x:x.count,
-                reverse=True
-            )
-
-        return UserActivityResponse(kpis=kpis, most_active_users=most_active_users, role_distribution=role_distribution)
     except HTTPException:
         raise
     except Exception as e:
-        print(f"User activity analytics error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to fetch user activity analytics data")
\ No newline at end of file
+        print(f"Latency analytics error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch latency analytics data")
+
+# Endpoint to purge cached analytics (admin only)
+# Every section is cached inside the one dashboard entry, so there is nothing to purge per section
+@router.delete("/api/analytics/cache")
+async def purge_analytics_cache(current_user: UserContext = Depends(get_current_user)):
+    if current_user.role not in ["admin"]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    purged = await analytics_cache.purge()
+    return {
+        "message": "Analytics cache purged",
+        "purged_entries": purged
+    }
+
+# Endpoint to export raw activity or search history (admin only)
+# Streams CSV or NDJSON page by page, optionally zstd compressed, e.g. /api/analytics/export?dataset=searches&format=ndjson&compress=true
+@router.get("/api/analytics/export")
+async def export_analytics(
+    dataset: str = "activity",
+    format: str = "csv",
+    compress: bool = False,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: UserContext = Depends(get_current_user),
+    supabase: AsyncClient = Depends(get_supabase)
+):
+    if current_user.role not in ["admin"]:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    # Validate before streaming starts, errors can't change the status code afterwards
+    if dataset not in EXPORT_DATASETS:
+        raise HTTPException(status_code=400, detail=f"Invalid dataset, expected one of: {', '.join(EXPORT_DATASETS)}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format, expected one of: {', '.join(EXPORT_FORMATS)}")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    
+    filename = f"{dataset}_{start_date or 'start'}_{end_date or 'now'}.{format}"
+    media_type = EXPORT_FORMATS[format]
+    if compress:
+        filename += ".zst"
+        media_type = "application/zstd"
+
+    # An async iterator: each page is fetched from Supabase only when the previous one has been sent
+    return StreamingResponse(
+        iter_export(supabase, dataset, format, compress, start_date, end_date),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
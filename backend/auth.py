@@ -3,6 +3,7 @@ import os
 from pydantic import BaseModel
 from fastapi import Header, HTTPException
 from typing import Optional
+from tracing import traced
 import jwt
 
 # Load environment variables
@@ -33,6 +34,13 @@ class UserContext(BaseModel):
 # Authentication dependency
 async def get_current_user(authorization: Optional[str] = Header(None)) -> UserContext:
     """ Extract and verify JWT token from Authorization header"""
+    with traced("auth.get_current_user") as span:
+        user = authenticate(authorization)
+        span.set_attribute("els.user_role", user.role)
+        span.set_attribute("els.access_level", user.min_access_level)
+        return user
+
+def authenticate(authorization: Optional[str]) -> UserContext:
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing authorization header")
     
@@ -0,0 +1,131 @@
+from pymongo import MongoClient, AsyncMongoClient, ASCENDING
+from datetime import datetime
+import argparse
+import asyncio
+import statistics
+import time
+
+# Before/after benchmark for the document endpoints' MongoDB access.
+# Simulates concurrent requests running the listing query (find + sort + limit) and a find_one per request:
+#   sync:  the old way, a blocking MongoClient called straight from coroutines (each call stalls the event loop)
+#   async: the AsyncMongoClient with the pool settings from mongo.py
+# Reports throughput, request latency percentiles and the worst event loop lag seen by a heartbeat task.
+#
+# Run against a local mongod (it seeds and drops its own database):
+#   python benchmarks/mongo_async_concurrency.py --uri mongodb://localhost:27017/ --requests 2000 --concurrency 100
+
+DATABASE_NAME = "els_benchmark"
+SEED_DOCUMENTS = 5000
+PAGE_SIZE = 10
+HEARTBEAT_INTERVAL = 0.005
+
+def seed(uri: str):
+    client = MongoClient(uri)
+    collection = client[DATABASE_NAME]["company_documents"]
+    collection.drop()
+    collection.insert_many([
+        {
+            "filename": f"document_{i:05d}.pdf",
+            "tags": ["HR", "IT", "Policies"][i % 3:i % 3 + 1],
+            "access_level": "internal",
+            "access_level_num": i % 4,
+            "upload_date": datetime.now(),
+            "size": "1.0 MB"
+        }
+        for i in range(SEED_DOCUMENTS)
+    ])
+    collection.create_index(
+        [("filename", ASCENDING), ("_id", ASCENDING), ("access_level_num", ASCENDING)],
+        name="filename_id_access_level"
+    )
+    ids = collection.distinct("_id")
+    client.close()
+    return ids
+
+def drop(uri: str):
+    client = MongoClient(uri)
+    client.drop_database(DATABASE_NAME)
+    client.close()
+
+async def measure_loop_lag(stop: asyncio.Event) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        expected = time.perf_counter() + HEARTBEAT_INTERVAL
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        worst = max(worst, time.perf_counter() - expected)
+    return worst * 1000
+
+async def run(mode: str, uri: str, ids: list, requests: int, concurrency: int, pool_size: int) -> dict:
+    if mode == "sync":
+        client = MongoClient(uri, maxPoolSize=pool_size)
+    else:
+        client = AsyncMongoClient(uri, maxPoolSize=pool_size, minPoolSize=min(5, pool_size))
+    collection = client[DATABASE_NAME]["company_documents"]
+
+    async def request(i: int):
+        query = {"access_level_num": {"$lte": 2}}
+        cursor = collection.find(query).sort([("filename", ASCENDING), ("_id", ASCENDING)]).skip(i % 100).limit(PAGE_SIZE + 1)
+        if mode == "sync":
+            list(cursor)
+            collection.find_one({"_id": ids[i % len(ids)]})
+        else:
+            await cursor.to_list()
+            await collection.find_one({"_id": ids[i % len(ids)]})
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await request(i)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    # Warm the pool so connection setup is not measured
+    await asyncio.gather(*(request(i) for i in range(min(concurrency, pool_size))))
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    max_lag_ms = await lag_task
+
+    if mode == "sync":
+        client.close()
+    else:
+        await client.close()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "throughput": requests / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "max_loop_lag_ms": max_lag_ms
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare sync and async MongoDB clients under concurrent requests")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--pool-size", type=int, default=50)
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded database")
+    args = parser.parse_args()
+
+    ids = seed(args.uri)
+    try:
+        results = [
+            asyncio.run(run(mode, args.uri, ids, args.requests, args.concurrency, args.pool_size))
+            for mode in ("sync", "async")
+        ]
+    finally:
+        if not args.keep:
+            drop(args.uri)
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, pool size {args.pool_size}")
+    print(f"{'mode':<6} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'max loop lag ms':>16}")
+    for result in results:
+        print(f"{result['mode']:<6} {result['throughput']:>10.1f} {result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f} {result['max_loop_lag_ms']:>16.1f}")
@@ -0,0 +1,90 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Cold start benchmark for the API process.
+# Every measurement runs in a fresh interpreter (nothing cached in sys.modules), from the backend directory:
+#   import:   wall time of "import main" (what every uvicorn worker pays before serving anything)
+#   lifespan: time for the app lifespan to create the shared clients and start the background tasks
+#             (--lifespan, needs the .env services to be reachable)
+# and a python -X importtime breakdown of the slowest top-level packages.
+#
+#   python benchmarks/startup_time.py --runs 5 --lifespan
+# Run it on the previous commit as well (git stash / git checkout) to compare before and after.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started)
+"""
+
+LIFESPAN_SNIPPET = """
+import asyncio
+import time
+import main
+
+async def start():
+    started = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        print(time.perf_counter() - started)
+
+asyncio.run(start())
+"""
+
+def run_snippet(snippet: str) -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", snippet],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1]) * 1000
+
+def import_breakdown(top: int) -> list:
+    """
+    Cumulative import time of each package main imports, slowest first
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nesting is shown by indentation, keep what main (depth 0) imports directly
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth != 1:
+            continue
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(cumulative) / 1000
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+def summarise(label: str, values: list):
+    print(f"{label:<10} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms   max {max(values):8.1f} ms   ({len(values)} runs)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import and startup time of the API process")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--lifespan", action="store_true", help="Also time the lifespan startup (connects to the configured services)")
+    parser.add_argument("--top", type=int, default=15, help="Packages to list in the import breakdown")
+    args = parser.parse_args()
+
+    summarise("import", [run_snippet(IMPORT_SNIPPET) for _ in range(args.runs)])
+    if args.lifespan:
+        summarise("lifespan", [run_snippet(LIFESPAN_SNIPPET) for _ in range(args.runs)])
+
+    print("\nSlowest imports (cumulative ms, one run):")
+    for package, milliseconds in import_breakdown(args.top):
+        print(f"  {package:<30} {milliseconds:8.1f}")
@@ -0,0 +1,121 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from supabase import create_client
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from supabase_client import create_http_client, create_supabase_client
+
+# Load test for the shared async Supabase client (supabase_client.py).
+# Simulates concurrent FAQ list requests the way the endpoints make them:
+#   sync:  the old way, a synchronous client whose .execute() is called straight from coroutines
+#   async: the shared AsyncClient with its pooled HTTP/2 httpx client, awaited
+# Reports throughput and request latency percentiles for both.
+#
+# By default it starts a local PostgREST stand-in answering every request with a fixed FAQ list after
+# --latency-ms, so the numbers reflect the client side only. Point --url/--key at a real PostgREST or a
+# local Supabase stack instead to include HTTP/2 (negotiated over TLS) and real query times:
+#   python benchmarks/supabase_async_load.py --requests 500 --concurrency 50
+#   python benchmarks/supabase_async_load.py --url https://<project>.supabase.co --key <service key>
+
+STAND_IN_KEY = "stand.in.key" # Shaped like a JWT so the client accepts it
+STAND_IN_ROWS = [
+    {"id": str(i), "question": f"Question {i}", "answer": "Answer", "category": "General", "access_level": "public", "access_level_num": 0}
+    for i in range(20)
+]
+
+def start_stand_in(latency_ms: float) -> ThreadingHTTPServer:
+    body = json.dumps(STAND_IN_ROWS).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency_ms / 1000)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+async def run(mode: str, url: str, key: str, requests: int, concurrency: int) -> dict:
+    http_client = None
+    if mode == "sync":
+        supabase = create_client(url, key)
+    else:
+        http_client = create_http_client()
+        supabase = await create_supabase_client(http_client, url, key)
+
+    async def request():
+        query = supabase.table("faqs").select("*").lte("access_level_num", 2).order("category").order("created_at")
+        if mode == "sync":
+            query.execute()
+        else:
+            await query.execute()
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed():
+        async with semaphore:
+            started = time.perf_counter()
+            await request()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    # Warm up connections so setup is not measured
+    await asyncio.gather(*(request() for _ in range(min(concurrency, 10))))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    if http_client is not None:
+        await http_client.aclose()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "throughput": requests / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the sync and shared async Supabase clients under concurrent requests")
+    parser.add_argument("--url", help="PostgREST/Supabase URL (default: local stand-in)")
+    parser.add_argument("--key", default=STAND_IN_KEY)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=20, help="Stand-in response time")
+    args = parser.parse_args()
+
+    url = args.url
+    server = None
+    if not url:
+        server = start_stand_in(args.latency_ms)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    try:
+        results = [asyncio.run(run(mode, url, args.key, args.requests, args.concurrency)) for mode in ("sync", "async")]
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, against {url}")
+    print(f"{'mode':<6} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for result in results:
+        print(f"{result['mode']:<6} {result['throughput']:>10.1f} {result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f}")
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from supabase import create_client
+import argparse
+import os
+import sys
+
+# Concurrency check for the track_activity Postgres function (backend/sql/001_track_activity.sql).
+# Fires N concurrent "question_asked" events for one user and verifies that questions_asked and
+# total_exp grew by exactly N and N * EXP. With --legacy it runs the old select-then-update
+# sequence instead, which loses increments under the same load.
+#
+# Run against a development Supabase project with a throwaway user:
+#   python benchmarks/track_activity_concurrency.py --user-id <uuid> --events 50 --workers 20
+
+EXP_PER_QUESTION = 10
+
+def get_stats(supabase, user_id: str) -> dict:
+    return supabase.table("user_gamification").select("*").eq("user_id", user_id).single().execute().data
+
+def track_atomic(supabase, user_id: str):
+    supabase.rpc("track_activity", {
+        "p_user_id": user_id,
+        "p_activity_type": "question_asked",
+        "p_exp_earned": EXP_PER_QUESTION,
+        "p_metadata": {"source": "concurrency_check"}
+    }).execute()
+
+def track_legacy(supabase, user_id: str):
+    stats = get_stats(supabase, user_id)
+    supabase.table("user_gamification").update({
+        "total_exp": stats["total_exp"] + EXP_PER_QUESTION,
+        "questions_asked": stats["questions_asked"] + 1
+    }).eq("user_id", user_id).execute()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify track_activity loses no increments under concurrency")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--legacy", action="store_true", help="Use the old read-modify-write sequence")
+    args = parser.parse_args()
+
+    load_dotenv()
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SECRET_KEY"))
+
+    # Make sure the stats row exists before measuring
+    track_atomic(supabase, args.user_id)
+    before = get_stats(supabase, args.user_id)
+
+    track = track_legacy if args.legacy else track_atomic
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(lambda _: track(supabase, args.user_id), range(args.events)))
+
+    after = get_stats(supabase, args.user_id)
+    questions_delta = after["questions_asked"] - before["questions_asked"]
+    exp_delta = after["total_exp"] - before["total_exp"]
+
+    print(f"Events sent:          {args.events}")
+    print(f"questions_asked grew: {questions_delta}")
+    print(f"total_exp grew:       {exp_delta} (expected at least {args.events * EXP_PER_QUESTION}, badge bonuses may add more)")
+
+    if questions_delta != args.events or exp_delta < args.events * EXP_PER_QUESTION:
+        print(f"LOST UPDATES: {args.events - questions_delta} increment(s) missing")
+        sys.exit(1)
+    print("OK: no lost increments")
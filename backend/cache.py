@@ -0,0 +1,217 @@
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+import asyncio
+import os
+import uuid
+import orjson
+
+# Two-tier cache shared by every uvicorn worker (and every instance) of the API.
+#   Tier 1: in-process LRU with a TTL, one per namespace. No I/O and no serialisation.
+#   Tier 2: a Redis-protocol server (REDIS_URL), optional. Values are stored as orjson with the same TTL,
+#           so a value computed by one worker is a hit for all the others.
+# Keys are namespaced as els:<namespace>:<key parts joined by ":">.
+# delete and clear remove keys from Redis and publish on CACHE_INVALIDATION_CHANNEL, every worker's
+# listener then drops them from its local tier. Values must be JSON-like (dicts, lists, strings, numbers):
+# what comes back from Redis is the orjson round trip.
+# Without REDIS_URL only the local tier is used. REDIS_URL=fakeredis:// uses an in-process fakeredis server
+# shared by every backend of the process (tests and single-process local runs, needs the fakeredis package
+# from requirements-dev.txt; see tests/test_cache.py). Redis errors never fail a request, the shared tier
+# is just skipped.
+load_dotenv()
+REDIS_URL = os.getenv("REDIS_URL")
+
+KEY_PREFIX = "els"
+CACHE_INVALIDATION_CHANNEL = "els:cache:invalidate"
+REDIS_TIMEOUT_SECONDS = 0.5
+LISTENER_RETRY_SECONDS = 1
+CLEAR_BATCH_SIZE = 500
+
+_MISSING = object()
+_fake_server = None
+
+def _escape_pattern(text: str) -> str:
+    for char in "\\*?[]":
+        text = text.replace(char, "\\" + char)
+    return text
+
+class CacheBackend:
+    """
+    The Redis connection and invalidation listener shared by all TieredCache namespaces
+    """
+    def __init__(self):
+        self.redis = None
+        self.instance_id = uuid.uuid4().hex
+        self.namespaces: Dict[str, "TieredCache"] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, url: Optional[str] = REDIS_URL):
+        """
+        Connect the shared tier and start listening for invalidations (called from the app lifespan)
+        """
+        if not url:
+            return
+        if url.startswith("fakeredis://"):
+            from fakeredis import FakeAsyncRedis, FakeServer
+            global _fake_server
+            if _fake_server is None:
+                _fake_server = FakeServer()
+            self.redis = FakeAsyncRedis(server=_fake_server)
+        else:
+            import redis.asyncio as redis
+            self.redis = redis.from_url(url, socket_timeout=REDIS_TIMEOUT_SECONDS, socket_connect_timeout=REDIS_TIMEOUT_SECONDS, health_check_interval=30)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            self._listener = None
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+
+    async def publish(self, namespace: str, key: Optional[str] = None, prefix: Optional[str] = None):
+        if self.redis is None:
+            return
+        message = {"origin": self.instance_id, "namespace": namespace, "key": key, "prefix": prefix}
+        try:
+            await self.redis.publish(CACHE_INVALIDATION_CHANNEL, orjson.dumps(message))
+        except Exception as e:
+            print(f"Cache invalidation publish error: {e}")
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                # Invalidations may have been missed while disconnected
+                for cache in self.namespaces.values():
+                    cache.drop_local()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    data = orjson.loads(message["data"])
+                    cache = self.namespaces.get(data["namespace"])
+                    if cache is not None and data["origin"] != self.instance_id:
+                        cache.drop_local(data.get("key"), data.get("prefix"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Cache invalidation listener error: {e}")
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(LISTENER_RETRY_SECONDS)
+
+cache_backend = CacheBackend()
+
+class TieredCache:
+    def __init__(self, namespace: str, ttl_seconds: float, maxsize: int = 1024, backend: CacheBackend = cache_backend):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        backend.namespaces[namespace] = self
+
+    def make_key(self, key: Hashable) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        return ":".join([KEY_PREFIX, self.namespace, *(str(part) for part in parts)])
+
+    def drop_local(self, key: Optional[str] = None, prefix: Optional[str] = None):
+        """
+        Drop one full key, every key starting with prefix, or everything from this worker's tier
+        """
+        if key is not None:
+            self._local.pop(key, None)
+        elif prefix is not None:
+            for local_key in [k for k in self._local if k.startswith(prefix)]:
+                self._local.pop(local_key, None)
+        else:
+            self._local.clear()
+
+    async def get(self, key: Hashable) -> Any:
+        """
+        Cached value or None
+        """
+        full_key = self.make_key(key)
+        value = self._local.get(full_key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        redis = self.backend.redis
+        if redis is None:
+            return None
+        try:
+            raw = await redis.get(full_key)
+        except Exception as e:
+            print(f"Cache read error ({self.namespace}): {e}")
+            return None
+        if raw is None:
+            return None
+        value = orjson.loads(raw)
+        self._local[full_key] = value
+        return value
+
+    async def set(self, key: Hashable, value: Any):
+        full_key = self.make_key(key)
+        self._local[full_key] = value
+
+        redis = self.backend.redis
+        if redis is None:
+            return
+        try:
+            await redis.set(full_key, orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS), ex=max(1, int(self.ttl_seconds)))
+        except Exception as e:
+            print(f"Cache write error ({self.namespace}): {e}")
+
+    async def get_or_set(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = await self.get(key)
+        if value is None:
+            value = await compute()
+            await self.set(key, value)
+        return value
+
+    async def delete(self, key: Hashable):
+        """
+        Remove a key from both tiers in every worker
+        """
+        full_key = self.make_key(key)
+        self._local.pop(full_key, None)
+
+        redis = self.backend.redis
+        if redis is None:
+            return
+        try:
+            await redis.delete(full_key)
+        except Exception as e:
+            print(f"Cache delete error ({self.namespace}): {e}")
+        await self.backend.publish(self.namespace, key=full_key)
+
+    async def clear(self, prefix: Optional[Hashable] = None) -> int:
+        """
+        Remove every key of the namespace, or those whose key starts with the given part(s), in every worker
+        Returns the number of keys removed (from Redis when it is used, otherwise from this worker)
+        """
+        full_prefix = self.make_key(prefix) + ":" if prefix is not None else self.make_key(()) + ":"
+        local_count = sum(1 for k in self._local if k.startswith(full_prefix))
+        self.drop_local(prefix=full_prefix)
+
+        redis = self.backend.redis
+        if redis is None:
+            return local_count
+        removed = 0
+        try:
+            batch = []
+            async for redis_key in redis.scan_iter(match=_escape_pattern(full_prefix) + "*", count=CLEAR_BATCH_SIZE):
+                batch.append(redis_key)
+                if len(batch) >= CLEAR_BATCH_SIZE:
+                    removed += await redis.unlink(*batch)
+                    batch = []
+            if batch:
+                removed += await redis.unlink(*batch)
+        except Exception as e:
+            print(f"Cache clear error ({self.namespace}): {e}")
+        await self.backend.publish(self.namespace, prefix=full_prefix)
+        return removed
@@ -0,0 +1,172 @@
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Iterable, List
+from pymongo.errors import DuplicateKeyError
+from mongo import run_sync_in_thread
+import asyncio
+
+# Incrementally maintained document statistics.
+# A single document in document_stats is kept current with $inc by upload, delete and metadata updates,
+# so analytics reads one small document instead of running dbStats, counts and a $unwind over all tags:
+#   total_documents, total_bytes (original PDF sizes), stored_bytes (bytes held in GridFS)
+#   tags: {tag: document count}
+#   uploads_by_day: {"YYYY-MM-DD": documents uploaded that day, UTC dates like the analytics windows}
+# Tags are user supplied, so they are escaped before being used as field names (empty tags are skipped).
+# A periodic rebuild from company_documents corrects any drift (crashes between writes, racing deletes,
+# files recompressed by storage.py).
+DOCUMENT_STATS_COLLECTION = "document_stats"
+DOCUMENT_STATS_ID = "global"
+DOCUMENT_STATS_RECONCILE_SECONDS = 3600
+
+def escape_field_name(name: str) -> str:
+    """
+    Make a value safe as a MongoDB field name ("." and a leading "$" are not allowed)
+    """
+    return name.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+def unescape_field_name(name: str) -> str:
+    return name.replace("%24", "$").replace("%2E", ".").replace("%25", "%")
+
+def _upload_day(document: dict) -> str:
+    upload_date = document.get("upload_date")
+    if not isinstance(upload_date, datetime):
+        return "unknown"
+    # upload_date is stored as naive server local time, astimezone treats naive values as local
+    return upload_date.astimezone(timezone.utc).strftime("%Y-%m-%d")
+
+def _tags(tags) -> set:
+    """
+    Distinct non-empty tags (an empty name would make an invalid field path)
+    """
+    return {tag for tag in tags or [] if tag}
+
+def _stored_bytes(document: dict) -> int:
+    return document.get("stored_size_bytes") or document.get("size_bytes") or 0
+
+def _apply_increments(stats_collection, increments: dict):
+    increments = {field: amount for field, amount in increments.items() if amount}
+    if not increments:
+        return
+    stats_collection.update_one(
+        {"_id": DOCUMENT_STATS_ID},
+        {"$inc": increments, "$set": {"updated_at": datetime.now()}},
+        upsert=True
+    )
+
+def _document_increments(documents: Iterable[dict], sign: int) -> dict:
+    increments = Counter()
+    for document in documents:
+        increments["total_documents"] += sign
+        increments["total_bytes"] += sign * (document.get("size_bytes") or 0)
+        increments["stored_bytes"] += sign * _stored_bytes(document)
+        increments[f"uploads_by_day.{_upload_day(document)}"] += sign
+        for tag in _tags(document.get("tags")):
+            increments[f"tags.{escape_field_name(tag)}"] += sign
+    return increments
+
+def record_uploads(stats_collection, documents: List[dict]):
+    """
+    Count newly stored documents (needs tags, size_bytes, stored_size_bytes, upload_date)
+    """
+    _apply_increments(stats_collection, _document_increments(documents, 1))
+
+def record_deletes(stats_collection, documents: List[dict]):
+    """
+    Remove deleted documents from the counts (same fields as record_uploads)
+    """
+    _apply_increments(stats_collection, _document_increments(documents, -1))
+
+def record_tag_change(stats_collection, old_tags: List[str], new_tags: List[str]):
+    """
+    Move one document from its old tags to its new ones
+    """
+    old_tags, new_tags = _tags(old_tags), _tags(new_tags)
+    increments = {f"tags.{escape_field_name(tag)}": -1 for tag in old_tags - new_tags}
+    increments.update({f"tags.{escape_field_name(tag)}": 1 for tag in new_tags - old_tags})
+    _apply_increments(stats_collection, increments)
+
+def _format_stats(stats: dict) -> dict:
+    return {
+        "total_documents": stats.get("total_documents", 0),
+        "total_bytes": stats.get("total_bytes", 0),
+        "stored_bytes": stats.get("stored_bytes", 0),
+        "tags": {unescape_field_name(tag): count for tag, count in (stats.get("tags") or {}).items() if count > 0},
+        "uploads_by_day": {day: count for day, count in (stats.get("uploads_by_day") or {}).items() if count > 0},
+        "updated_at": stats.get("updated_at"),
+        "reconciled_at": stats.get("reconciled_at")
+    }
+
+def get_document_stats(stats_collection) -> dict:
+    """
+    Current stats with tag names unescaped, empty counts if nothing was recorded yet
+    """
+    return _format_stats(stats_collection.find_one({"_id": DOCUMENT_STATS_ID}) or {})
+
+async def get_document_stats_async(stats_collection) -> dict:
+    """
+    Same as get_document_stats for an AsyncMongoClient collection
+    """
+    return _format_stats(await stats_collection.find_one({"_id": DOCUMENT_STATS_ID}) or {})
+
+def rebuild_document_stats(company_documents_collection, stats_collection) -> dict:
+    """
+    Recompute the stats from company_documents, replace the stored document and report the drift found.
+    The replace only applies if no increment landed since the scan started (updated_at unchanged),
+    otherwise it is skipped ("applied": False) and the next run tries again.
+    """
+    # Read before the scan: increments made during it may or may not be reflected in the scan
+    previous_raw = stats_collection.find_one({"_id": DOCUMENT_STATS_ID}) or {}
+    previous = _format_stats(previous_raw)
+
+    totals = {"total_documents": 0, "total_bytes": 0, "stored_bytes": 0}
+    tags = Counter()
+    uploads_by_day = Counter()
+
+    projection = {"tags": 1, "size_bytes": 1, "stored_size_bytes": 1, "upload_date": 1}
+    for document in company_documents_collection.find({}, projection):
+        totals["total_documents"] += 1
+        totals["total_bytes"] += document.get("size_bytes") or 0
+        totals["stored_bytes"] += _stored_bytes(document)
+        uploads_by_day[_upload_day(document)] += 1
+        for tag in _tags(document.get("tags")):
+            tags[tag] += 1
+
+    drift = {field: total - previous[field] for field, total in totals.items()}
+    drift["tags"] = sum(
+        abs(tags.get(tag, 0) - previous["tags"].get(tag, 0))
+        for tag in set(tags) | set(previous["tags"])
+    )
+
+    now = datetime.now()
+    try:
+        result = stats_collection.replace_one(
+            {"_id": DOCUMENT_STATS_ID, "updated_at": previous_raw.get("updated_at")},
+            {
+                **totals,
+                "tags": {escape_field_name(tag): count for tag, count in tags.items()},
+                "uploads_by_day": dict(uploads_by_day),
+                "updated_at": now,
+                "reconciled_at": now
+            },
+            upsert=True
+        )
+        applied = result.matched_count > 0 or result.upserted_id is not None
+    except DuplicateKeyError:
+        # The document changed (or was created by a first increment) during the scan
+        applied = False
+    return {**totals, "drift": drift, "applied": applied}
+
+async def run_document_stats_reconciler(company_documents_collection, stats_collection, interval_seconds: float = DOCUMENT_STATS_RECONCILE_SECONDS):
+    """
+    Background loop rebuilding the stats until cancelled (the first run also creates them)
+    """
+    while True:
+        try:
+            report = await run_sync_in_thread(rebuild_document_stats, company_documents_collection, stats_collection)
+            if not report["applied"]:
+                print("Document stats rebuild skipped, stats changed during the scan")
+            elif any(report["drift"].values()):
+                print(f"Document stats drift corrected: {report['drift']}")
+        except Exception as e:
+            print(f"Document stats reconciler error: {e}")
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,112 @@
+from datetime import date, timedelta
+from typing import AsyncIterator, List, Optional
+import csv
+import io
+import json
+import zstandard as zstd
+
+# Streaming bulk export of activity_log for offline analysis.
+# Rows are read from Supabase (async client) in pages with keyset pagination on (created_at, id), so every page is an
+# index range scan no matter how deep into the export it is, and each page is serialised and handed to
+# the response before the next one is fetched. Memory stays at one page regardless of the date range.
+EXPORT_PAGE_SIZE = 1000
+
+# Dataset -> table columns (PostgREST select, JSON paths flattened server-side), output columns and fixed filters
+EXPORT_DATASETS = {
+    "activity": {
+        "select": "id,user_id,activity_type,exp_earned,metadata,created_at",
+        "columns": ["id", "user_id", "activity_type", "exp_earned", "metadata", "created_at"],
+        "filters": {}
+    },
+    # Search history: questions asked in the AI assistant, with the details the frontend tracks
+    "searches": {
+        "select": (
+            "id,user_id,created_at,"
+            "question:metadata->>question,"
+            "response_time_ms:metadata->>response_time_ms,"
+            "success:metadata->>success,"
+            "sources_count:metadata->>sources_count,"
+            "streaming:metadata->>streaming"
+        ),
+        "columns": ["id", "user_id", "created_at", "question", "response_time_ms", "success", "sources_count", "streaming"],
+        "filters": {"activity_type": "question_asked"}
+    }
+}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"
+}
+
+async def iter_export_pages(supabase, dataset: str, start_date: Optional[date] = None, end_date: Optional[date] = None, page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[List[dict]]:
+    """
+    Yield pages of activity_log rows ordered by (created_at, id), end_date inclusive
+    """
+    spec = EXPORT_DATASETS[dataset]
+    last_row = None
+
+    while True:
+        query = supabase.table("activity_log").select(spec["select"])
+        for column, value in spec["filters"].items():
+            query = query.eq(column, value)
+        if start_date:
+            query = query.gte("created_at", start_date.isoformat())
+        if end_date:
+            query = query.lt("created_at", (end_date + timedelta(days=1)).isoformat())
+        if last_row:
+            # Continue strictly after the last row of the previous page
+            created_at, row_id = last_row["created_at"], last_row["id"]
+            query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt."{row_id}")')
+
+        rows = (await query.order("created_at").order("id").limit(page_size).execute()).data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last_row = rows[-1]
+
+async def iter_csv(pages: AsyncIterator[List[dict]], columns: List[str]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+
+    async for page in pages:
+        for row in page:
+            writer.writerow([
+                json.dumps(row.get(column)) if isinstance(row.get(column), (dict, list)) else row.get(column)
+                for column in columns
+            ])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    # Header only, when there were no rows
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+async def iter_ndjson(pages: AsyncIterator[List[dict]], columns: List[str]) -> AsyncIterator[bytes]:
+    async for page in pages:
+        yield "".join(
+            json.dumps({column: row.get(column) for column in columns}, default=str) + "\n"
+            for row in page
+        ).encode("utf-8")
+
+async def iter_zstd(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Compress a byte stream into a single zstd frame, chunk by chunk
+    """
+    compressor = zstd.ZstdCompressor(level=3).compressobj()
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def iter_export(supabase, dataset: str, export_format: str, compress: bool = False, start_date: Optional[date] = None, end_date: Optional[date] = None) -> AsyncIterator[bytes]:
+    """
+    The full export body: pages serialised as CSV or NDJSON, optionally zstd compressed
+    """
+    pages = iter_export_pages(supabase, dataset, start_date, end_date)
+    serialise = iter_csv if export_format == "csv" else iter_ndjson
+    chunks = serialise(pages, EXPORT_DATASETS[dataset]["columns"])
+    return iter_zstd(chunks) if compress else chunks
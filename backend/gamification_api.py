@@ -1,19 +1,24 @@
-from fastapi import APIRouter, HTTPException, Depends
-from supabase import Client
-from typing import Optional
-import os
+from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import JSONResponse, Response
+from supabase import AsyncClient
+from typing import Optional, List
+import json
+import hashlib
+import asyncio
+import uuid
 from dotenv import load_dotenv
 from datetime import datetime, timezone
+from auth import UserContext, get_current_user
+from activity_buffer import ActivityBuffer
+from leaderboard import leaderboard
+from tracing import traced
+from supabase_client import get_supabase
+from cache import TieredCache
 
 load_dotenv()
 router = APIRouter()
 
-# Supabase client setup
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_secret_key = os.getenv("SUPABASE_SECRET_KEY")
-
-from supabase import create_client
-supabase: Client = create_client(supabase_url, supabase_secret_key)
+# Supabase: shared async client created by the app lifespan (see supabase_client.py)
 
 # EXP rewards for different actions
 EXP_REWARDS = {
@@ -23,152 +28,256 @@ EXP_REWARDS = {
     "document_viewed_thinkinsight": 5
 }
 
-async def track_activity(user_id: str, activity_type: str, metadata: Optional[dict] = None):
+# Badge definitions rarely change, keep them cached (shared by all workers, see cache.py) and re-read at most every few minutes
+BADGE_CATALOGUE_TTL_SECONDS = 300
+
+# Stat each badge requirement_type is checked against
+REQUIREMENT_STATS = {
+    "questions_asked": "questions_asked",
+    "documents_viewed": "documents_viewed",
+    "bookmarks_created": "bookmarks_created",
+    "level_reached": "level",
+    "documents_viewed_thinkinsight": "documents_viewed_thinkinsight"
+}
+
+# Requirement types each activity can move forward (every activity earns EXP, so level can change too)
+ACTIVITY_REQUIREMENT_TYPES = {
+    "question_asked": ["questions_asked", "level_reached"],
+    "document_viewed": ["documents_viewed", "level_reached"],
+    "bookmark_created": ["bookmarks_created", "level_reached"],
+    "document_viewed_thinkinsight": ["documents_viewed_thinkinsight", "level_reached"]
+}
+
+class BadgeCatalogue:
     """
-    Track user activity and award EXP
+    Cached copy of the badges table with a TTL, indexed by requirement_type
     """
-    try:
-        # Get current user stats
-        result = supabase.table("user_gamification")\
+    def __init__(self, ttl_seconds: int = BADGE_CATALOGUE_TTL_SECONDS):
+        self.cache = TieredCache("badge_catalogue", ttl_seconds=ttl_seconds, maxsize=1)
+        self.badges: List[dict] = []
+        self.by_requirement_type: dict = {}
+
+    @staticmethod
+    async def _load() -> List[dict]:
+        result = await get_supabase().table("badges")\
             .select("*")\
-            .eq("user_id", user_id)\
-            .single()\
+            .order("created_at")\
             .execute()
+        return result.data or []
+
+    async def _ensure_fresh(self):
+        badges = await self.cache.get_or_set("all", self._load)
+        if badges is self.badges:
+            return
         
-        if not result.data:
-            # Initialise if doesnt exist
-            supabase.table("user_gamification").insert({
-                "user_id": user_id
-            }).execute()
-            result = supabase.table("user_gamification")\
-                .select("*")\
-                .eq("user_id", user_id)\
-                .single()\
-                .execute()
+        # Re-index only when the cached list changed
+        by_requirement_type = {}
+        for badge in badges:
+            by_requirement_type.setdefault(badge["requirement_type"], []).append(badge)
         
-        current_stats = result.data
-        exp_earned = EXP_REWARDS.get(activity_type, 0)
+        self.badges = badges
+        self.by_requirement_type = by_requirement_type
+
+    async def get_all(self) -> List[dict]:
+        await self._ensure_fresh()
+        return self.badges
 
-        # Update stats based on activity type
-        updates = {
-            "total_exp": current_stats["total_exp"] + exp_earned,
-            "last_activity_at": datetime.now(timezone.utc).isoformat()
+    async def get_for_activities(self, activity_types: List[str]) -> List[dict]:
+        """
+        Badges whose requirement can be affected by any of the given activity types
+        """
+        await self._ensure_fresh()
+        requirement_types = {
+            req_type
+            for activity_type in activity_types
+            for req_type in ACTIVITY_REQUIREMENT_TYPES.get(activity_type, [])
         }
+        return [
+            badge
+            for req_type in requirement_types
+            for badge in self.by_requirement_type.get(req_type, [])
+        ]
 
-        if activity_type == "question_asked":
-            updates["questions_asked"] = current_stats["questions_asked"] + 1
-        elif activity_type == "document_viewed":
-            updates["documents_viewed"] = current_stats["documents_viewed"] + 1
-        elif activity_type == "bookmark_created":
-            updates["bookmarks_created"] = current_stats["bookmarks_created"] + 1
-        
-        # Update user stats
-        supabase.table("user_gamification")\
-            .update(updates)\
-            .eq("user_id", user_id)\
+    async def invalidate(self):
+        await self.cache.clear()
+        await badge_response_cache.clear()
+
+badge_catalogue = BadgeCatalogue()
+
+# Per-user /badges responses with their ETag, dropped whenever that user's activity is tracked
+BADGE_RESPONSE_CACHE_TTL_SECONDS = 300
+badge_response_cache = TieredCache("badges", ttl_seconds=BADGE_RESPONSE_CACHE_TTL_SECONDS, maxsize=10000)
+
+async def invalidate_user_badges(user_id: str):
+    await badge_response_cache.delete(user_id)
+
+# Leaderboard is reloaded in full this often, activity tracking keeps it current in between.
+# Each worker only applies the increments from the events it flushed itself, so with several workers
+# a board can lag behind the others' activity by up to this interval (the reload is the shared source).
+LEADERBOARD_REFRESH_SECONDS = 60
+LEADERBOARD_PAGE_SIZE = 1000
+
+async def load_leaderboard():
+    """
+    Load the leaderboard from user_activity_summary, one page at a time
+    """
+    supabase = get_supabase()
+    rows = []
+    offset = 0
+    while True:
+        result = await supabase.table("user_activity_summary")\
+            .select("user_id, first_name, last_name, role, total_exp")\
+            .order("user_id")\
+            .range(offset, offset + LEADERBOARD_PAGE_SIZE - 1)\
             .execute()
-        
-        # Log activity
-        supabase.table("activity_log").insert({
-            "user_id": user_id,
-            "activity_type": activity_type,
-            "exp_earned": exp_earned,
-            "metadata": metadata
-        }).execute()
+        page = result.data or []
+        rows.extend(page)
+        if len(page) < LEADERBOARD_PAGE_SIZE:
+            break
+        offset += LEADERBOARD_PAGE_SIZE
+    leaderboard.load(rows)
+
+async def run_leaderboard_refresher(interval_seconds: float = LEADERBOARD_REFRESH_SECONDS):
+    """
+    Background loop reloading the leaderboard until cancelled
+    """
+    while True:
+        try:
+            await load_leaderboard()
+        except Exception as e:
+            print(f"Error loading leaderboard: {e}")
+        await asyncio.sleep(interval_seconds)
+
+async def track_activity(user_id: str, activity_type: str, metadata: Optional[dict] = None):
+    """
+    Track user activity and award EXP
+    Counters, activity log and the returned stats are handled atomically by the
+    track_activity Postgres function (backend/sql/001_track_activity.sql) in one round trip
+    """
+    try:
+        exp_earned = EXP_REWARDS.get(activity_type, 0)
+
+        with traced("supabase.rpc", {"db.system": "postgresql", "db.operation": "rpc", "db.target": "track_activity"}):
+            result = await get_supabase().rpc("track_activity", {
+                "p_user_id": user_id,
+                "p_activity_type": activity_type,
+                "p_exp_earned": exp_earned,
+                "p_metadata": metadata
+            }).execute()
 
-        # Check for new badges
-        await check_and_award_badges(user_id)
+        new_stats = result.data[0] if isinstance(result.data, list) else result.data
+
+        leaderboard.update(user_id, new_stats["total_exp"])
+
+        # Check for new badges against the stats just returned
+        await check_and_award_badges(user_id, new_stats, [activity_type])
+        await invalidate_user_badges(user_id)
 
         return {
             "success": True,
             "exp_earned": exp_earned,
-            "new_stats": {**current_stats, **updates}
+            "new_stats": new_stats
         }
     
     except Exception as e:
         print(f"Error tracking activity: {e}")
         return {"success": False, "error": str(e)}
 
-async def check_and_award_badges(user_id: str):
+async def check_and_award_badges(user_id: str, stats: Optional[dict] = None, activity_types: Optional[List[str]] = None):
     """
     Check if user has earned any new badges
+    Only badges the given activity types can affect are evaluated (all badges if none are given),
+    against counters maintained on user_gamification
     """
     try:
-        # Get user stats
-        stats_result = supabase.table("user_gamification")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .single()\
-            .execute()
+        supabase = get_supabase()
+
+        # Get user stats if the caller doesn't have them already
+        if stats is None:
+            stats_result = await supabase.table("user_gamification")\
+                .select("*")\
+                .eq("user_id", user_id)\
+                .single()\
+                .execute()
+            stats = stats_result.data
         
-        if not stats_result.data:
+        if not stats:
             return
+
+        # Candidate badges from the cached catalogue
+        if activity_types:
+            candidate_badges = await badge_catalogue.get_for_activities(activity_types)
+        else:
+            candidate_badges = await badge_catalogue.get_all()
         
-        stats = stats_result.data
+        # Only badges whose requirement is met are worth checking against what the user already earned
+        qualifying_badges = [
+            badge for badge in candidate_badges
+            if badge["requirement_type"] in REQUIREMENT_STATS
+            and (stats.get(REQUIREMENT_STATS[badge["requirement_type"]]) or 0) >= badge["requirement_value"]
+        ]
 
-        # Get all badges
-        badges_result = supabase.table("badges").select("*").execute()
-        all_badges = badges_result.data
+        if not qualifying_badges:
+            return
 
-        # Get user's earned badges
-        earned_result = supabase.table("user_badges")\
-            .select("badge_id")\
-            .eq("user_id", user_id)\
-            .execute()
+        # Get which of those the user has already earned
+        with traced("supabase.select", {"db.system": "postgresql", "db.operation": "select", "db.target": "user_badges"}):
+            earned_result = await supabase.table("user_badges")\
+                .select("badge_id")\
+                .eq("user_id", user_id)\
+                .in_("badge_id", [badge["id"] for badge in qualifying_badges])\
+                .execute()
         
-        earned_badge_ids = [b["badge_id"] for b in earned_result.data]
+        earned_badge_ids = {b["badge_id"] for b in earned_result.data}
 
-        # Check each badge
-        for badge in all_badges:
+        for badge in qualifying_badges:
             if badge["id"] in earned_badge_ids:
                 continue
 
-            requirement_met = False
-            req_type = badge["requirement_type"]
-            req_value = badge["requirement_value"]
-
-            if req_type == "questions_asked":
-                requirement_met = stats["questions_asked"] >= req_value
-            elif req_type == "documents_viewed":
-                requirement_met = stats["documents_viewed"] >= req_value
-            elif req_type == "bookmarks_created":
-                requirement_met = stats["bookmarks_created"] >= req_value
-            elif req_type == "level_reached":
-                requirement_met = stats["level"] >= req_value
-            elif req_type == "documents_viewed_thinkinsight":
-                activity_check = supabase.table("activity_log")\
-                    .select("id")\
-                    .eq("user_id", user_id)\
-                    .eq("activity_type", "document_viewed_thinkinsight")\
-                    .execute()
-                requirement_met = len(activity_check.data) >= req_value
-            
-            if requirement_met:
-                # Award badge
-                supabase.table("user_badges").insert({
-                    "user_id": user_id,
-                    "badge_id": badge["id"]
+            # Award badge and its bonus EXP atomically (no-op if already awarded concurrently)
+            with traced("supabase.rpc", {"db.system": "postgresql", "db.operation": "rpc", "db.target": "award_badge"}):
+                awarded = await supabase.rpc("award_badge", {
+                    "p_user_id": user_id,
+                    "p_badge_id": badge["id"]
                 }).execute()
 
-                # Award bonus EXP if applicable
-                if badge["exp_reward"] > 0:
-                    supabase.table("user_gamification")\
-                        .update({
-                            "total_exp": stats["total_exp"] + badge["exp_reward"]
-                        })\
-                        .eq("user_id", user_id)\
-                        .execute()
+            if awarded.data is True and badge["exp_reward"] > 0:
+                leaderboard.add_exp(user_id, badge["exp_reward"])
     
     except Exception as e:
         print(f"Error checking badges: {e}")
 
+async def flush_activity_events(events: List[dict]) -> dict:
+    """
+    Write a batch of buffered events: one bulk insert plus aggregated counter updates,
+    then badge checks for every affected user against their new stats.
+    Returns the new stats by user_id.
+    """
+    with traced("supabase.rpc", {"db.system": "postgresql", "db.operation": "rpc", "db.target": "track_activity_batch", "els.batch_size": len(events)}):
+        result = await get_supabase().rpc("track_activity_batch", {"p_events": events}).execute()
+
+    activity_types_by_user = {}
+    for event in events:
+        activity_types_by_user.setdefault(event["user_id"], set()).add(event["activity_type"])
+
+    new_stats = {}
+    for stats in result.data or []:
+        leaderboard.update(stats["user_id"], stats["total_exp"])
+        await check_and_award_badges(stats["user_id"], stats, list(activity_types_by_user.get(stats["user_id"], [])))
+        await invalidate_user_badges(stats["user_id"])
+        new_stats[stats["user_id"]] = stats
+    return new_stats
+
+# Write-behind buffer for /api/gamification/track, started and drained by the app lifespan in main.py
+activity_buffer = ActivityBuffer(flush_activity_events)
+
 @router.get("/api/gamification/stats/{user_id}")
-async def get_user_stats(user_id: str):
+async def get_user_stats(user_id: str, supabase: AsyncClient = Depends(get_supabase)):
     """
     Endpoint to get user gamification stats
     """
     try:
-        result = supabase.table("user_gamification")\
+        result = await supabase.table("user_gamification")\
             .select("*")\
             .eq("user_id", user_id)\
             .single()\
@@ -176,10 +285,10 @@ async def get_user_stats(user_id: str):
         
         if not result.data:
             # Initialise if doesn't exist
-            supabase.table("user_gamification").insert({
+            await supabase.table("user_gamification").insert({
                 "user_id": user_id
             }).execute()
-            result = supabase.table("user_gamification")\
+            result = await supabase.table("user_gamification")\
                 .select("*")\
                 .eq("user_id", user_id)\
                 .single()\
@@ -204,83 +313,125 @@ async def get_user_stats(user_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/api/gamification/badges/{user_id}")
-async def get_user_badges(user_id: str):
+async def build_user_badges(user_id: str) -> dict:
     """
-    Endpoint to get available badges and user's earned badges
+    Badges with earned status and progress, from the cached catalogue plus two queries
     """
-    try:
-        # Get all badges
-        badges_result = supabase.table("badges")\
-            .select("*")\
-            .order("created_at")\
-            .execute()
-        
-        all_badges = badges_result.data
+    supabase = get_supabase()
+    all_badges = await badge_catalogue.get_all()
 
-        # Get user's earned badges
-        earned_result = supabase.table("user_badges")\
+    # Get user's earned badges
+    with traced("supabase.select", {"db.system": "postgresql", "db.operation": "select", "db.target": "user_badges"}):
+        earned_result = await supabase.table("user_badges")\
             .select("badge_id, earned_at")\
             .eq("user_id", user_id)\
             .execute()
-        
-        earned_map = {b["badge_id"]: b["earned_at"] for b in earned_result.data}
+    
+    earned_map = {b["badge_id"]: b["earned_at"] for b in earned_result.data}
 
-        # Get user stats for progress calculation
-        stats_result = supabase.table("user_gamification")\
+    # Get user stats for progress calculation (includes the maintained thinkinsight counter)
+    with traced("supabase.select", {"db.system": "postgresql", "db.operation": "select", "db.target": "user_gamification"}):
+        stats_result = await supabase.table("user_gamification")\
             .select("*")\
             .eq("user_id", user_id)\
-            .single()\
+            .maybe_single()\
             .execute()
+    
+    stats = stats_result.data if stats_result and stats_result.data else {}
+
+    # Enrich badges with earned status and progress
+    enriched_badges = []
+    for badge in all_badges:
+        earned_at = earned_map.get(badge["id"])
+        is_earned = earned_at is not None
+
+        # Calculate progress
+        progress = 0
+        if is_earned:
+            progress = 100
+        elif stats and badge["requirement_type"] in REQUIREMENT_STATS:
+            default_value = 1 if badge["requirement_type"] == "level_reached" else 0
+            current_value = stats.get(REQUIREMENT_STATS[badge["requirement_type"]]) or default_value
+            progress = min(100, (current_value / badge["requirement_value"]) * 100)
         
-        stats = stats_result.data if stats_result.data else {}
-
-        # Enrich badges with earned status and progress
-        enriched_badges = []
-        for badge in all_badges:
-            earned_at = earned_map.get(badge["id"])
-            is_earned = earned_at is not None
-
-            # Calculate progress
-            progress = 0
-            if not is_earned and stats:
-                req_type = badge["requirement_type"]
-                req_value = badge["requirement_value"]
-
-                if req_type == "questions_asked":
-                    progress = min(100, (stats.get("questions_asked", 0) / req_value) * 100)
-                elif req_type == "documents_viewed":
-                    progress = min(100, (stats.get("documents_viewed", 0) / req_value) * 100)
-                elif req_type == "bookmarks_created":
-                    progress = min(100, (stats.get("bookmarks_created", 0) / req_value) * 100)
-                elif req_type == "level_reached":
-                    progress = min(100, (stats.get("level", 1) / req_value) * 100)
-                elif req_type == "documents_viewed_thinkinsight":
-                    activity_count = supabase.table("activity_log")\
-                        .select("id", count="exact")\
-                        .eq("user_id", user_id)\
-                        .eq("activity_type", "document_viewed_thinkinsight")\
-                        .execute()
-                    count = activity_count.count if activity_count.count else 0
-                    progress = min(100, (count / req_value) * 100)
-            elif is_earned:
-                progress = 100
-            
-            enriched_badges.append({
-                **badge,
-                "earned": is_earned,
-                "earned_at": earned_at,
-                "progress": progress
-            })
+        enriched_badges.append({
+            **badge,
+            "earned": is_earned,
+            "earned_at": earned_at,
+            "progress": progress
+        })
+    
+    return {
+        "badges": enriched_badges,
+        "total_earned": len(earned_map)
+    }
+
+@router.get("/api/gamification/badges/{user_id}")
+async def get_user_badges(user_id: str, if_none_match: Optional[str] = Header(None)):
+    """
+    Endpoint to get available badges and user's earned badges
+    Responses are cached per user and carry an ETag, so polling clients get 304 until the user's activity changes
+    """
+    try:
+        cached = await badge_response_cache.get(user_id)
+        if cached is None:
+            payload = await build_user_badges(user_id)
+            etag = '"' + hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest() + '"'
+            cached = {"etag": etag, "payload": payload}
+            await badge_response_cache.set(user_id, cached)
         
-        return {
-            "badges": enriched_badges,
-            "total_earned": len(earned_map)
-        }
+        etag, payload = cached["etag"], cached["payload"]
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+        if if_none_match == etag:
+            return Response(status_code=304, headers=headers)
+        
+        return JSONResponse(content=payload, headers=headers)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/api/gamification/leaderboard")
+async def get_leaderboard(limit: int = 10, role: Optional[str] = None, current_user: UserContext = Depends(get_current_user)):
+    """
+    Endpoint to get the top users by EXP, optionally for one role
+    """
+    limit = max(1, min(limit, 100))
+    return {
+        "entries": leaderboard.top(limit, role),
+        "total_users": len(leaderboard)
+    }
+
+@router.get("/api/gamification/leaderboard/rank/{user_id}")
+async def get_leaderboard_rank(user_id: str, current_user: UserContext = Depends(get_current_user)):
+    """
+    Endpoint to get a user's rank
+    """
+    rank = leaderboard.rank(user_id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="User not on leaderboard")
+    
+    return {
+        "user_id": user_id,
+        "rank": rank,
+        "total_users": len(leaderboard)
+    }
+
+@router.get("/api/gamification/leaderboard/around/{user_id}")
+async def get_leaderboard_around(user_id: str, radius: int = 2, current_user: UserContext = Depends(get_current_user)):
+    """
+    Endpoint to get a user and their neighbours on the leaderboard
+    """
+    radius = max(0, min(radius, 25))
+    entries = leaderboard.around(user_id, radius)
+    if not entries:
+        raise HTTPException(status_code=404, detail="User not on leaderboard")
+    
+    return {
+        "entries": entries,
+        "total_users": len(leaderboard)
+    }
+
 @router.post("/api/gamification/track")
 async def track_user_activity(data: dict):
     """
@@ -288,19 +439,74 @@ async def track_user_activity(data: dict):
     Expected data: {
         "user_id": str,
         "activity_type": str,
-        "metadata": dict (optional)
+        "metadata": dict (optional),
+        "wait": bool (optional, answer only once the event is written, with new_stats, so stats and badges
+                      fetched right after include it)
     }
     """
     user_id = data.get("user_id")
     activity_type = data.get("activity_type")
     metadata = data.get("metadata", {})
+    wait = bool(data.get("wait", False))
 
     if not user_id or not activity_type:
         raise HTTPException(status_code=400, detail="Missing required fields")
     
+    exp_earned = EXP_REWARDS.get(activity_type, 0)
+    event = {
+        "event_id": str(uuid.uuid4()), # Makes a retried batch idempotent
+        "user_id": user_id,
+        "activity_type": activity_type,
+        "exp_earned": exp_earned,
+        "metadata": metadata,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+
+    if wait:
+        # Answer once the buffer has written the event (it still shares a batch with other events)
+        queued, flushed, new_stats = await activity_buffer.submit_and_wait(event)
+        if queued:
+            return {
+                "success": True,
+                "exp_earned": exp_earned,
+                "queued": True,
+                "flushed": flushed,
+                "new_stats": (new_stats or {}).get(user_id)
+            }
+    # Otherwise answer immediately with the EXP this event will earn, the buffer writes it in the background
+    elif activity_buffer.submit(event):
+        return {
+            "success": True,
+            "exp_earned": exp_earned,
+            "queued": True,
+            "flushed": False
+        }
+    
+    # Buffer not running or full: write directly
     result = await track_activity(user_id, activity_type, metadata)
 
     if not result["success"]:
         raise HTTPException(status_code=500, detail=result.get("error"))
     
-    return result
\ No newline at end of file
+    return result
+
+@router.get("/api/gamification/buffer-metrics")
+async def get_buffer_metrics(current_user: UserContext = Depends(get_current_user)):
+    """
+    Endpoint to get activity buffer queue depth and flush latency (admin only)
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    return activity_buffer.get_metrics()
+
+@router.post("/api/gamification/badges/cache/invalidate")
+async def invalidate_badge_catalogue(current_user: UserContext = Depends(get_current_user)):
+    """
+    Endpoint to drop the cached badge catalogue after badges are edited (admin only)
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    
+    await badge_catalogue.invalidate()
+    return {"message": "Badge catalogue cache cleared"}
@@ -0,0 +1,171 @@
+from contextlib import contextmanager
+from datetime import datetime
+from pymongo import ASCENDING
+from typing import Dict, List
+import asyncio
+import math
+import time
+
+from mongo import run_sync_in_thread
+
+# In-process latency histograms for endpoints and chat pipeline stages.
+# Each histogram has fixed log-spaced buckets (HDR-style: every value is kept within ~4% of its true
+# value from 10 microseconds to 10 minutes), so memory is constant however many values are recorded,
+# and histograms can be merged by adding bucket counts.
+# Two sets are kept: cumulative ones for the Prometheus /metrics endpoint, and per-interval ones that
+# are persisted as percentile snapshots to MongoDB for trend charts and then reset.
+HISTOGRAM_MIN_MS = 0.01
+HISTOGRAM_MAX_MS = 600000
+HISTOGRAM_GROWTH = 1.04
+HISTOGRAM_BUCKETS = math.ceil(math.log(HISTOGRAM_MAX_MS / HISTOGRAM_MIN_MS) / math.log(HISTOGRAM_GROWTH)) + 1
+
+LATENCY_SNAPSHOT_COLLECTION = "latency_snapshots"
+LATENCY_SNAPSHOT_INTERVAL_SECONDS = 300
+LATENCY_SNAPSHOT_RETENTION_DAYS = 30
+
+REPORTED_PERCENTILES = [50, 90, 99]
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    @staticmethod
+    def _bucket(value_ms: float) -> int:
+        if value_ms <= HISTOGRAM_MIN_MS:
+            return 0
+        index = math.ceil(math.log(value_ms / HISTOGRAM_MIN_MS) / math.log(HISTOGRAM_GROWTH))
+        return min(index, HISTOGRAM_BUCKETS - 1)
+
+    def record(self, value_ms: float):
+        self.counts[self._bucket(value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def merge(self, other: "LatencyHistogram"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, percentile: float) -> float:
+        """
+        Upper bound of the bucket holding the given percentile, capped at the largest recorded value
+        """
+        if self.count == 0:
+            return 0.0
+        target = max(1, math.ceil(self.count * percentile / 100))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(HISTOGRAM_MIN_MS * HISTOGRAM_GROWTH ** i, self.max_ms)
+        return self.max_ms
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            **{f"p{p}_ms": round(self.percentile(p), 2) for p in REPORTED_PERCENTILES},
+            "max_ms": round(self.max_ms, 2)
+        }
+
+class LatencyRegistry:
+    def __init__(self):
+        self._cumulative: Dict[str, LatencyHistogram] = {}
+        self._interval: Dict[str, LatencyHistogram] = {}
+        self.started_at = datetime.now()
+        self.interval_started_at = self.started_at
+
+    def record(self, name: str, value_ms: float):
+        for histograms in (self._cumulative, self._interval):
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = LatencyHistogram()
+            histogram.record(value_ms)
+
+    @contextmanager
+    def measure(self, name: str):
+        """
+        Record the duration of a with-block, also when it raises
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def get_summary(self) -> List[dict]:
+        """
+        Percentiles since process start, one entry per metric name
+        """
+        return [{"name": name, **histogram.summary()} for name, histogram in sorted(self._cumulative.items())]
+
+    def take_interval_summary(self) -> List[dict]:
+        """
+        Percentiles since the previous call, then start a new interval
+        """
+        histograms, self._interval = self._interval, {}
+        self.interval_started_at = datetime.now()
+        return [{"name": name, **histogram.summary()} for name, histogram in sorted(histograms.items())]
+
+    def render_prometheus(self) -> str:
+        """
+        Cumulative histograms as Prometheus summaries (seconds)
+        """
+        lines = [
+            "# HELP els_latency_seconds Latency of API endpoints and chat pipeline stages",
+            "# TYPE els_latency_seconds summary"
+        ]
+        for name, histogram in sorted(self._cumulative.items()):
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            for p in REPORTED_PERCENTILES:
+                lines.append(f'els_latency_seconds{{name="{label}",quantile="{p / 100}"}} {histogram.percentile(p) / 1000:.6f}')
+            lines.append(f'els_latency_seconds_sum{{name="{label}"}} {histogram.total_ms / 1000:.6f}')
+            lines.append(f'els_latency_seconds_count{{name="{label}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+latency_metrics = LatencyRegistry()
+
+def ensure_snapshot_indexes(snapshot_collection):
+    # Old snapshots expire on their own
+    snapshot_collection.create_index(
+        [("timestamp", ASCENDING)],
+        name="timestamp_ttl",
+        expireAfterSeconds=LATENCY_SNAPSHOT_RETENTION_DAYS * 24 * 3600
+    )
+
+def persist_snapshot(snapshot_collection, registry: LatencyRegistry = latency_metrics):
+    interval_started_at = registry.interval_started_at
+    metrics = registry.take_interval_summary()
+    if not metrics:
+        return
+    snapshot_collection.insert_one({
+        "timestamp": datetime.now(),
+        "interval_started_at": interval_started_at,
+        "metrics": metrics
+    })
+
+async def get_snapshots(snapshot_collection, since: datetime) -> List[dict]:
+    """
+    Snapshots since the given time, oldest first (snapshot_collection from the AsyncMongoClient)
+    """
+    return await snapshot_collection.find(
+        {"timestamp": {"$gte": since}},
+        {"_id": 0}
+    ).sort("timestamp", ASCENDING).to_list()
+
+async def run_latency_snapshotter(snapshot_collection, interval_seconds: float = LATENCY_SNAPSHOT_INTERVAL_SECONDS):
+    """
+    Background loop persisting interval percentiles until cancelled
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_sync_in_thread(persist_snapshot, snapshot_collection)
+        except Exception as e:
+            print(f"Latency snapshot error: {e}")
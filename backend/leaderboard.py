@@ -0,0 +1,105 @@
+from typing import List, Optional
+import bisect
+
+# In-memory EXP leaderboard.
+# Users are kept in a list sorted by (-total_exp, user_id), so rank lookups are a binary search
+# and top-N / neighbourhood queries are slices. It is loaded once from user_activity_summary,
+# kept current from the stats returned by activity tracking, and fully reloaded periodically
+# to pick up anything changed outside the app.
+# The board is per process: with several uvicorn workers each one sees the increments it applied
+# itself immediately and everyone else's at the next reload (LEADERBOARD_REFRESH_SECONDS).
+class Leaderboard:
+    def __init__(self):
+        self._entries: List[tuple] = [] # sorted (-total_exp, user_id)
+        self._exp: dict = {} # user_id -> total_exp
+        self._profiles: dict = {} # user_id -> {"name", "role"}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, rows: List[dict]):
+        """
+        Replace the whole board from rows with user_id, first_name, last_name, role, total_exp
+        """
+        exp = {}
+        profiles = {}
+        for row in rows:
+            exp[row["user_id"]] = row.get("total_exp") or 0
+            profiles[row["user_id"]] = {
+                "name": f"{row.get('first_name') or ''} {row.get('last_name') or ''}".strip() or "Unknown User",
+                "role": row.get("role") or "Unknown"
+            }
+
+        # Swap in fully built structures so readers never see a half-loaded board
+        self._entries = sorted((-total_exp, user_id) for user_id, total_exp in exp.items())
+        self._exp = exp
+        self._profiles = profiles
+        self.loaded = True
+
+    def update(self, user_id: str, total_exp: int):
+        """
+        Move a user to their new EXP total
+        """
+        old_exp = self._exp.get(user_id)
+        if old_exp == total_exp:
+            return
+
+        if old_exp is not None:
+            index = bisect.bisect_left(self._entries, (-old_exp, user_id))
+            if index < len(self._entries) and self._entries[index] == (-old_exp, user_id):
+                del self._entries[index]
+
+        bisect.insort(self._entries, (-total_exp, user_id))
+        self._exp[user_id] = total_exp
+
+    def add_exp(self, user_id: str, exp: int):
+        if user_id in self._exp:
+            self.update(user_id, self._exp[user_id] + exp)
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """
+        1-based rank, or None if the user isn't on the board
+        """
+        total_exp = self._exp.get(user_id)
+        if total_exp is None:
+            return None
+        return bisect.bisect_left(self._entries, (-total_exp, user_id)) + 1
+
+    def _entry(self, index: int) -> dict:
+        neg_exp, user_id = self._entries[index]
+        profile = self._profiles.get(user_id, {"name": "Unknown User", "role": "Unknown"})
+        return {
+            "rank": index + 1,
+            "user_id": user_id,
+            "name": profile["name"],
+            "role": profile["role"],
+            "total_exp": -neg_exp
+        }
+
+    def top(self, limit: int = 10, role: Optional[str] = None) -> List[dict]:
+        if role is None:
+            return [self._entry(i) for i in range(min(limit, len(self._entries)))]
+
+        # Walk down the board until enough users with the role are found
+        entries = []
+        for i in range(len(self._entries)):
+            if len(entries) >= limit:
+                break
+            entry = self._entry(i)
+            if entry["role"] == role:
+                entries.append(entry)
+        return entries
+
+    def around(self, user_id: str, radius: int = 2) -> List[dict]:
+        """
+        The user plus up to `radius` neighbours above and below
+        """
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        end = min(len(self._entries), rank + radius)
+        return [self._entry(i) for i in range(start, end)]
+
+leaderboard = Leaderboard()
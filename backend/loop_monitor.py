@@ -0,0 +1,137 @@
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List, Optional
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+from latency_metrics import latency_metrics
+
+# Event-loop blocking detector and sampling profiler.
+# A heartbeat task on the event loop ticks every HEARTBEAT_INTERVAL_MS. A watchdog thread checks the last
+# tick: if the loop has not ticked for LOOP_LAG_THRESHOLD_MS, something is running synchronously on it
+# (a blocking pymongo, GridFS or Supabase call in an async handler, usually). The watchdog then grabs the
+# loop thread's stack while it is still blocked, finds the endpoint on it and logs both.
+# The heartbeat's own lateness is recorded as the event_loop.lag latency metric.
+HEARTBEAT_INTERVAL_MS = 50
+LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))
+RECENT_STALLS = 50
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_DEFAULT_INTERVAL_MS = 5
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class LoopMonitor:
+    def __init__(self, threshold_ms: int = LOOP_LAG_THRESHOLD_MS, interval_ms: int = HEARTBEAT_INTERVAL_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.endpoints: Dict[object, str] = {} # endpoint code object -> "METHODS /path"
+        self.stalls = deque(maxlen=RECENT_STALLS)
+        self.stall_count = 0
+        self.max_lag_ms = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self, routes):
+        """
+        Start the heartbeat on the running loop and the watchdog thread
+        """
+        self.endpoints = {
+            route.endpoint.__code__: f"{','.join(sorted(getattr(route, 'methods', None) or []))} {route.path}"
+            for route in routes
+            if hasattr(getattr(route, "endpoint", None), "__code__")
+        }
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat:
+            self._heartbeat.cancel()
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            latency_metrics.record("event_loop.lag", max(0.0, now - expected) * 1000)
+            self._last_beat = now
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopped.wait(self.interval):
+            last_beat = self._last_beat
+            lag = time.monotonic() - last_beat
+            if lag < self.threshold or last_beat == reported_beat:
+                continue
+            # One report per stall, taken while the loop is still blocked
+            reported_beat = last_beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._report(lag, frame)
+
+    def _find_endpoint(self, frame) -> Optional[str]:
+        while frame is not None:
+            endpoint = self.endpoints.get(frame.f_code)
+            if endpoint:
+                return endpoint
+            frame = frame.f_back
+        return None
+
+    def _report(self, lag: float, frame):
+        endpoint = self._find_endpoint(frame) or "unknown (not inside an endpoint)"
+        stack = "".join(traceback.format_stack(frame))
+        self.stall_count += 1
+        self.max_lag_ms = max(self.max_lag_ms, lag * 1000)
+        self.stalls.append({
+            "detected_at": datetime.now().isoformat(),
+            "lag_ms": round(lag * 1000, 1),
+            "endpoint": endpoint,
+            "stack": stack
+        })
+        print(f"Event loop blocked for {lag * 1000:.0f}ms+ in {endpoint}:\n{stack}")
+
+    def get_report(self) -> dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "stall_count": self.stall_count,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "recent_stalls": list(self.stalls)
+        }
+
+loop_monitor = LoopMonitor()
+
+# Sampling profiler: a thread reads every thread's stack at a fixed interval and counts identical stacks.
+# Output is the collapsed-stack format (root;...;leaf count) read by flamegraph.pl, speedscope and similar.
+profile_lock = threading.Lock()
+
+def sample_stacks(seconds: float, interval_ms: float = PROFILE_DEFAULT_INTERVAL_MS, all_threads: bool = True, loop_thread_id: Optional[int] = None) -> str:
+    sampler_id = threading.get_ident()
+    counts = Counter()
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == sampler_id or (not all_threads and thread_id != loop_thread_id):
+                continue
+            labels: List[str] = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+            counts[";".join(reversed(labels))] += 1
+        time.sleep(interval_ms / 1000)
+
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
@@ -1,43 +1,61 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, StreamingResponse
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 import os
 from dotenv import load_dotenv
 import json
 import io
-from datetime import datetime
+import base64
+import re
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, date, time, timedelta
 from bson import ObjectId
 
 from auth import UserContext, get_current_user
-from gamification_api import router as gamification_router
+from gamification_api import router as gamification_router, activity_buffer, run_leaderboard_refresher
 from analytics_api import router as analytics_router
+from reconcile import reconcile_vector_store
+from storage import compress_for_storage, iter_stored_file_async, read_stored_file_async, get_storage_report
+from previews import store_page_image, get_page_count, image_etag, IMAGE_CACHE_CONTROL
+from vector_sync import OUTBOX_COLLECTION, ensure_outbox_indexes, enqueue_sync, claim_entry, apply_entry, run_outbox_worker
+from document_stats import DOCUMENT_STATS_COLLECTION, record_uploads, record_deletes, record_tag_change, run_document_stats_reconciler
+from latency_metrics import LATENCY_SNAPSHOT_COLLECTION, latency_metrics, ensure_snapshot_indexes, run_latency_snapshotter
+from tracing import setup_tracing, shutdown_tracing, traced, tracer, set_attributes, end_span
+from loop_monitor import loop_monitor, profile_lock, sample_stacks, PROFILE_MAX_SECONDS, PROFILE_DEFAULT_INTERVAL_MS
+from mongo import init_mongodb, close_mongodb_clients, get_db, get_fs, get_async_db, get_async_fs
+from supabase_client import init_supabase, close_supabase, get_supabase
+from ai_clients import init_ai_clients, close_ai_clients, get_openai_client, get_chroma_client
+from cache import TieredCache, cache_backend
 
-from openai import AsyncOpenAI
 import asyncio
-from functools import lru_cache
-from pymongo import MongoClient
-from gridfs import GridFS
-import pdfplumber
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_chroma import Chroma
-from supabase import create_client, Client
+import hashlib
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.asynchronous.database import AsyncDatabase
+from gridfs import AsyncGridFSBucket
+from supabase import AsyncClient
+
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
 
 # Load environment variables
 load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
-mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
-chroma_api_key = os.getenv("CHROMA_API_KEY")
-chroma_tenant = os.getenv("CHROMA_TENANT")
-chroma_database = os.getenv("CHROMA_DATABASE")
 supabase_jwt_secret = os.getenv("SUPABASE_JWT_SECRET")
 
 MAX_FILE_SIZE = 10 * 1024 * 1024 # 10MB in bytes
 
+# Document totals are cached per access level so paging doesn't re-count the library on every request
+DOCUMENT_COUNT_TTL_SECONDS = 60
+
+# Maximum number of document ids per $in filter sent to Chroma
+CHROMA_DELETE_BATCH_SIZE = 100
+
+# Retrieval results and FAQ lists are cached across workers (cache.py) and dropped when documents or FAQs change
+RETRIEVAL_CACHE_TTL_SECONDS = 600
+FAQ_CACHE_TTL_SECONDS = 600
+
 # Access level hierarchy
 ACCESS_HIERARCHY = {
     "public": 0,
@@ -53,30 +71,110 @@ ROLE_MIN_ACCESS = {
     "admin": 3
 }
 
-# Initialise clients
-async_openai_client = AsyncOpenAI(api_key=openai_api_key)
-mongodb_client = MongoClient(mongodb_uri, tls=True, tlsAllowInvalidCertificates=True)
-db = mongodb_client["els_db"]
-fs = GridFS(db)
-company_documents_collection = db["company_documents"]
-
-# Supabase client setup
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_secret_key = os.getenv("SUPABASE_SECRET_KEY")
-supabase: Client = create_client(supabase_url, supabase_secret_key)
-
-# Initialise Chroma Cloud client
-embeddings = OpenAIEmbeddings(api_key=openai_api_key)
-chroma_client = Chroma(
-    collection_name="company_documents",
-    embedding_function=embeddings,
-    chroma_cloud_api_key=chroma_api_key,
-    tenant=chroma_tenant,
-    database=chroma_database
-)
+# Clients (one instance each, created by the lifespan below and handed out by the get_* functions):
+# - MongoDB (mongo.py): request handlers take the async database and GridFS bucket as dependencies,
+#   work offloaded to threads uses the sync ones
+# - Supabase (supabase_client.py): one async client (HTTP/2), also used by the analytics and gamification routers
+# - OpenAI and Chroma Cloud (ai_clients.py)
+
+# Document counts cached per access level (shared by all workers, see cache.py), cleared whenever documents are added, removed or re-levelled
+document_count_cache = TieredCache("document_counts", ttl_seconds=DOCUMENT_COUNT_TTL_SECONDS, maxsize=len(ACCESS_HIERARCHY))
+
+# Chroma results per (access level, k, question), cleared after every write to Chroma (upload, delete, outbox
+# entries applied inline or by the worker, reconciliation fixes), never before it: a search between a clear and
+# the write would cache the old chunks and metadata again
+retrieval_cache = TieredCache("retrieval", ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS, maxsize=2048)
+
+# FAQ lists per access level, cleared whenever an FAQ is created, updated or deleted
+faq_cache = TieredCache("faqs", ttl_seconds=FAQ_CACHE_TTL_SECONDS, maxsize=len(ACCESS_HIERARCHY))
+
+# Function to create the indexes the document queries rely on (create_index is a no-op if it already exists)
+def ensure_document_indexes(company_documents_collection):
+    # Listing: sort on (filename, _id) and filter access_level_num from the index keys (equality, sort, range order)
+    company_documents_collection.create_index(
+        [("filename", ASCENDING), ("_id", ASCENDING), ("access_level_num", ASCENDING)],
+        name="filename_id_access_level"
+    )
+    # Counting: access_level_num range first so counts are answered from the index alone
+    company_documents_collection.create_index(
+        [("access_level_num", ASCENDING), ("filename", ASCENDING)],
+        name="access_level_filename"
+    )
+    # Search: tag filter with filename ordering, upload date range, and word search over filenames
+    company_documents_collection.create_index(
+        [("tags", ASCENDING), ("filename", ASCENDING)],
+        name="tags_filename"
+    )
+    company_documents_collection.create_index(
+        [("upload_date", DESCENDING)],
+        name="upload_date"
+    )
+    company_documents_collection.create_index(
+        [("filename", TEXT)],
+        name="filename_text"
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tracing exporter is configured from OTEL_* environment variables (see tracing.py)
+    setup_tracing()
+
+    # Shared clients, one instance of each for the process, before anything below uses them
+    # (created here rather than at import, so importing this module stays fast and does no network I/O)
+    await asyncio.to_thread(init_mongodb)
+    await asyncio.to_thread(init_ai_clients)
+    await init_supabase()
+    await cache_backend.start()
+
+    db = get_db()
+    company_documents_collection = db["company_documents"]
+    vector_store_outbox = db[OUTBOX_COLLECTION]
+    document_stats_collection = db[DOCUMENT_STATS_COLLECTION]
+    latency_snapshot_collection = db[LATENCY_SNAPSHOT_COLLECTION]
+    chroma_client = get_chroma_client()
+
+    try:
+        await asyncio.to_thread(ensure_document_indexes, company_documents_collection)
+        await asyncio.to_thread(ensure_outbox_indexes, vector_store_outbox)
+        await asyncio.to_thread(ensure_snapshot_indexes, latency_snapshot_collection)
+    except Exception as e:
+        print(f"Error creating document indexes: {str(e)}")
+
+    # Background worker retrying vector store updates recorded in the outbox
+    # Cached retrieval results are dropped after each applied entry, once Chroma holds the new metadata
+    outbox_worker = asyncio.create_task(run_outbox_worker(vector_store_outbox, company_documents_collection, chroma_client, on_synced=retrieval_cache.clear))
+
+    # Write-behind buffer for gamification activity events
+    await activity_buffer.start()
+
+    # Leaderboard full reloads (incremental updates come from activity tracking)
+    leaderboard_refresher = asyncio.create_task(run_leaderboard_refresher())
+
+    # Document stats rebuilds (incremental updates come from upload, delete and update)
+    document_stats_reconciler = asyncio.create_task(run_document_stats_reconciler(company_documents_collection, document_stats_collection))
+
+    # Periodic latency percentile snapshots for trend charts
+    latency_snapshotter = asyncio.create_task(run_latency_snapshotter(latency_snapshot_collection))
+
+    # Logs the endpoint and stack whenever a handler blocks the event loop
+    loop_monitor.start(app.routes)
+    yield
+    loop_monitor.stop()
+    # Flush queued activity events before shutting down
+    await activity_buffer.stop()
+    background_tasks = [latency_snapshotter, document_stats_reconciler, leaderboard_refresher, outbox_worker]
+    for task in background_tasks:
+        task.cancel()
+    # Wait for them (and any thread they started) to stop before closing the clients they use
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await close_mongodb_clients()
+    await close_supabase()
+    await close_ai_clients()
+    await cache_backend.stop()
+    shutdown_tracing()
 
 # Initialise FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware to allow frontend requests
 app.add_middleware(
@@ -90,6 +188,22 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+# Record the latency of every matched endpoint, keyed by method and route template, and open the request's root span
+# For streaming responses this is the time until headers are sent, the streamed body is measured per stage
+@app.middleware("http")
+async def record_endpoint_latency(request: Request, call_next):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    with traced(f"{request.method} {request.url.path}", {"http.method": request.method}) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        route = request.scope.get("route")
+        if route is not None:
+            span.update_name(f"{request.method} {route.path}")
+            span.set_attribute("http.route", route.path)
+            latency_metrics.record(f"{request.method} {route.path}", (loop.time() - started) * 1000)
+    return response
+
 # Gamification routes
 app.include_router(gamification_router)
 
@@ -111,6 +225,19 @@ class PaginatedDocumentsResponse(BaseModel):
     page: int
     page_size: int
     total_pages: int
+    next_cursor: Optional[str] = None
+
+class TagFacet(BaseModel):
+    tag: str
+    count: int
+
+class DocumentSearchResponse(BaseModel):
+    documents: List[DocumentResponse]
+    total: int
+    page: int
+    page_size: int
+    total_pages: int
+    tag_facets: List[TagFacet]
 
 class DocumentDelete(BaseModel):
     document_ids: List[str]
@@ -170,8 +297,33 @@ def format_file_size(size_bytes: int) -> str:
         i += 1
     return f"{size_bytes:.1f} {size_names[i]}"
 
+# Helper functions for the opaque keyset cursor used by document pagination
+# The cursor encodes the (filename, _id) of the last document on the previous page
+def encode_document_cursor(filename: str, doc_id: ObjectId) -> str:
+    payload = json.dumps({"f": filename, "id": str(doc_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_document_cursor(cursor: str):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return payload["f"], ObjectId(payload["id"])
+
+# Helper function to get the (cached, possibly slightly stale) number of documents visible to an access level
+async def get_document_count(documents, min_access_level: int) -> int:
+    async def count():
+        if min_access_level >= max(ACCESS_HIERARCHY.values()):
+            # Every document is visible, so the collection metadata count is enough
+            return await documents.estimated_document_count()
+        return await documents.count_documents({"access_level_num": {"$lte": min_access_level}})
+
+    return await document_count_cache.get_or_set(min_access_level, count)
+
 # Function to process and store uploaded document embeddings in Chroma
-def process_and_store_document(file_content: bytes, doc_id: str, filename: str, tags_list: List[str], access_level: str, chroma_client: Chroma):
+# pdfplumber and the text splitter are imported on first use, only uploads need them
+def process_and_store_document(file_content: bytes, doc_id: str, filename: str, tags_list: List[str], access_level: str, chroma_client: "Chroma"):
+    import pdfplumber
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     try:
         # Extract text from PDF
         with pdfplumber.open(io.BytesIO(file_content)) as pdf:
@@ -209,20 +361,34 @@ def process_and_store_document(file_content: bytes, doc_id: str, filename: str,
         print(f"Error processing document: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
-# Function to return retriever instance, retriever instances are cached per access level
-@lru_cache(maxsize=10)
-def get_cached_retriever_with_scores(access_level: int):
-    def search_with_scores(query: str, k: int = 3):
-        return chroma_client.similarity_search_with_score(
+# Function to search Chroma for the chunks closest to a question, within an access level
+def search_with_scores(query: str, access_level: int, k: int = 3):
+    with traced("chroma.similarity_search", {"db.system": "chroma", "db.operation": "query", "db.target": "company_documents", "els.access_level": access_level, "retrieval.k": k}) as span:
+        results = get_chroma_client().similarity_search_with_score(
             query,
             k=k,
             filter={"access_level_num": {"$lte": access_level}}
         )
-    return search_with_scores
+        span.set_attribute("retrieval.chunk_count", len(results))
+        return results
+
+# Function to retrieve (document, score) pairs through the retrieval cache
+# Repeated questions at the same access level skip the embedding call and the Chroma query
+async def retrieve_with_scores(query: str, access_level: int, k: int = 3):
+    from langchain_core.documents import Document
+
+    question_hash = hashlib.sha256(query.strip().encode()).hexdigest()
+
+    async def search():
+        results = await asyncio.to_thread(search_with_scores, query, access_level, k)
+        return [{"page_content": doc.page_content, "metadata": doc.metadata, "score": float(score)} for doc, score in results]
+
+    chunks = await retrieval_cache.get_or_set((access_level, k, question_hash), search)
+    return [(Document(page_content=chunk["page_content"], metadata=chunk["metadata"]), chunk["score"]) for chunk in chunks]
 
 # Upload endpoint
 @app.post("/api/upload")
-async def upload_document(file: UploadFile = File(...), tags: str = Form(...), access_level: str = Form(...), current_user: UserContext = Depends(get_current_user)):
+async def upload_document(file: UploadFile = File(...), tags: str = Form(...), access_level: str = Form(...), current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db), async_fs: AsyncGridFSBucket = Depends(get_async_fs)):
     try:
         # Only admins and internal employees can upload documents
         if current_user.role not in ["admin", "internal-employee"]:
@@ -257,12 +423,15 @@ async def upload_document(file: UploadFile = File(...), tags: str = Form(...), a
         # Store file in GridFS
         # This creates entries in fs.files (one per uploaded file) and fs.chunks (multiple entries per file, depending on its size)
         # The file_id returned is stored in the company_documents_collection as file_id, linking the metadata to the gridfs-stored file
-        file_id = fs.put(
-            file_content,
-            filename=file.filename,
-            content_type="application/pdf",
-            upload_date=datetime.now()
-        )
+        # Stored zstd-compressed when that saves space, downloads decompress transparently
+        # (compressed in a worker thread, level 10 on a 10 MB file would block the event loop)
+        stored_content, compression_fields = await asyncio.to_thread(compress_for_storage, file_content)
+        with traced("gridfs.write", {"db.system": "mongodb", "db.operation": "write", "db.target": "fs", "storage.bytes": len(stored_content), "storage.compression": compression_fields["compression"] or "none"}):
+            file_id = await async_fs.upload_from_stream(
+                file.filename,
+                stored_content,
+                metadata={"compression": compression_fields["compression"], "content_type": "application/pdf"}
+            )
         
         # Create document metadata
         document_data = {
@@ -274,22 +443,41 @@ async def upload_document(file: UploadFile = File(...), tags: str = Form(...), a
             "uploaded_by": current_user.email,
             "upload_date": datetime.now(),
             "size": format_file_size(file_size),
-            "size_bytes": file_size
+            "size_bytes": file_size,
+            **compression_fields
         }
         
         # Insert document metadata to company_documents_collection
-        result = company_documents_collection.insert_one(document_data)
+        result = await db["company_documents"].insert_one(document_data)
         doc_id = str(result.inserted_id)
         
         # Process and store uploaded document embeddings in Chroma
         try:
-            process_and_store_document(file_content, doc_id, file.filename, tags_list, access_level, chroma_client)
+            await asyncio.to_thread(process_and_store_document, file_content, doc_id, file.filename, tags_list, access_level, get_chroma_client())
         except Exception as e:
             # If embedding fails, clean up Mongodb entries
-            company_documents_collection.delete_one({"_id": result.inserted_id})
-            fs.delete(file_id)
+            await db["company_documents"].delete_one({"_id": result.inserted_id})
+            await async_fs.delete(file_id)
             raise HTTPException(status_code=500, detail=f"Failed to process document: {str(e)}")
 
+        # Pre-render the first-page thumbnail, a failure here only means it is rendered on first request
+        try:
+            thumbnail_file_id = await asyncio.to_thread(store_page_image, get_fs(), file_content, doc_id, file.filename, 0)
+            page_count = await asyncio.to_thread(get_page_count, file_content)
+            await db["company_documents"].update_one(
+                {"_id": result.inserted_id},
+                {"$set": {"thumbnail_file_id": thumbnail_file_id, "page_count": page_count}}
+            )
+        except Exception as e:
+            print(f"Error rendering thumbnail: {str(e)}")
+
+        await document_count_cache.clear()
+        await retrieval_cache.clear()
+        try:
+            await asyncio.to_thread(record_uploads, get_db()[DOCUMENT_STATS_COLLECTION], [document_data])
+        except Exception as e:
+            print(f"Error updating document stats: {str(e)}")
+
         return {
             "message": "Document uploaded successfully",
             "document_id": str(result.inserted_id),
@@ -303,8 +491,9 @@ async def upload_document(file: UploadFile = File(...), tags: str = Form(...), a
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 # Retrieve documents endpoint
+# Pass the next_cursor of the previous response as cursor for keyset pagination, page/skip is kept for direct page jumps
 @app.get("/api/documents", response_model=PaginatedDocumentsResponse)
-async def get_documents(page: int = 1, page_size: int = 10, current_user: UserContext = Depends(get_current_user)):
+async def get_documents(page: int = 1, page_size: int = 10, cursor: Optional[str] = None, current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db)):
     try:
         if page < 1:
             page = 1
@@ -313,14 +502,34 @@ async def get_documents(page: int = 1, page_size: int = 10, current_user: UserCo
         
         query = {"access_level_num": {"$lte": current_user.min_access_level}}
 
-        # Get total count
-        total_documents = company_documents_collection.count_documents(query)
-
-        # Calculate pagination
-        skip = (page - 1) * page_size
+        # Get total count (cached per access level)
+        total_documents = await get_document_count(db["company_documents"], current_user.min_access_level)
         total_pages = (total_documents + page_size - 1) // page_size
 
-        # Fetch paginated documents
+        skip = 0
+        if cursor:
+            # Seek past the last (filename, _id) of the previous page instead of skipping N documents
+            try:
+                last_filename, last_id = decode_document_cursor(cursor)
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            
+            query["$or"] = [
+                {"filename": {"$gt": last_filename}},
+                {"filename": last_filename, "_id": {"$gt": last_id}}
+            ]
+        else:
+            skip = (page - 1) * page_size
+
+        documents_cursor = db["company_documents"].find(query)\
+            .sort([("filename", ASCENDING), ("_id", ASCENDING)])\
+            .skip(skip) # Ignore the first N documents, then start returning results (0 when using a cursor)
+
+        # Fetch one extra document to know whether there is a next page
+        docs = await documents_cursor.limit(page_size + 1).to_list()
+        has_next = len(docs) > page_size
+        docs = docs[:page_size]
+
         documents = [
             DocumentResponse(
                 id=str(doc["_id"]),
@@ -330,29 +539,143 @@ async def get_documents(page: int = 1, page_size: int = 10, current_user: UserCo
                 size=doc["size"],
                 access_level=doc["access_level"]
             )
-            for doc in company_documents_collection.find(query)
-                .sort("filename", 1)
-                .skip(skip) # Ignore the first N documents, then start returning results
-                .limit(page_size)
+            for doc in docs
         ]
 
+        next_cursor = encode_document_cursor(docs[-1]["filename"], docs[-1]["_id"]) if has_next else None
+
         return PaginatedDocumentsResponse(
             documents=documents,
             total=total_documents,
             page=page,
             page_size=page_size,
-            total_pages=total_pages
+            total_pages=total_pages,
+            next_cursor=next_cursor
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error fetching documents: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch documents")
 
+# Search documents endpoint
+# Filters by tags (any of), access level, upload date range and filename (prefix or word match)
+# Results, total and per-tag facet counts come back from a single $facet aggregation
+@app.get("/api/documents/search", response_model=DocumentSearchResponse)
+async def search_documents(
+    q: Optional[str] = None,
+    match: str = "prefix",
+    tags: Optional[List[str]] = Query(None),
+    access_level: Optional[str] = None,
+    uploaded_from: Optional[date] = None,
+    uploaded_to: Optional[date] = None,
+    page: int = 1,
+    page_size: int = 10,
+    current_user: UserContext = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_async_db)
+):
+    try:
+        if page < 1:
+            page = 1
+        if page_size < 1 or page_size > 100:
+            page_size = 10
+        if match not in ["prefix", "text"]:
+            raise HTTPException(status_code=400, detail="match must be 'prefix' or 'text'")
+        
+        query = {"access_level_num": {"$lte": current_user.min_access_level}}
+
+        if access_level is not None:
+            if access_level not in ACCESS_HIERARCHY:
+                raise HTTPException(status_code=400, detail="Invalid access level")
+            if ACCESS_HIERARCHY[access_level] > current_user.min_access_level:
+                return DocumentSearchResponse(documents=[], total=0, page=page, page_size=page_size, total_pages=0, tag_facets=[])
+            query["access_level_num"] = ACCESS_HIERARCHY[access_level]
+        
+        if tags:
+            query["tags"] = {"$in": tags}
+        
+        if uploaded_from or uploaded_to:
+            query["upload_date"] = {}
+            if uploaded_from:
+                query["upload_date"]["$gte"] = datetime.combine(uploaded_from, time.min)
+            if uploaded_to:
+                # Inclusive of the whole end day
+                query["upload_date"]["$lt"] = datetime.combine(uploaded_to + timedelta(days=1), time.min)
+        
+        sort = {"filename": 1, "_id": 1}
+        pipeline = []
+        q = q.strip() if q else None
+        if q and match == "text":
+            # $text must be in the first stage, results are ranked by relevance
+            query["$text"] = {"$search": q}
+            pipeline.append({"$match": query})
+            pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+            sort = {"score": -1, "filename": 1, "_id": 1}
+        else:
+            if q:
+                # Anchored, case-sensitive regex so the filename index can be used
+                query["filename"] = {"$regex": f"^{re.escape(q)}"}
+            pipeline.append({"$match": query})
+        
+        skip = (page - 1) * page_size
+        pipeline.append({"$facet": {
+            "documents": [
+                {"$sort": sort},
+                {"$skip": skip},
+                {"$limit": page_size},
+                {"$project": {"filename": 1, "tags": 1, "upload_date": 1, "size": 1, "access_level": 1}}
+            ],
+            "total": [{"$count": "count"}],
+            "tag_facets": [
+                {"$unwind": "$tags"},
+                {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}}
+            ]
+        }})
+
+        results = await (await db["company_documents"].aggregate(pipeline)).to_list(1)
+        result = results[0] if results else {}
+
+        total_documents = result["total"][0]["count"] if result.get("total") else 0
+        total_pages = (total_documents + page_size - 1) // page_size
+
+        documents = [
+            DocumentResponse(
+                id=str(doc["_id"]),
+                filename=doc["filename"],
+                tags=doc.get("tags", []),
+                uploadDate=doc["upload_date"].isoformat(),
+                size=doc["size"],
+                access_level=doc["access_level"]
+            )
+            for doc in result.get("documents", [])
+        ]
+
+        tag_facets = [
+            TagFacet(tag=facet["_id"], count=facet["count"])
+            for facet in result.get("tag_facets", [])
+        ]
+
+        return DocumentSearchResponse(
+            documents=documents,
+            total=total_documents,
+            page=page,
+            page_size=page_size,
+            total_pages=total_pages,
+            tag_facets=tag_facets
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error searching documents: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to search documents")
+
 # Download document endpoint
 @app.get("/api/documents/{document_id}/download")
-async def download_document(document_id: str, current_user: UserContext = Depends(get_current_user)):
+async def download_document(document_id: str, current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db), async_fs: AsyncGridFSBucket = Depends(get_async_fs)):
     try:
         # Find document metadata in MongoDB
-        document = company_documents_collection.find_one({
+        document = await db["company_documents"].find_one({
             "_id": ObjectId(document_id),
             "access_level_num": {"$lte": current_user.min_access_level}
         })
@@ -361,7 +684,7 @@ async def download_document(document_id: str, current_user: UserContext = Depend
             raise HTTPException(status_code=404, detail="Document not found or access denied")
         
         # Get the actual binary PDF file from GridFS using file_id
-        file_data = fs.get(document["file_id"])
+        file_data = await async_fs.open_download_stream(document["file_id"])
         if not file_data:
             raise HTTPException(status_code=404, detail="File not found")
         
@@ -371,11 +694,12 @@ async def download_document(document_id: str, current_user: UserContext = Depend
             "Content-Type": "application/pdf",
             "Cache-Control": "public, max-age=3600" # cache for 1 hour
         }
+        if document.get("size_bytes"):
+            headers["Content-Length"] = str(document["size_bytes"])
 
-        pdf_bytes = file_data.read()
-        
-        return Response(
-            content=pdf_bytes,
+        # Stream the file in chunks, decompressing if it is stored compressed
+        return StreamingResponse(
+            iter_stored_file_async(file_data, document.get("compression")),
             media_type="application/pdf",
             headers=headers
         )
@@ -383,41 +707,167 @@ async def download_document(document_id: str, current_user: UserContext = Depend
         print(f"Download error: {str(e)}")
         raise HTTPException(status_code=500, detail="Download failed")
 
+# Helper function to serve a rendered page image from GridFS, rendering and storing it first if needed
+async def serve_page_image(document_id: str, page_number: int, kind: str, if_none_match: Optional[str], current_user: UserContext, db: AsyncDatabase, async_fs: AsyncGridFSBucket):
+    document = await db["company_documents"].find_one({
+        "_id": ObjectId(document_id),
+        "access_level_num": {"$lte": current_user.min_access_level}
+    })
+
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found or access denied")
+    
+    if kind == "thumbnail":
+        image_file_id = document.get("thumbnail_file_id")
+    else:
+        image_file_id = (document.get("page_preview_file_ids") or {}).get(str(page_number))
+    
+    if not image_file_id:
+        # Not rendered yet (older uploads, or a preview page requested for the first time)
+        page_count = document.get("page_count")
+        if page_count is not None and page_number > page_count:
+            raise HTTPException(status_code=404, detail="Page not found")
+        
+        pdf_bytes = await read_stored_file_async(async_fs, document)
+        try:
+            image_file_id = await asyncio.to_thread(store_page_image, get_fs(), pdf_bytes, document_id, document["filename"], page_number - 1, kind)
+        except IndexError:
+            raise HTTPException(status_code=404, detail="Page not found")
+        
+        # Only the first request to finish rendering stores its image, a concurrent one deletes its copy
+        field = "thumbnail_file_id" if kind == "thumbnail" else f"page_preview_file_ids.{page_number}"
+        result = await db["company_documents"].update_one({"_id": document["_id"], field: None}, {"$set": {field: image_file_id}})
+        if result.matched_count == 0:
+            await async_fs.delete(image_file_id)
+            document = await db["company_documents"].find_one({"_id": document["_id"]}, {"thumbnail_file_id": 1, "page_preview_file_ids": 1})
+            if not document:
+                raise HTTPException(status_code=404, detail="Document not found or access denied")
+            if kind == "thumbnail":
+                image_file_id = document.get("thumbnail_file_id")
+            else:
+                image_file_id = (document.get("page_preview_file_ids") or {}).get(str(page_number))
+    
+    headers = {
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+        "ETag": image_etag(image_file_id)
+    }
+
+    # Browser already has this image
+    if if_none_match == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    
+    with traced("gridfs.read", {"db.system": "mongodb", "db.operation": "read", "db.target": "fs", "els.document_id": document_id}) as span:
+        image_bytes = await (await async_fs.open_download_stream(image_file_id)).read()
+        span.set_attribute("storage.bytes", len(image_bytes))
+    return Response(content=image_bytes, media_type="image/jpeg", headers=headers)
+
+# Document thumbnail endpoint (first page, small)
+@app.get("/api/documents/{document_id}/thumbnail")
+async def get_document_thumbnail(document_id: str, if_none_match: Optional[str] = Header(None), current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db), async_fs: AsyncGridFSBucket = Depends(get_async_fs)):
+    try:
+        return await serve_page_image(document_id, 1, "thumbnail", if_none_match, current_user, db, async_fs)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Thumbnail error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch thumbnail")
+
+# Document page preview endpoint (low resolution, page numbers start at 1)
+@app.get("/api/documents/{document_id}/pages/{page_number}/preview")
+async def get_document_page_preview(document_id: str, page_number: int, if_none_match: Optional[str] = Header(None), current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db), async_fs: AsyncGridFSBucket = Depends(get_async_fs)):
+    try:
+        if page_number < 1:
+            raise HTTPException(status_code=404, detail="Page not found")
+        return await serve_page_image(document_id, page_number, "preview", if_none_match, current_user, db, async_fs)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Page preview error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch page preview")
+
+# Function to delete every Chroma chunk of the given documents, one $in filter per batch of ids
+def delete_document_chunks(doc_ids: List[str]):
+    chroma_client = get_chroma_client()
+    for i in range(0, len(doc_ids), CHROMA_DELETE_BATCH_SIZE):
+        batch = doc_ids[i:i + CHROMA_DELETE_BATCH_SIZE]
+        chroma_client._collection.delete(where={"doc_id": {"$in": batch}})
+
 # Delete documents endpoint
+# Set-based: one $in lookup, delete_many on metadata and GridFS, and $in deletes on the vector store
 @app.delete("/api/documents")
-async def delete_documents(request: DocumentDelete, current_user: UserContext = Depends(get_current_user)):
+async def delete_documents(request: DocumentDelete, current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db)):
     try:
         # Only admins and internal employees can delete documents
         if current_user.role not in ["admin", "internal-employee"]:
             raise HTTPException(status_code=403, detail="Only administrators or internal employees can delete documents")
         
-        deleted_count = 0
-        
+        # Per-id outcome: deleted, not_found or invalid_id
+        outcomes = {}
+        object_ids = []
         for doc_id in request.document_ids:
-            # Find document
-            document = company_documents_collection.find_one({"_id": ObjectId(doc_id)})
-            if document:
-                # Delete file from GridFS
-                fs.delete(document["file_id"])
-                
-                # Delete document metadata from company_documents collection
-                company_documents_collection.delete_one({"_id": ObjectId(doc_id)})
-                
-                # Delete from Chroma Cloud
-                try:
-                    # Get all chunk IDs for this document
-                    results = chroma_client.get(where={"doc_id": doc_id})
-                    if results and results['ids']:
-                        chroma_client.delete(ids=results['ids'])
-                except Exception as e:
-                    print(f"Error deleting from Chroma: {e}")
+            try:
+                object_ids.append(ObjectId(doc_id))
+            except Exception:
+                outcomes[doc_id] = "invalid_id"
+
+        # Resolve all documents in a single query
+        documents = await db["company_documents"].find(
+            {"_id": {"$in": object_ids}},
+            {"file_id": 1, "thumbnail_file_id": 1, "page_preview_file_ids": 1, "tags": 1, "size_bytes": 1, "stored_size_bytes": 1, "upload_date": 1}
+        ).to_list()
+        found_ids = [doc["_id"] for doc in documents]
+
+        # The PDFs plus their rendered thumbnails and page previews
+        file_ids = []
+        for doc in documents:
+            file_ids.extend(file_id for file_id in [doc.get("file_id"), doc.get("thumbnail_file_id")] if file_id)
+            file_ids.extend((doc.get("page_preview_file_ids") or {}).values())
+        found_doc_ids = [str(object_id) for object_id in found_ids]
+
+        vector_store_deleted = True
+        if found_ids:
+            # Delete document metadata from company_documents collection
+            await db["company_documents"].delete_many({"_id": {"$in": found_ids}})
+            try:
+                await asyncio.to_thread(record_deletes, get_db()[DOCUMENT_STATS_COLLECTION], documents)
+            except Exception as e:
+                print(f"Error updating document stats: {str(e)}")
 
-                deleted_count += 1
+            # Delete files from GridFS (fs.files entries and all their fs.chunks)
+            if file_ids:
+                await db["fs.files"].delete_many({"_id": {"$in": file_ids}})
+                await db["fs.chunks"].delete_many({"files_id": {"$in": file_ids}})
+            
+            # Delete all chunks of these documents from Chroma Cloud (blocking HTTP calls, in a worker thread)
+            try:
+                await asyncio.to_thread(delete_document_chunks, found_doc_ids)
+            except Exception as e:
+                # Leave it to the outbox worker, which deletes chunks of documents missing from MongoDB (and clears the cache)
+                vector_store_deleted = False
+                print(f"Error deleting from Chroma: {e}")
+                await asyncio.to_thread(enqueue_sync, get_db()[OUTBOX_COLLECTION], found_doc_ids)
+
+            await document_count_cache.clear()
+            if vector_store_deleted:
+                await retrieval_cache.clear()
+        
+        found_set = set(found_doc_ids)
+        for object_id in object_ids:
+            outcomes[str(object_id)] = "deleted" if str(object_id) in found_set else "not_found"
         
+        deleted_count = len(found_ids)
+
         return {
             "message": f"Successfully deleted {deleted_count} document(s)",
-            "deleted_count": deleted_count
+            "deleted_count": deleted_count,
+            "results": [
+                {"document_id": doc_id, "status": status}
+                for doc_id, status in outcomes.items()
+            ],
+            "vector_store_deleted": vector_store_deleted
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Delete error: {str(e)}")
         raise HTTPException(status_code=500, detail="Delete failed")
@@ -425,17 +875,15 @@ async def delete_documents(request: DocumentDelete, current_user: UserContext =
 # Chat endpoint with naive RAG
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest, current_user: UserContext = Depends(get_current_user)):
+    stage_prefix = "chat"
     try:
-        # Retriever
-        search_func = get_cached_retriever_with_scores(current_user.min_access_level)
-
         # Relevance threshold
         # For cosine distance: lower is better (typically 0.3-0.5)
         RELEVANCE_THRESHOLD = 0.45
         
-        # Parallel execution for chromadb retrieval
+        # Parallel execution for chromadb retrieval (cached per access level and question)
         docs_task = asyncio.create_task(
-            asyncio.to_thread(search_func, request.message, k=3)
+            retrieve_with_scores(request.message, current_user.min_access_level, k=3)
         )
 
         general_system_message = (
@@ -462,7 +910,8 @@ async def chat(request: ChatRequest, current_user: UserContext = Depends(get_cur
             "5. Be helpful, concise, and professional"
         )
 
-        docs_with_scores = await docs_task
+        with latency_metrics.measure(f"{stage_prefix}.retrieval"):
+            docs_with_scores = await docs_task
 
         # Filter by relevance score
         relevant_docs = [
@@ -483,15 +932,22 @@ async def chat(request: ChatRequest, current_user: UserContext = Depends(get_cur
             system_message = general_system_message
         
         # OpenAI call
-        response = await async_openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_content}
-            ],
-            temperature=0.2,
-            max_tokens=500
-        )
+        with latency_metrics.measure(f"{stage_prefix}.llm"), traced("openai.chat.completions", {"llm.model": "gpt-3.5-turbo", "llm.stream": False, "llm.max_tokens": 500, "retrieval.chunk_count": len(relevant_docs)}) as llm_span:
+            response = await get_openai_client().chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": user_content}
+                ],
+                temperature=0.2,
+                max_tokens=500
+            )
+            if response.usage:
+                set_attributes(llm_span, {
+                    "llm.prompt_tokens": response.usage.prompt_tokens,
+                    "llm.completion_tokens": response.usage.completion_tokens,
+                    "llm.total_tokens": response.usage.total_tokens
+                })
 
         answer = response.choices[0].message.content.strip()
 
@@ -516,17 +972,15 @@ async def chat(request: ChatRequest, current_user: UserContext = Depends(get_cur
 # Chat endpoint (streaming)
 @app.post("/api/chat-streaming")
 async def chat_stream(request: ChatRequest, current_user: UserContext = Depends(get_current_user)):
+    stage_prefix = "chat_stream"
     try:
-        # Retriever
-        search_func = get_cached_retriever_with_scores(current_user.min_access_level)
-
         # Relevance threshold
         # For cosine distance: lower is better (typically 0.3-0.5)
         RELEVANCE_THRESHOLD = 0.45
         
-        # Parallel execution for chromadb retrieval
+        # Parallel execution for chromadb retrieval (cached per access level and question)
         docs_task = asyncio.create_task(
-            asyncio.to_thread(search_func, request.message, k=3)
+            retrieve_with_scores(request.message, current_user.min_access_level, k=3)
         )
 
         general_system_message = (
@@ -558,7 +1012,8 @@ async def chat_stream(request: ChatRequest, current_user: UserContext = Depends(
             "- Use headings (##) to organize longer responses"
         )
 
-        docs_with_scores = await docs_task
+        with latency_metrics.measure(f"{stage_prefix}.retrieval"):
+            docs_with_scores = await docs_task
 
         # Filter by relevance score
         relevant_docs = [
@@ -578,17 +1033,25 @@ async def chat_stream(request: ChatRequest, current_user: UserContext = Depends(
             user_content = f"Question: {request.message}"
             system_message = general_system_message
 
-        # Async OpenAI client with streaming
-        stream = await async_openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_content}
-            ],
-            temperature=0.2,
-            max_tokens=500,
-            stream=True
-        )
+        # Async OpenAI client with streaming (time until the stream is open, roughly time to first token)
+        # The span covers the whole stream, so it is ended by generate() rather than a with-block
+        llm_span = tracer.start_span("openai.chat.completions", attributes={"llm.model": "gpt-3.5-turbo", "llm.stream": True, "llm.max_tokens": 500, "retrieval.chunk_count": len(relevant_docs)})
+        llm_started = asyncio.get_running_loop().time()
+        try:
+            with latency_metrics.measure(f"{stage_prefix}.llm_open"):
+                stream = await get_openai_client().chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": user_content}
+                    ],
+                    temperature=0.2,
+                    max_tokens=500,
+                    stream=True
+                )
+        except Exception as e:
+            end_span(llm_span, e)
+            raise
 
         # Process sources
         async def process_sources():
@@ -615,20 +1078,30 @@ async def chat_stream(request: ChatRequest, current_user: UserContext = Depends(
 
         # Stream response to client
         async def generate():
+            chunk_count = 0
+            stream_error = None
             try:
                 # Stream content chunks
-                async for chunk in stream:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        yield f"data: {json.dumps({'content': content})}\n\n"
+                with latency_metrics.measure(f"{stage_prefix}.llm_stream"):
+                    async for chunk in stream:
+                        if chunk.choices[0].delta.content:
+                            if chunk_count == 0:
+                                llm_span.set_attribute("llm.time_to_first_token_ms", round((asyncio.get_running_loop().time() - llm_started) * 1000, 1))
+                            chunk_count += 1
+                            content = chunk.choices[0].delta.content
+                            yield f"data: {json.dumps({'content': content})}\n\n"
                 
                 # Send sources after content completes
                 sources = await sources_task
                 yield f"data: {json.dumps({'sources': sources, 'done': True, 'used_context': show_sources})}\n\n"
                 
             except Exception as e:
+                stream_error = e
                 print(f"Streaming error: {str(e)}")
                 yield f"data: {json.dumps({'error': 'Streaming failed', 'done': True})}\n\n"
+            finally:
+                llm_span.set_attribute("llm.chunk_count", chunk_count)
+                end_span(llm_span, stream_error)
 
         return StreamingResponse(
             generate(), 
@@ -645,7 +1118,7 @@ async def chat_stream(request: ChatRequest, current_user: UserContext = Depends(
 
 # Endpoint to fetch metadata of multiple specific documents from mongodb, to display a user's bookmarked documents in YourBookmarks page
 @app.post("/api/documents/batch", response_model=List[DocumentResponse])
-async def get_documents_batch(request: DocumentIdsRequest):
+async def get_documents_batch(request: DocumentIdsRequest, db: AsyncDatabase = Depends(get_async_db)):
     try:
         # Convert string Ids to ObjectIds
         object_ids = []
@@ -657,13 +1130,13 @@ async def get_documents_batch(request: DocumentIdsRequest):
                 continue
         
         # Fetch all documents in a single database query
-        docs_cursor = company_documents_collection.find({
+        docs = await db["company_documents"].find({
             "_id": {"$in": object_ids}
-        })
+        }).to_list()
 
         # Format the results
         documents = []
-        for doc in docs_cursor:
+        for doc in docs:
             documents.append(DocumentResponse(
                 id=str(doc["_id"]),
                 filename=doc["filename"],
@@ -680,20 +1153,23 @@ async def get_documents_batch(request: DocumentIdsRequest):
 
 # Endpoint to get all FAQs (filtered by user access level)
 @app.get("/api/faqs", response_model=List[FAQResponse])
-async def get_faqs(current_user: UserContext = Depends(get_current_user)):
+async def get_faqs(current_user: UserContext = Depends(get_current_user), supabase: AsyncClient = Depends(get_supabase)):
     try:
-        response = supabase.table("faqs").select("*").lte(
-            "access_level_num", current_user.min_access_level
-            ).order("category").order("created_at").execute()
-        
-        return response.data
+        async def load_faqs():
+            with traced("supabase.select", {"db.system": "postgresql", "db.operation": "select", "db.target": "faqs"}):
+                response = await supabase.table("faqs").select("*").lte(
+                    "access_level_num", current_user.min_access_level
+                    ).order("category").order("created_at").execute()
+            return response.data
+
+        return await faq_cache.get_or_set(current_user.min_access_level, load_faqs)
     except Exception as e:
         print(f"Error fetching FAQs: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch FAQs")
 
 # Endpoint to create FAQ (admin only)
 @app.post("/api/faqs", response_model=FAQResponse)
-async def create_faq(faq: FAQCreate, current_user: UserContext = Depends(get_current_user)):
+async def create_faq(faq: FAQCreate, current_user: UserContext = Depends(get_current_user), supabase: AsyncClient = Depends(get_supabase)):
     try:
         if current_user.role != "admin":
             raise HTTPException(status_code=403, detail="Only admins can create FAQs")
@@ -701,14 +1177,16 @@ async def create_faq(faq: FAQCreate, current_user: UserContext = Depends(get_cur
         # Convert access_level string to number
         access_level_num = ACCESS_HIERARCHY.get(faq.access_level, 0)
 
-        response = supabase.table("faqs").insert({
-            "question": faq.question,
-            "answer": faq.answer,
-            "category": faq.category,
-            "access_level": faq.access_level,
-            "access_level_num": access_level_num,
-            "created_by": current_user.user_id
-        }).execute()
+        with traced("supabase.insert", {"db.system": "postgresql", "db.operation": "insert", "db.target": "faqs"}):
+            response = await supabase.table("faqs").insert({
+                "question": faq.question,
+                "answer": faq.answer,
+                "category": faq.category,
+                "access_level": faq.access_level,
+                "access_level_num": access_level_num,
+                "created_by": current_user.user_id
+            }).execute()
+        await faq_cache.clear()
 
         return response.data[0]
     except Exception as e:
@@ -717,7 +1195,7 @@ async def create_faq(faq: FAQCreate, current_user: UserContext = Depends(get_cur
 
 # Endpoint to update FAQ (admin only)
 @app.put("/api/faqs/{faq_id}", response_model=FAQResponse)
-async def update_faq(faq_id: str, faq: FAQUpdate, current_user: UserContext = Depends(get_current_user)):
+async def update_faq(faq_id: str, faq: FAQUpdate, current_user: UserContext = Depends(get_current_user), supabase: AsyncClient = Depends(get_supabase)):
     try:
         if current_user.role != "admin":
             raise HTTPException(status_code=403, detail="Only admins can update FAQs")
@@ -728,10 +1206,12 @@ async def update_faq(faq_id: str, faq: FAQUpdate, current_user: UserContext = De
         if "access_level" in update_data:
             update_data["access_level_num"] = ACCESS_HIERARCHY.get(update_data["access_level"], 0)
         
-        response = supabase.table("faqs").update(update_data).eq("id", faq_id).execute()
+        with traced("supabase.update", {"db.system": "postgresql", "db.operation": "update", "db.target": "faqs"}):
+            response = await supabase.table("faqs").update(update_data).eq("id", faq_id).execute()
 
         if not response.data:
             raise HTTPException(status_code=404, detail="FAQ not found")
+        await faq_cache.clear()
 
         return response.data[0]
     except Exception as e:
@@ -740,15 +1220,17 @@ async def update_faq(faq_id: str, faq: FAQUpdate, current_user: UserContext = De
 
 # Endpoint to delete FAQ (admin only)
 @app.delete("/api/faqs/{faq_id}")
-async def delete_faq(faq_id: str, current_user: UserContext = Depends(get_current_user)):
+async def delete_faq(faq_id: str, current_user: UserContext = Depends(get_current_user), supabase: AsyncClient = Depends(get_supabase)):
     try:
         if current_user.role != "admin":
             raise HTTPException(status_code=403, detail="Only admins can delete FAQs")
         
-        response = supabase.table("faqs").delete().eq("id", faq_id).execute()
+        with traced("supabase.delete", {"db.system": "postgresql", "db.operation": "delete", "db.target": "faqs"}):
+            response = await supabase.table("faqs").delete().eq("id", faq_id).execute()
 
         if not response.data:
             raise HTTPException(status_code=404, detail="FAQ not found")
+        await faq_cache.clear()
 
         return {"message": "FAQ deleted successfully"}
     except Exception as e:
@@ -757,9 +1239,9 @@ async def delete_faq(faq_id: str, current_user: UserContext = Depends(get_curren
 
 # Endpoint to get current tags list
 @app.get("/api/tags")
-async def get_tags(current_user: UserContext = Depends(get_current_user)):
+async def get_tags(current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db)):
     try:
-        tags_config = db["system_config"].find_one({"type": "tags"})
+        tags_config = await db["system_config"].find_one({"type": "tags"})
         if isinstance(tags_config, dict) and "values" in tags_config:
             return {"tags": sorted(tags_config["values"])}
         else:
@@ -771,7 +1253,7 @@ async def get_tags(current_user: UserContext = Depends(get_current_user)):
 
 # Endpoint to update tags list (admin only)
 @app.put("/api/tags")
-async def update_tags(request: TagsManagement, current_user: UserContext = Depends(get_current_user)):
+async def update_tags(request: TagsManagement, current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db)):
     try:
         if current_user.role != "admin":
             raise HTTPException(status_code=403, detail="Only admins can update tags")
@@ -782,7 +1264,7 @@ async def update_tags(request: TagsManagement, current_user: UserContext = Depen
         cleaned_tags = list(set([tag.strip() for tag in request.tags if tag.strip()]))
 
         # Update or create tags configuration
-        db["system_config"].update_one(
+        await db["system_config"].update_one(
             {"type": "tags"},
             {"$set": {"values": cleaned_tags, "updated_at": datetime.now()}},
             upsert=True
@@ -800,13 +1282,13 @@ async def update_tags(request: TagsManagement, current_user: UserContext = Depen
 
 # Endpoint to update document metadata (admin)
 @app.patch("/api/documents/{document_id}")
-async def update_document(document_id: str, request: DocumentUpdate, current_user: UserContext = Depends(get_current_user)):
+async def update_document(document_id: str, request: DocumentUpdate, current_user: UserContext = Depends(get_current_user), db: AsyncDatabase = Depends(get_async_db)):
     try:
         if current_user.role != "admin":
             raise HTTPException(status_code=403, detail="Only admins can update document metadata")
         
         # Find document
-        document = company_documents_collection.find_one({"_id": ObjectId(document_id)})
+        document = await db["company_documents"].find_one({"_id": ObjectId(document_id)})
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
@@ -831,35 +1313,36 @@ async def update_document(document_id: str, request: DocumentUpdate, current_use
         update_data["updated_by"] = current_user.email
 
         # Update mongodb
-        company_documents_collection.update_one(
+        await db["company_documents"].update_one(
             {"_id": ObjectId(document_id)},
             {"$set": update_data}
         )
+        if "access_level_num" in update_data:
+            await document_count_cache.clear()
 
-        # Update chroma
-        try:
-            results = chroma_client.get(where={"doc_id": document_id})
-            if results and results.get("ids"):
-                chroma_metadata = {}
-                if request.tags is not None:
-                    chroma_metadata["tags"] = ",".join(request.tags)
-                if request.access_level is not None:
-                    chroma_metadata["access_level"] = request.access_level
-                    chroma_metadata["access_level_num"] = ACCESS_HIERARCHY[request.access_level]
-                
-                # Update all chunks for this document
-                for chunk_id in results["ids"]:
-                    chroma_client._collection.update(
-                        ids=[chunk_id],
-                        metadatas=[chroma_metadata]
-                    )
-        except Exception as e:
-            print(f"Error updating Chroma metadata: {e}")
+        if "tags" in update_data:
+            try:
+                await asyncio.to_thread(record_tag_change, get_db()[DOCUMENT_STATS_COLLECTION], document.get("tags", []), update_data["tags"])
+            except Exception as e:
+                print(f"Error updating document stats: {str(e)}")
+
+        # Update chroma through the outbox: record the change durably, then try to apply it straight away
+        # If the vector store is unavailable the background worker keeps retrying the entry
+        sync_db = get_db()
+        vector_store_outbox = sync_db[OUTBOX_COLLECTION]
+        entry_id = await asyncio.to_thread(enqueue_sync, vector_store_outbox, [document_id])
+        entry = await asyncio.to_thread(claim_entry, vector_store_outbox, entry_id)
+        vector_store_synced = await asyncio.to_thread(apply_entry, vector_store_outbox, sync_db["company_documents"], get_chroma_client(), entry) if entry else False
+        # Cached chunks carry the document metadata, drop them now that Chroma has the new one
+        # (otherwise the outbox worker does it once it applies the entry)
+        if vector_store_synced:
+            await retrieval_cache.clear()
         
         return {
             "message": "Document updated successfully",
             "document_id": document_id,
-            "updates": update_data
+            "updates": update_data,
+            "vector_store_synced": vector_store_synced
         }
     except HTTPException:
         raise
@@ -867,6 +1350,82 @@ async def update_document(document_id: str, request: DocumentUpdate, current_use
         print(f"Error updating document metadata: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to update document metadata")
 
+# Endpoint to reconcile MongoDB documents with the Chroma vector store (admin only)
+@app.post("/api/admin/reconcile")
+async def reconcile_documents(dry_run: bool = True, current_user: UserContext = Depends(get_current_user)):
+    try:
+        if current_user.role != "admin":
+            raise HTTPException(status_code=403, detail="Only admins can reconcile the vector store")
+        
+        report = await asyncio.to_thread(
+            reconcile_vector_store,
+            get_db()["company_documents"],
+            get_chroma_client(),
+            outbox=get_db()[OUTBOX_COLLECTION],
+            dry_run=dry_run
+        )
+        if report["vector_store_changed"]:
+            await retrieval_cache.clear()
+        return report
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Reconciliation error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Reconciliation failed")
+
+# Endpoint to report original vs stored (compressed) document storage (admin only)
+@app.get("/api/admin/storage-report")
+async def storage_report(current_user: UserContext = Depends(get_current_user)):
+    try:
+        if current_user.role != "admin":
+            raise HTTPException(status_code=403, detail="Only admins can view the storage report")
+        
+        return await asyncio.to_thread(get_storage_report, get_db()["company_documents"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Storage report error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch storage report")
+
+# Endpoint to list recent event loop stalls with the blocking endpoint and stack (admin only)
+@app.get("/api/admin/loop-stalls")
+async def loop_stalls(current_user: UserContext = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view loop stalls")
+    
+    return loop_monitor.get_report()
+
+# Endpoint to capture a sampling profile of the running server (admin only)
+# Returns collapsed stacks for flamegraph.pl or speedscope, e.g. /api/admin/profile?seconds=10
+# loop_only=true samples just the event loop thread, otherwise worker threads are included too
+@app.get("/api/admin/profile")
+async def profile_server(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(PROFILE_DEFAULT_INTERVAL_MS, ge=1, le=1000),
+    loop_only: bool = False,
+    current_user: UserContext = Depends(get_current_user)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can profile the server")
+    
+    if not profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already being captured")
+    try:
+        # Sampled from a worker thread so the loop keeps serving the traffic being profiled
+        collapsed = await asyncio.to_thread(sample_stacks, seconds, interval_ms, not loop_only, threading.get_ident())
+    finally:
+        profile_lock.release()
+    
+    return PlainTextResponse(
+        collapsed,
+        headers={"Content-Disposition": f'attachment; filename="profile_{datetime.now():%Y%m%d_%H%M%S}.collapsed"'}
+    )
+
+# Prometheus scrape endpoint with latency percentiles of endpoints and chat stages
+@app.get("/metrics")
+def metrics():
+    return Response(content=latency_metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 # Health check endpoint
 @app.get("/healthcheck")
 def health_check():
@@ -0,0 +1,89 @@
+from dotenv import load_dotenv
+from gridfs import GridFS, AsyncGridFSBucket
+from pymongo import MongoClient, AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.database import Database
+from typing import Any, Callable, Optional
+import asyncio
+import os
+
+# Shared MongoDB clients for the whole backend, so every module draws from the same connection pools.
+# Created once by the app lifespan (main.py) with init_mongodb, not at import, and handed out by the
+# get_* functions below (also usable as FastAPI dependencies):
+# - get_async_db / get_async_fs: used directly by request handlers (never blocks the event loop)
+# - get_db / get_fs: for code that already runs in worker threads (outbox worker, reconciliation,
+#   stats rebuilds, page rendering)
+# Pool sizes are tuned for a single API process: enough connections for concurrent requests without
+# exhausting the cluster's connection limit, idle connections recycled, and a bounded wait for a free
+# connection so overload surfaces as an error instead of an ever-growing queue.
+load_dotenv()
+mongodb_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
+DATABASE_NAME = "els_db"
+
+MONGODB_CLIENT_OPTIONS = {
+    "tls": True,
+    "tlsAllowInvalidCertificates": True,
+    "maxIdleTimeMS": 300000,
+    "waitQueueTimeoutMS": 5000,
+    "serverSelectionTimeoutMS": 5000,
+    "connectTimeoutMS": 5000,
+    "retryWrites": True,
+    "retryReads": True
+}
+ASYNC_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+ASYNC_MIN_POOL_SIZE = 5
+SYNC_MAX_POOL_SIZE = 20 # Bounded by the number of worker threads using it
+
+_async_mongodb_client: Optional[AsyncMongoClient] = None
+_mongodb_client: Optional[MongoClient] = None
+
+def init_mongodb():
+    """
+    Create both clients (called once from the app lifespan, in a thread: resolving a mongodb+srv URI blocks)
+    """
+    global _async_mongodb_client, _mongodb_client
+    _async_mongodb_client = AsyncMongoClient(
+        mongodb_uri,
+        maxPoolSize=ASYNC_MAX_POOL_SIZE,
+        minPoolSize=ASYNC_MIN_POOL_SIZE,
+        **MONGODB_CLIENT_OPTIONS
+    )
+    _mongodb_client = MongoClient(mongodb_uri, maxPoolSize=SYNC_MAX_POOL_SIZE, **MONGODB_CLIENT_OPTIONS)
+
+async def close_mongodb_clients():
+    global _async_mongodb_client, _mongodb_client
+    if _async_mongodb_client is not None:
+        await _async_mongodb_client.close()
+    if _mongodb_client is not None:
+        _mongodb_client.close()
+    _async_mongodb_client = None
+    _mongodb_client = None
+
+async def run_sync_in_thread(func: Callable, *args) -> Any:
+    """
+    asyncio.to_thread for work on the sync client from background loops. If the loop is cancelled
+    (app shutdown), the thread is waited for before the cancellation propagates, so the lifespan
+    never closes the client under a running thread.
+    """
+    work = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(work)
+    except asyncio.CancelledError:
+        await asyncio.wait([work])
+        raise
+
+def get_async_db() -> AsyncDatabase:
+    if _async_mongodb_client is None:
+        raise RuntimeError("MongoDB clients not initialised, they are created by the app lifespan")
+    return _async_mongodb_client[DATABASE_NAME]
+
+def get_async_fs() -> AsyncGridFSBucket:
+    return AsyncGridFSBucket(get_async_db()) # Same fs.files / fs.chunks as GridFS(db)
+
+def get_db() -> Database:
+    if _mongodb_client is None:
+        raise RuntimeError("MongoDB clients not initialised, they are created by the app lifespan")
+    return _mongodb_client[DATABASE_NAME]
+
+def get_fs() -> GridFS:
+    return GridFS(get_db())
@@ -0,0 +1,67 @@
+from datetime import datetime
+import io
+import threading
+import pypdfium2 as pdfium
+from tracing import traced
+
+# Rendered page images are stored in GridFS next to the PDFs so browsing the library transfers
+# a few KB per document instead of the whole file. They never change once rendered (a document's PDF
+# is immutable after upload), so they are served with long-lived cache headers keyed on the GridFS id.
+THUMBNAIL_WIDTH_PX = 240
+PREVIEW_WIDTH_PX = 800
+JPEG_QUALITY = 70
+
+IMAGE_CACHE_CONTROL = "private, max-age=604800, immutable" # 7 days
+
+# pdfium is not thread-safe and these functions run in worker threads (asyncio.to_thread) from several
+# endpoints at once, so every pypdfium2 call goes through this lock
+PDFIUM_LOCK = threading.Lock()
+
+def render_page_jpeg(pdf_bytes: bytes, page_index: int, width_px: int) -> bytes:
+    """
+    Render one PDF page to a JPEG scaled to the given width
+    """
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            if page_index < 0 or page_index >= len(pdf):
+                raise IndexError(f"Page {page_index + 1} out of range")
+
+            page = pdf[page_index]
+            scale = width_px / page.get_width()
+            # convert copies the pixels out of the pdfium bitmap before the document is closed
+            image = page.render(scale=scale).to_pil().convert("RGB")
+        finally:
+            pdf.close()
+
+    # JPEG encoding does not touch pdfium, it runs outside the lock
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+def get_page_count(pdf_bytes: bytes) -> int:
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def store_page_image(fs, pdf_bytes: bytes, document_id: str, filename: str, page_index: int, kind: str = "thumbnail"):
+    """
+    Render a page (thumbnail or preview) and store it in GridFS. Returns the GridFS file id.
+    """
+    width_px = THUMBNAIL_WIDTH_PX if kind == "thumbnail" else PREVIEW_WIDTH_PX
+    image_bytes = render_page_jpeg(pdf_bytes, page_index, width_px)
+
+    with traced("gridfs.write", {"db.system": "mongodb", "db.operation": "write", "db.target": "fs", "storage.bytes": len(image_bytes), "els.document_id": document_id}):
+        return fs.put(
+            image_bytes,
+            filename=f"{filename}.{kind}.p{page_index + 1}.jpg",
+            content_type="image/jpeg",
+            upload_date=datetime.now(),
+            metadata={"kind": kind, "document_id": document_id, "page": page_index + 1}
+        )
+
+def image_etag(file_id) -> str:
+    return f'"{file_id}"'
@@ -0,0 +1,169 @@
+from bson import ObjectId
+from datetime import datetime
+from typing import Optional
+import argparse
+import json
+import os
+import time
+
+from vector_sync import OUTBOX_COLLECTION, build_chunk_metadata, sync_documents
+
+# Reconciliation between company_documents (MongoDB) and the company_documents collection in Chroma.
+# Both stores are streamed in pages, compared by doc_id with set operations, and then:
+# - orphan chunks (doc_id no longer in MongoDB) are deleted, after re-checking their doc_ids against MongoDB
+#   (a document uploaded during the run is missing from the snapshot but must keep its chunks)
+# - drifted chunks (tags / access level differing from MongoDB) get their metadata rewritten from the
+#   documents' current state, re-read at fix time (the scan snapshot may predate an access level change)
+# - documents with no chunks at all are reported (they need re-processing, not a metadata fix)
+RECONCILE_PAGE_SIZE = 500
+
+# Metadata keys that must match MongoDB for retrieval filters and sources to be correct
+SYNCED_METADATA_KEYS = ["filename", "tags", "access_level", "access_level_num"]
+
+def _stream_mongo_documents(company_documents_collection, page_size: int):
+    """
+    Yield documents in _id order, one page per query
+    """
+    last_id: Optional[ObjectId] = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id else {}
+        page = list(
+            company_documents_collection.find(query, {"filename": 1, "tags": 1, "access_level": 1, "access_level_num": 1})
+                .sort("_id", 1)
+                .limit(page_size)
+        )
+        if not page:
+            break
+        yield from page
+        last_id = page[-1]["_id"]
+
+def _stream_chroma_chunks(chroma_client, page_size: int):
+    """
+    Yield (chunk_id, metadata) pairs from Chroma, one page per request
+    """
+    offset = 0
+    while True:
+        results = chroma_client._collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        chunk_ids = results.get("ids") or []
+        if not chunk_ids:
+            break
+        yield from zip(chunk_ids, results.get("metadatas") or [{}] * len(chunk_ids))
+        offset += len(chunk_ids)
+
+def _existing_doc_ids(company_documents_collection, doc_ids) -> set:
+    """
+    Subset of doc_ids that exist in MongoDB now, one $in query per page of ids
+    """
+    object_ids = [ObjectId(doc_id) for doc_id in doc_ids if doc_id and ObjectId.is_valid(doc_id)]
+    existing = set()
+    for i in range(0, len(object_ids), RECONCILE_PAGE_SIZE):
+        for doc in company_documents_collection.find({"_id": {"$in": object_ids[i:i + RECONCILE_PAGE_SIZE]}}, {"_id": 1}):
+            existing.add(str(doc["_id"]))
+    return existing
+
+def reconcile_vector_store(company_documents_collection, chroma_client, outbox=None, page_size: int = RECONCILE_PAGE_SIZE, dry_run: bool = False) -> dict:
+    """
+    Compare MongoDB and Chroma, fix orphans and metadata drift in batches, and report counts and timings.
+    With dry_run the counts are what would have been fixed.
+    """
+    started_at = datetime.now()
+    timings = {}
+
+    # Expected chunk metadata per document, from MongoDB
+    phase_start = time.perf_counter()
+    expected = {
+        str(doc["_id"]): build_chunk_metadata(doc)
+        for doc in _stream_mongo_documents(company_documents_collection, page_size)
+    }
+    mongo_doc_ids = set(expected)
+    timings["scan_mongo_ms"] = round((time.perf_counter() - phase_start) * 1000, 1)
+
+    # Actual chunks in Chroma, only the ids that need fixing are kept
+    phase_start = time.perf_counter()
+    vector_doc_ids = set()
+    orphan_chunk_ids = []
+    drifted_chunks = {}
+    total_chunks = 0
+    for chunk_id, metadata in _stream_chroma_chunks(chroma_client, page_size):
+        total_chunks += 1
+        metadata = metadata or {}
+        doc_id = metadata.get("doc_id")
+        vector_doc_ids.add(doc_id)
+
+        if doc_id not in mongo_doc_ids:
+            orphan_chunk_ids.append((chunk_id, doc_id))
+        elif any(metadata.get(key) != expected[doc_id][key] for key in SYNCED_METADATA_KEYS):
+            drifted_chunks.setdefault(doc_id, []).append(chunk_id)
+    timings["scan_vector_store_ms"] = round((time.perf_counter() - phase_start) * 1000, 1)
+
+    orphan_doc_ids = vector_doc_ids - mongo_doc_ids
+    documents_without_chunks = mongo_doc_ids - vector_doc_ids
+
+    # Documents created after the MongoDB scan are not orphans
+    created_during_run = _existing_doc_ids(company_documents_collection, orphan_doc_ids)
+    orphan_doc_ids -= created_during_run
+    orphan_chunk_ids = [chunk_id for chunk_id, doc_id in orphan_chunk_ids if doc_id not in created_during_run]
+
+    # Fix in batches
+    phase_start = time.perf_counter()
+    drifted_chunk_count = sum(len(chunk_ids) for chunk_ids in drifted_chunks.values())
+    if not dry_run:
+        for i in range(0, len(orphan_chunk_ids), page_size):
+            chroma_client._collection.delete(ids=orphan_chunk_ids[i:i + page_size])
+
+        # Same path as the outbox: re-reads each document from MongoDB, so a change made during the run is not reverted
+        drifted_doc_ids = list(drifted_chunks)
+        for i in range(0, len(drifted_doc_ids), page_size):
+            sync_documents(company_documents_collection, chroma_client, drifted_doc_ids[i:i + page_size])
+
+        # Outbox entries that gave up before this run are now covered by it
+        if outbox is not None:
+            outbox.delete_many({"status": "failed", "created_at": {"$lt": started_at}})
+    timings["fix_ms"] = round((time.perf_counter() - phase_start) * 1000, 1)
+    timings["total_ms"] = round(sum(timings.values()), 1)
+
+    return {
+        "dry_run": dry_run,
+        "started_at": started_at.isoformat(),
+        "mongo_documents": len(mongo_doc_ids),
+        "vector_store_documents": len(vector_doc_ids),
+        "vector_store_chunks": total_chunks,
+        "orphan_documents": len(orphan_doc_ids),
+        "orphan_chunks": len(orphan_chunk_ids),
+        "drifted_documents": len(drifted_chunks),
+        "drifted_chunks": drifted_chunk_count,
+        "vector_store_changed": not dry_run and bool(orphan_chunk_ids or drifted_chunks),
+        "documents_without_chunks": sorted(documents_without_chunks),
+        "timings": timings
+    }
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    from langchain_openai import OpenAIEmbeddings
+    from langchain_chroma import Chroma
+
+    parser = argparse.ArgumentParser(description="Reconcile MongoDB documents with the Chroma vector store")
+    parser.add_argument("--dry-run", action="store_true", help="Report differences without fixing them")
+    parser.add_argument("--page-size", type=int, default=RECONCILE_PAGE_SIZE)
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongodb_client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"), tls=True, tlsAllowInvalidCertificates=True)
+    db = mongodb_client["els_db"]
+    chroma_client = Chroma(
+        collection_name="company_documents",
+        embedding_function=OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY")),
+        chroma_cloud_api_key=os.getenv("CHROMA_API_KEY"),
+        tenant=os.getenv("CHROMA_TENANT"),
+        database=os.getenv("CHROMA_DATABASE")
+    )
+
+    report = reconcile_vector_store(
+        db["company_documents"],
+        chroma_client,
+        outbox=db[OUTBOX_COLLECTION],
+        page_size=args.page_size,
+        dry_run=args.dry_run
+    )
+    print(json.dumps(report, indent=2))
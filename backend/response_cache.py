@@ -0,0 +1,78 @@
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+import asyncio
+import time
+
+from cache import TieredCache
+
+# Response cache with stale-while-revalidate, stored in a TieredCache namespace (cache.py) so every
+# worker shares the entries when Redis is configured.
+# - younger than fresh_seconds: served from cache
+# - between fresh_seconds and stale_seconds: served from cache while one background task recomputes it
+# - older than stale_seconds, or missing: computed inline (concurrent callers in this worker share the same computation)
+# Values are stored with dump and rebuilt with load, so they can be models as long as dump makes them JSON-like.
+class StaleWhileRevalidateCache:
+    def __init__(
+        self,
+        namespace: str,
+        fresh_seconds: float = 300,
+        stale_seconds: float = 1800,
+        maxsize: int = 512,
+        dump: Callable[[Any], Any] = lambda value: value,
+        load: Callable[[Any], Any] = lambda value: value
+    ):
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self.dump = dump
+        self.load = load
+        self._entries = TieredCache(namespace, ttl_seconds=stale_seconds, maxsize=maxsize) # key -> {"value", "stored_at"}
+        self._in_flight: dict = {} # key -> asyncio.Task
+
+    def _start_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]], background: bool = False) -> asyncio.Task:
+        task = self._in_flight.get(key)
+        if task is not None:
+            return task
+
+        async def run():
+            try:
+                value = await compute()
+                # Wall clock, the entry may be read by another process
+                await self._entries.set(key, {"value": self.dump(value), "stored_at": time.time()})
+                return value
+            finally:
+                self._in_flight.pop(key, None)
+
+        task = asyncio.create_task(run())
+        if background:
+            # Registered once per task, however many STALE hits join it
+            task.add_done_callback(self._log_refresh_failure)
+        self._in_flight[key] = task
+        return task
+
+    @staticmethod
+    def _log_refresh_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Background cache refresh failed: {task.exception()}")
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """
+        Returns (value, status) where status is HIT, STALE or MISS
+        """
+        entry = await self._entries.get(key)
+        if entry is not None:
+            age = time.time() - entry["stored_at"]
+            if age < self.fresh_seconds:
+                return self.load(entry["value"]), "HIT"
+            if age < self.stale_seconds:
+                # A failed background refresh is logged and the stale value keeps being served
+                self._start_compute(key, compute, background=True)
+                return self.load(entry["value"]), "STALE"
+
+        # shield: a cancelled request must not cancel the computation other callers are waiting on
+        value = await asyncio.shield(self._start_compute(key, compute))
+        return value, "MISS"
+
+    async def purge(self, prefix: Optional[str] = None) -> int:
+        """
+        Drop all entries, or only those whose key starts with prefix (keys are tuples, prefix matches the first item)
+        """
+        return await self._entries.clear(prefix)
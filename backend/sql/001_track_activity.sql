@@ -0,0 +1,89 @@
+-- Atomic activity tracking for gamification_api.track_activity
+-- Increments the user's counters, logs the activity and returns the new stats in one round trip.
+-- The increments happen inside a single INSERT ... ON CONFLICT DO UPDATE, so concurrent events for the
+-- same user serialise on the row lock instead of overwriting each other (no lost updates).
+
+create or replace function public.track_activity(
+    p_user_id public.user_gamification.user_id%type,
+    p_activity_type text,
+    p_exp_earned integer,
+    p_metadata jsonb default null
+)
+returns setof public.user_gamification
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into public.activity_log (user_id, activity_type, exp_earned, metadata)
+    values (p_user_id, p_activity_type, p_exp_earned, p_metadata);
+
+    return query
+    insert into public.user_gamification as ug (
+        user_id,
+        total_exp,
+        questions_asked,
+        documents_viewed,
+        bookmarks_created,
+        last_activity_at
+    )
+    values (
+        p_user_id,
+        p_exp_earned,
+        case when p_activity_type = 'question_asked' then 1 else 0 end,
+        case when p_activity_type = 'document_viewed' then 1 else 0 end,
+        case when p_activity_type = 'bookmark_created' then 1 else 0 end,
+        now()
+    )
+    on conflict (user_id) do update set
+        total_exp = ug.total_exp + excluded.total_exp,
+        questions_asked = ug.questions_asked + excluded.questions_asked,
+        documents_viewed = ug.documents_viewed + excluded.documents_viewed,
+        bookmarks_created = ug.bookmarks_created + excluded.bookmarks_created,
+        last_activity_at = excluded.last_activity_at
+    returning ug.*;
+end;
+$$;
+
+-- Award a badge and its bonus EXP atomically. Returns false if the user already had it.
+create unique index if not exists user_badges_user_id_badge_id_key
+    on public.user_badges (user_id, badge_id);
+
+create or replace function public.award_badge(
+    p_user_id public.user_badges.user_id%type,
+    p_badge_id public.user_badges.badge_id%type
+)
+returns boolean
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_exp_reward integer;
+begin
+    insert into public.user_badges (user_id, badge_id)
+    values (p_user_id, p_badge_id)
+    on conflict (user_id, badge_id) do nothing;
+
+    if not found then
+        return false;
+    end if;
+
+    select exp_reward into v_exp_reward from public.badges where id = p_badge_id;
+
+    if coalesce(v_exp_reward, 0) > 0 then
+        update public.user_gamification
+        set total_exp = total_exp + v_exp_reward
+        where user_id = p_user_id;
+    end if;
+
+    return true;
+end;
+$$;
+
+-- Both functions are security definer and trust p_user_id / p_exp_earned, so only the backend
+-- (service_role, which applies EXP_REWARDS) may call them, not clients holding the publishable key
+revoke execute on function public.track_activity from public, anon, authenticated;
+revoke execute on function public.award_badge from public, anon, authenticated;
+grant execute on function public.track_activity to service_role;
+grant execute on function public.award_badge to service_role;
@@ -0,0 +1,51 @@
+-- Batched activity tracking used by the write-behind buffer in activity_buffer.py
+-- p_events is a JSON array of {user_id, activity_type, exp_earned, metadata, created_at}.
+-- All events are logged with one INSERT, counters are aggregated per user and applied with one
+-- INSERT ... ON CONFLICT DO UPDATE, and the new stats of every affected user are returned.
+
+create or replace function public.track_activity_batch(p_events jsonb)
+returns setof public.user_gamification
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into public.activity_log (user_id, activity_type, exp_earned, metadata, created_at)
+    select e.user_id, e.activity_type, e.exp_earned, e.metadata, coalesce(e.created_at, now())
+    from jsonb_populate_recordset(null::public.activity_log, p_events) as e;
+
+    return query
+    with totals as (
+        select
+            e.user_id,
+            sum(e.exp_earned) as exp_earned,
+            count(*) filter (where e.activity_type = 'question_asked') as questions_asked,
+            count(*) filter (where e.activity_type = 'document_viewed') as documents_viewed,
+            count(*) filter (where e.activity_type = 'bookmark_created') as bookmarks_created,
+            max(coalesce(e.created_at, now())) as last_activity_at
+        from jsonb_populate_recordset(null::public.activity_log, p_events) as e
+        group by e.user_id
+    )
+    insert into public.user_gamification as ug (
+        user_id,
+        total_exp,
+        questions_asked,
+        documents_viewed,
+        bookmarks_created,
+        last_activity_at
+    )
+    select user_id, exp_earned, questions_asked, documents_viewed, bookmarks_created, last_activity_at
+    from totals
+    on conflict (user_id) do update set
+        total_exp = ug.total_exp + excluded.total_exp,
+        questions_asked = ug.questions_asked + excluded.questions_asked,
+        documents_viewed = ug.documents_viewed + excluded.documents_viewed,
+        bookmarks_created = ug.bookmarks_created + excluded.bookmarks_created,
+        last_activity_at = greatest(ug.last_activity_at, excluded.last_activity_at)
+    returning ug.*;
+end;
+$$;
+
+-- Backend only, see 001_track_activity.sql
+revoke execute on function public.track_activity_batch from public, anon, authenticated;
+grant execute on function public.track_activity_batch to service_role;
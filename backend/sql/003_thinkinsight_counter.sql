@@ -0,0 +1,115 @@
+-- Maintained counter for documents_viewed_thinkinsight badges
+-- Badge checks read this column instead of selecting every matching activity_log row.
+
+alter table public.user_gamification
+    add column if not exists documents_viewed_thinkinsight integer not null default 0;
+
+-- Backfill from the existing activity history
+update public.user_gamification ug
+set documents_viewed_thinkinsight = counts.total
+from (
+    select user_id, count(*) as total
+    from public.activity_log
+    where activity_type = 'document_viewed_thinkinsight'
+    group by user_id
+) as counts
+where counts.user_id = ug.user_id;
+
+-- Same as 001_track_activity.sql, plus the thinkinsight counter
+create or replace function public.track_activity(
+    p_user_id public.user_gamification.user_id%type,
+    p_activity_type text,
+    p_exp_earned integer,
+    p_metadata jsonb default null
+)
+returns setof public.user_gamification
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into public.activity_log (user_id, activity_type, exp_earned, metadata)
+    values (p_user_id, p_activity_type, p_exp_earned, p_metadata);
+
+    return query
+    insert into public.user_gamification as ug (
+        user_id,
+        total_exp,
+        questions_asked,
+        documents_viewed,
+        bookmarks_created,
+        documents_viewed_thinkinsight,
+        last_activity_at
+    )
+    values (
+        p_user_id,
+        p_exp_earned,
+        case when p_activity_type = 'question_asked' then 1 else 0 end,
+        case when p_activity_type = 'document_viewed' then 1 else 0 end,
+        case when p_activity_type = 'bookmark_created' then 1 else 0 end,
+        case when p_activity_type = 'document_viewed_thinkinsight' then 1 else 0 end,
+        now()
+    )
+    on conflict (user_id) do update set
+        total_exp = ug.total_exp + excluded.total_exp,
+        questions_asked = ug.questions_asked + excluded.questions_asked,
+        documents_viewed = ug.documents_viewed + excluded.documents_viewed,
+        bookmarks_created = ug.bookmarks_created + excluded.bookmarks_created,
+        documents_viewed_thinkinsight = ug.documents_viewed_thinkinsight + excluded.documents_viewed_thinkinsight,
+        last_activity_at = excluded.last_activity_at
+    returning ug.*;
+end;
+$$;
+
+-- Same as 002_track_activity_batch.sql, plus the thinkinsight counter
+create or replace function public.track_activity_batch(p_events jsonb)
+returns setof public.user_gamification
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into public.activity_log (user_id, activity_type, exp_earned, metadata, created_at)
+    select e.user_id, e.activity_type, e.exp_earned, e.metadata, coalesce(e.created_at, now())
+    from jsonb_populate_recordset(null::public.activity_log, p_events) as e;
+
+    return query
+    with totals as (
+        select
+            e.user_id,
+            sum(e.exp_earned) as exp_earned,
+            count(*) filter (where e.activity_type = 'question_asked') as questions_asked,
+            count(*) filter (where e.activity_type = 'document_viewed') as documents_viewed,
+            count(*) filter (where e.activity_type = 'bookmark_created') as bookmarks_created,
+            count(*) filter (where e.activity_type = 'document_viewed_thinkinsight') as documents_viewed_thinkinsight,
+            max(coalesce(e.created_at, now())) as last_activity_at
+        from jsonb_populate_recordset(null::public.activity_log, p_events) as e
+        group by e.user_id
+    )
+    insert into public.user_gamification as ug (
+        user_id,
+        total_exp,
+        questions_asked,
+        documents_viewed,
+        bookmarks_created,
+        documents_viewed_thinkinsight,
+        last_activity_at
+    )
+    select user_id, exp_earned, questions_asked, documents_viewed, bookmarks_created, documents_viewed_thinkinsight, last_activity_at
+    from totals
+    on conflict (user_id) do update set
+        total_exp = ug.total_exp + excluded.total_exp,
+        questions_asked = ug.questions_asked + excluded.questions_asked,
+        documents_viewed = ug.documents_viewed + excluded.documents_viewed,
+        bookmarks_created = ug.bookmarks_created + excluded.bookmarks_created,
+        documents_viewed_thinkinsight = ug.documents_viewed_thinkinsight + excluded.documents_viewed_thinkinsight,
+        last_activity_at = greatest(ug.last_activity_at, excluded.last_activity_at)
+    returning ug.*;
+end;
+$$;
+
+-- Backend only, see 001_track_activity.sql
+revoke execute on function public.track_activity from public, anon, authenticated;
+revoke execute on function public.track_activity_batch from public, anon, authenticated;
+grant execute on function public.track_activity to service_role;
+grant execute on function public.track_activity_batch to service_role;
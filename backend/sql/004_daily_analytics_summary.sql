@@ -0,0 +1,79 @@
+-- Pre-aggregated daily_analytics for the Reports page (analytics_api.py)
+-- Returns the current and previous period totals and the current period's day-of-week buckets
+-- in one small JSON object, instead of every daily_analytics row of both windows:
+-- {
+--   "current":  {"total_questions", "total_documents_viewed", "active_users", "days"},
+--   "previous": {"total_questions", "total_documents_viewed", "active_users", "days"},
+--   "weekdays": [{"day_of_week" (0=Monday, 6=Sunday), "total_questions", "total_documents_viewed", "active_users"}]
+-- }
+-- user_role null means all roles. "days" is the number of distinct dates with rows, used for daily averages.
+
+create index if not exists daily_analytics_date_user_role_idx
+    on public.daily_analytics (date, user_role);
+
+create or replace function public.get_daily_analytics_summary(
+    start_date date,
+    end_date date,
+    prev_start_date date,
+    prev_end_date date,
+    user_role text default null
+)
+returns jsonb
+language sql
+stable
+security definer
+set search_path = public
+as $$
+    with rows as (
+        select
+            case when da.date >= start_date then 'current' else 'previous' end as period,
+            da.date,
+            da.total_questions,
+            da.total_documents_viewed,
+            da.active_users
+        from public.daily_analytics da
+        where da.date between prev_start_date and end_date
+          and (da.date between start_date and end_date or da.date between prev_start_date and prev_end_date)
+          and (get_daily_analytics_summary.user_role is null or da.user_role = get_daily_analytics_summary.user_role)
+    ),
+    totals as (
+        select
+            period,
+            jsonb_build_object(
+                'total_questions', coalesce(sum(total_questions), 0),
+                'total_documents_viewed', coalesce(sum(total_documents_viewed), 0),
+                'active_users', coalesce(sum(active_users), 0),
+                'days', count(distinct date)
+            ) as summary
+        from rows
+        group by period
+    ),
+    weekdays as (
+        select
+            extract(isodow from date)::int - 1 as day_of_week,
+            coalesce(sum(total_questions), 0) as total_questions,
+            coalesce(sum(total_documents_viewed), 0) as total_documents_viewed,
+            coalesce(sum(active_users), 0) as active_users
+        from rows
+        where period = 'current'
+        group by 1
+    )
+    select jsonb_build_object(
+        'current', coalesce(
+            (select summary from totals where period = 'current'),
+            '{"total_questions": 0, "total_documents_viewed": 0, "active_users": 0, "days": 0}'::jsonb
+        ),
+        'previous', coalesce(
+            (select summary from totals where period = 'previous'),
+            '{"total_questions": 0, "total_documents_viewed": 0, "active_users": 0, "days": 0}'::jsonb
+        ),
+        'weekdays', coalesce(
+            (select jsonb_agg(to_jsonb(w) order by w.day_of_week) from weekdays w),
+            '[]'::jsonb
+        )
+    );
+$$;
+
+-- Backend only, see 001_track_activity.sql (security definer, reads every role's analytics)
+revoke execute on function public.get_daily_analytics_summary from public, anon, authenticated;
+grant execute on function public.get_daily_analytics_summary to service_role;
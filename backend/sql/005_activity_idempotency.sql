@@ -0,0 +1,77 @@
+-- Idempotent batched activity tracking
+-- The write-behind buffer (activity_buffer.py) retries a failed batch, including after ambiguous
+-- failures such as a timeout after the transaction committed. Every buffered event now carries an
+-- event_id; activity_log rows are inserted with ON CONFLICT DO NOTHING on it, and the counters are
+-- incremented only from the rows actually inserted, so a retried batch is neither logged nor counted twice.
+-- Rows written by track_activity (direct path) have no event_id; NULLs never conflict.
+
+alter table public.activity_log
+    add column if not exists event_id uuid;
+
+create unique index if not exists activity_log_event_id_key
+    on public.activity_log (event_id);
+
+-- Same as 003_thinkinsight_counter.sql, counting only newly inserted events.
+-- Users whose events were all duplicates still get their current stats back.
+create or replace function public.track_activity_batch(p_events jsonb)
+returns setof public.user_gamification
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    return query
+    with inserted as (
+        insert into public.activity_log (event_id, user_id, activity_type, exp_earned, metadata, created_at)
+        select e.event_id, e.user_id, e.activity_type, e.exp_earned, e.metadata, coalesce(e.created_at, now())
+        from jsonb_populate_recordset(null::public.activity_log, p_events) as e
+        on conflict (event_id) do nothing
+        returning activity_log.user_id, activity_log.activity_type, activity_log.exp_earned, activity_log.created_at
+    ),
+    totals as (
+        select
+            i.user_id,
+            sum(i.exp_earned) as exp_earned,
+            count(*) filter (where i.activity_type = 'question_asked') as questions_asked,
+            count(*) filter (where i.activity_type = 'document_viewed') as documents_viewed,
+            count(*) filter (where i.activity_type = 'bookmark_created') as bookmarks_created,
+            count(*) filter (where i.activity_type = 'document_viewed_thinkinsight') as documents_viewed_thinkinsight,
+            max(i.created_at) as last_activity_at
+        from inserted i
+        group by i.user_id
+    ),
+    updated as (
+        insert into public.user_gamification as ug (
+            user_id,
+            total_exp,
+            questions_asked,
+            documents_viewed,
+            bookmarks_created,
+            documents_viewed_thinkinsight,
+            last_activity_at
+        )
+        select user_id, exp_earned, questions_asked, documents_viewed, bookmarks_created, documents_viewed_thinkinsight, last_activity_at
+        from totals
+        on conflict (user_id) do update set
+            total_exp = ug.total_exp + excluded.total_exp,
+            questions_asked = ug.questions_asked + excluded.questions_asked,
+            documents_viewed = ug.documents_viewed + excluded.documents_viewed,
+            bookmarks_created = ug.bookmarks_created + excluded.bookmarks_created,
+            documents_viewed_thinkinsight = ug.documents_viewed_thinkinsight + excluded.documents_viewed_thinkinsight,
+            last_activity_at = greatest(ug.last_activity_at, excluded.last_activity_at)
+        returning ug.*
+    )
+    select * from updated
+    union all
+    select current_stats.*
+    from public.user_gamification as current_stats
+    where current_stats.user_id in (
+            select e.user_id from jsonb_populate_recordset(null::public.activity_log, p_events) as e
+        )
+        and current_stats.user_id not in (select u.user_id from updated u);
+end;
+$$;
+
+-- Backend only, see 001_track_activity.sql
+revoke execute on function public.track_activity_batch from public, anon, authenticated;
+grant execute on function public.track_activity_batch to service_role;
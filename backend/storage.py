@@ -0,0 +1,160 @@
+from datetime import datetime
+from typing import AsyncIterator
+import argparse
+import asyncio
+import json
+import os
+import zstandard as zstd
+from tracing import traced, tracer, end_span
+
+# Transparent zstd compression for PDFs stored in GridFS.
+# company_documents records per file:
+#   compression: "zstd" or None (None = stored as-is, either incompressible or not migrated yet)
+#   stored_size_bytes: bytes actually stored in GridFS
+#   compression_ratio: size_bytes / stored_size_bytes
+# size_bytes / size keep describing the original PDF so the rest of the app is unaffected.
+ZSTD_LEVEL = 10
+MIN_SAVING_RATIO = 0.05 # Keep the compressed copy only if it saves at least 5%
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def compress_for_storage(content: bytes):
+    """
+    Returns (bytes to store, compression fields for company_documents)
+    """
+    compressed = zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(content)
+
+    if len(compressed) <= len(content) * (1 - MIN_SAVING_RATIO):
+        return compressed, {
+            "compression": "zstd",
+            "stored_size_bytes": len(compressed),
+            "compression_ratio": round(len(content) / len(compressed), 3)
+        }
+
+    return content, {
+        "compression": None,
+        "stored_size_bytes": len(content),
+        "compression_ratio": 1.0
+    }
+
+async def iter_stored_file_async(grid_out, compression) -> AsyncIterator[bytes]:
+    """
+    Stream the original bytes of a GridFS file from an AsyncGridOut (AsyncGridFSBucket.open_download_stream),
+    decompressing on the fly
+    """
+    # The span is ended explicitly: chunks are pulled after the endpoint returns
+    span = tracer.start_span("gridfs.read", attributes={"db.system": "mongodb", "db.operation": "read", "db.target": "fs", "storage.compression": compression or "none"})
+    decompressor = zstd.ZstdDecompressor().decompressobj() if compression == "zstd" else None
+    bytes_read = 0
+    error = None
+    try:
+        while True:
+            chunk = await grid_out.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+                if not chunk:
+                    continue
+            bytes_read += len(chunk)
+            yield chunk
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        span.set_attribute("storage.bytes", bytes_read)
+        end_span(span, error)
+
+async def read_stored_file_async(async_fs, document: dict) -> bytes:
+    """
+    Read the whole original file of a document through an AsyncGridFSBucket (decompression runs in a worker thread)
+    """
+    with traced("gridfs.read", {"db.system": "mongodb", "db.operation": "read", "db.target": "fs", "storage.compression": document.get("compression") or "none"}) as span:
+        grid_out = await async_fs.open_download_stream(document["file_id"])
+        content = await grid_out.read()
+        if document.get("compression") == "zstd":
+            content = await asyncio.to_thread(zstd.ZstdDecompressor().decompress, content)
+        span.set_attribute("storage.bytes", len(content))
+        return content
+
+def migrate_to_compressed(fs, company_documents_collection, dry_run: bool = False) -> dict:
+    """
+    Compress files stored before compression existed (documents without a compression field)
+    """
+    report = {"checked": 0, "compressed": 0, "left_uncompressed": 0, "bytes_before": 0, "bytes_after": 0, "errors": 0}
+
+    for document in company_documents_collection.find({"compression": {"$exists": False}}, {"file_id": 1, "filename": 1}):
+        report["checked"] += 1
+        try:
+            content = fs.get(document["file_id"]).read()
+            stored_content, compression_fields = compress_for_storage(content)
+            report["bytes_before"] += len(content)
+            report["bytes_after"] += compression_fields["stored_size_bytes"]
+
+            if compression_fields["compression"] is None:
+                report["left_uncompressed"] += 1
+                if not dry_run:
+                    company_documents_collection.update_one({"_id": document["_id"]}, {"$set": compression_fields})
+                continue
+
+            report["compressed"] += 1
+            if dry_run:
+                continue
+
+            # Write the compressed copy, point the document at it, then drop the original
+            new_file_id = fs.put(
+                stored_content,
+                filename=document["filename"],
+                content_type="application/pdf",
+                upload_date=datetime.now(),
+                metadata={"compression": "zstd"}
+            )
+            company_documents_collection.update_one(
+                {"_id": document["_id"]},
+                {"$set": {"file_id": new_file_id, **compression_fields}}
+            )
+            fs.delete(document["file_id"])
+        except Exception as e:
+            report["errors"] += 1
+            print(f"Error compressing {document.get('filename')}: {e}")
+
+    report["bytes_reclaimed"] = report["bytes_before"] - report["bytes_after"]
+    return report
+
+def get_storage_report(company_documents_collection) -> dict:
+    """
+    Original vs stored bytes across all documents
+    """
+    result = next(company_documents_collection.aggregate([
+        {"$group": {
+            "_id": None,
+            "documents": {"$sum": 1},
+            "compressed_documents": {"$sum": {"$cond": [{"$eq": ["$compression", "zstd"]}, 1, 0]}},
+            "original_bytes": {"$sum": "$size_bytes"},
+            "stored_bytes": {"$sum": {"$ifNull": ["$stored_size_bytes", "$size_bytes"]}}
+        }}
+    ]), None) or {"documents": 0, "compressed_documents": 0, "original_bytes": 0, "stored_bytes": 0}
+
+    result.pop("_id", None)
+    result["bytes_reclaimed"] = result["original_bytes"] - result["stored_bytes"]
+    result["overall_ratio"] = round(result["original_bytes"] / result["stored_bytes"], 3) if result["stored_bytes"] else 1.0
+    return result
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    from gridfs import GridFS
+
+    parser = argparse.ArgumentParser(description="Compression of stored PDFs")
+    parser.add_argument("command", choices=["migrate", "report"])
+    parser.add_argument("--dry-run", action="store_true", help="With migrate: report savings without rewriting files")
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongodb_client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"), tls=True, tlsAllowInvalidCertificates=True)
+    db = mongodb_client["els_db"]
+
+    if args.command == "migrate":
+        output = migrate_to_compressed(GridFS(db), db["company_documents"], dry_run=args.dry_run)
+    else:
+        output = get_storage_report(db["company_documents"])
+    print(json.dumps(output, indent=2))
@@ -0,0 +1,50 @@
+from dotenv import load_dotenv
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from typing import Optional
+import httpx
+import os
+
+# Shared async Supabase client for the whole backend.
+# One AsyncClient is created by the app lifespan (main.py) and used by main, analytics and gamification,
+# so every PostgREST call is awaited instead of blocking the event loop for a round trip, and all of
+# them reuse one HTTP/2 connection pool (requests are multiplexed over a few connections to Supabase
+# instead of opening one connection per concurrent call).
+load_dotenv()
+supabase_url = os.getenv("SUPABASE_URL")
+supabase_secret_key = os.getenv("SUPABASE_SECRET_KEY")
+
+SUPABASE_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+SUPABASE_HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+_supabase: Optional[AsyncClient] = None
+_http_client: Optional[httpx.AsyncClient] = None
+
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(http2=True, limits=SUPABASE_HTTP_LIMITS, timeout=SUPABASE_HTTP_TIMEOUT)
+
+async def create_supabase_client(http_client: httpx.AsyncClient, url: str = supabase_url, key: str = supabase_secret_key) -> AsyncClient:
+    return await acreate_client(url, key, options=AsyncClientOptions(httpx_client=http_client))
+
+async def init_supabase() -> AsyncClient:
+    """
+    Create the shared client (called once from the app lifespan)
+    """
+    global _supabase, _http_client
+    _http_client = create_http_client()
+    _supabase = await create_supabase_client(_http_client)
+    return _supabase
+
+async def close_supabase():
+    global _supabase, _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _supabase = None
+    _http_client = None
+
+def get_supabase() -> AsyncClient:
+    """
+    The shared client, usable directly or as a FastAPI dependency (Depends(get_supabase))
+    """
+    if _supabase is None:
+        raise RuntimeError("Supabase client not initialised, it is created by the app lifespan")
+    return _supabase
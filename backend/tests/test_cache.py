@@ -0,0 +1,96 @@
+import asyncio
+
+from cache import CacheBackend, TieredCache
+
+# TieredCache against the in-process fakeredis server (REDIS_URL=fakeredis://).
+# Two CacheBackend instances stand in for two uvicorn workers sharing one Redis.
+#   python -m pytest tests   (from backend/, after pip install -r requirements-dev.txt)
+
+async def start_workers(namespace: str, count: int = 2):
+    workers = []
+    for _ in range(count):
+        backend = CacheBackend()
+        cache = TieredCache(namespace, ttl_seconds=60, backend=backend)
+        await backend.start("fakeredis://")
+        workers.append((backend, cache))
+    # Let every listener subscribe before anything is published
+    await asyncio.sleep(0.1)
+    return workers
+
+async def stop_workers(workers):
+    for backend, _ in workers:
+        await backend.stop()
+
+async def wait_until(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+def test_local_tier_without_redis():
+    async def run():
+        cache = TieredCache("local_only", ttl_seconds=60, backend=CacheBackend())
+        await cache.set(("a", 1), {"value": 1})
+        await cache.set(("b", 1), {"value": 2})
+        assert await cache.get(("a", 1)) == {"value": 1}
+        assert await cache.clear("a") == 1
+        assert await cache.get(("a", 1)) is None
+        assert await cache.get(("b", 1)) == {"value": 2}
+
+    asyncio.run(run())
+
+def test_value_set_by_one_worker_is_a_hit_for_another():
+    async def run():
+        workers = await start_workers("shared_hit")
+        try:
+            (_, first), (_, second) = workers
+            await first.set(3, [{"page_content": "text", "score": 0.25}])
+
+            calls = []
+            async def compute():
+                calls.append(1)
+                return []
+
+            assert await second.get_or_set(3, compute) == [{"page_content": "text", "score": 0.25}]
+            assert calls == []
+        finally:
+            await stop_workers(workers)
+
+    asyncio.run(run())
+
+def test_delete_invalidates_other_workers_local_tier():
+    async def run():
+        workers = await start_workers("shared_delete")
+        try:
+            (_, first), (_, second) = workers
+            await first.set("key", 1)
+            assert await second.get("key") == 1 # now held in the second worker's local tier
+
+            await first.delete("key")
+            await wait_until(lambda: second.make_key("key") not in second._local)
+            assert await second.get("key") is None
+        finally:
+            await stop_workers(workers)
+
+    asyncio.run(run())
+
+def test_clear_by_prefix_across_workers():
+    async def run():
+        workers = await start_workers("shared_clear")
+        try:
+            (_, first), (_, second) = workers
+            for access_level in (1, 2):
+                await first.set((access_level, "question"), access_level)
+                assert await second.get((access_level, "question")) == access_level
+
+            assert await first.clear(1) == 1
+            await wait_until(lambda: second.make_key((1, "question")) not in second._local)
+            assert await second.get((1, "question")) is None
+            assert await second.get((2, "question")) == 2
+
+            assert await second.clear() == 1
+            await wait_until(lambda: len(first._local) == 0)
+        finally:
+            await stop_workers(workers)
+
+    asyncio.run(run())
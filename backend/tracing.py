@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor
+from opentelemetry.trace import Status, StatusCode
+from typing import Optional
+import os
+
+# OpenTelemetry tracing for the backend.
+# Exporter chosen from the environment:
+#   OTEL_EXPORTER_OTLP_ENDPOINT set (e.g. http://localhost:4317): OTLP over gRPC to that collector
+#   OTEL_TRACES_FILE set: spans appended to that file as JSON (local runs)
+#   OTEL_TRACES_CONSOLE=true: spans printed to stdout (local runs)
+# With none of them spans are still created (and cheap) but not exported.
+#
+# Span attributes used across the app:
+#   els.user_role, els.access_level, els.document_id, els.query_name
+#   retrieval.k, retrieval.chunk_count
+#   llm.model, llm.stream, llm.max_tokens, llm.prompt_tokens, llm.completion_tokens, llm.total_tokens,
+#   llm.time_to_first_token_ms, llm.chunk_count
+#   db.system (mongodb, postgresql, chroma), db.operation, db.target (collection, table or function), storage.bytes
+load_dotenv()
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "els-backend")
+
+def setup_tracing():
+    provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+
+    otlp_endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    traces_file = os.getenv("OTEL_TRACES_FILE")
+    if otlp_endpoint:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=otlp_endpoint)))
+    elif traces_file:
+        provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter(out=open(traces_file, "a"))))
+    elif os.getenv("OTEL_TRACES_CONSOLE", "").lower() == "true":
+        provider.add_span_processor(SimpleSpanProcessor(ConsoleSpanExporter()))
+
+    trace.set_tracer_provider(provider)
+    return provider
+
+def shutdown_tracing():
+    """
+    Flush spans still waiting in batch processors
+    """
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, TracerProvider):
+        provider.shutdown()
+
+tracer = trace.get_tracer("els-backend")
+
+def set_attributes(span, attributes: Optional[dict]):
+    for key, value in (attributes or {}).items():
+        if value is not None:
+            span.set_attribute(key, value)
+
+@contextmanager
+def traced(name: str, attributes: Optional[dict] = None):
+    """
+    Child span of the current one, with attributes (None values skipped) and the exception recorded on failure
+    """
+    with tracer.start_as_current_span(name, record_exception=True, set_status_on_exception=True) as span:
+        set_attributes(span, attributes)
+        yield span
+
+def end_span(span, error: Optional[Exception] = None):
+    """
+    End a span started with tracer.start_span (used where the work outlives the with-block, e.g. streamed responses)
+    """
+    if error is not None:
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, str(error)))
+    span.end()
@@ -0,0 +1,166 @@
+from pymongo import ASCENDING, ReturnDocument
+from bson import ObjectId
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+
+from mongo import run_sync_in_thread
+
+# Outbox of documents whose chunks in the vector store must be brought in line with MongoDB.
+# Entries only carry doc ids: applying an entry re-reads the document from MongoDB and pushes its
+# current metadata (or deletes its chunks if the document is gone), so entries are idempotent and
+# can be retried in any order without reverting newer changes.
+# Callers invalidate anything derived from the vector store (the retrieval cache) only after an entry
+# was applied: apply_entry returns True, drain_outbox counts them and run_outbox_worker calls on_synced.
+OUTBOX_COLLECTION = "vector_store_outbox"
+
+OUTBOX_POLL_INTERVAL_SECONDS = 5
+OUTBOX_MAX_BACKOFF_SECONDS = 300
+OUTBOX_LEASE_SECONDS = 120 # Entries stuck in "processing" longer than this are picked up again
+OUTBOX_MAX_ATTEMPTS = 20 # After this the entry is marked "failed" and left for the reconciliation job
+
+def ensure_outbox_indexes(outbox):
+    outbox.create_index(
+        [("status", ASCENDING), ("next_attempt_at", ASCENDING)],
+        name="status_next_attempt"
+    )
+
+def build_chunk_metadata(document: dict) -> dict:
+    """
+    Metadata every Chroma chunk of a document should carry
+    """
+    tags = document.get("tags", [])
+    return {
+        "doc_id": str(document["_id"]),
+        "filename": document.get("filename", ""),
+        "tags": ",".join(tags) if tags else "",
+        "access_level": document.get("access_level", "public"),
+        "access_level_num": document.get("access_level_num", 0)
+    }
+
+def enqueue_sync(outbox, doc_ids: List[str]) -> ObjectId:
+    """
+    Record that the vector store copies of these documents must be synced
+    """
+    now = datetime.now()
+    result = outbox.insert_one({
+        "doc_ids": list(doc_ids),
+        "status": "pending",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now,
+        "last_error": None
+    })
+    return result.inserted_id
+
+def sync_documents(company_documents_collection, chroma_client, doc_ids: List[str]):
+    """
+    Push the current MongoDB state of the documents to their Chroma chunks, one batched call per document.
+    Raises if the vector store rejects any call.
+    """
+    object_ids = [ObjectId(doc_id) for doc_id in doc_ids]
+    documents = {
+        str(doc["_id"]): doc
+        for doc in company_documents_collection.find(
+            {"_id": {"$in": object_ids}},
+            {"filename": 1, "tags": 1, "access_level": 1, "access_level_num": 1}
+        )
+    }
+
+    # Documents no longer in MongoDB must not keep chunks in the vector store
+    missing_doc_ids = [doc_id for doc_id in doc_ids if doc_id not in documents]
+    if missing_doc_ids:
+        chroma_client._collection.delete(where={"doc_id": {"$in": missing_doc_ids}})
+
+    for doc_id, document in documents.items():
+        results = chroma_client._collection.get(where={"doc_id": doc_id}, include=[])
+        chunk_ids = results.get("ids") or []
+        if chunk_ids:
+            metadata = build_chunk_metadata(document)
+            chroma_client._collection.update(
+                ids=chunk_ids,
+                metadatas=[metadata] * len(chunk_ids)
+            )
+
+def apply_entry(outbox, company_documents_collection, chroma_client, entry: dict) -> bool:
+    """
+    Apply one outbox entry. Removes it on success, schedules a retry with backoff on failure.
+    """
+    try:
+        sync_documents(company_documents_collection, chroma_client, entry["doc_ids"])
+        outbox.delete_one({"_id": entry["_id"]})
+        return True
+    except Exception as e:
+        attempts = entry.get("attempts", 0) + 1
+        backoff = min(2 ** attempts, OUTBOX_MAX_BACKOFF_SECONDS)
+        outbox.update_one(
+            {"_id": entry["_id"]},
+            {"$set": {
+                "status": "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending",
+                "attempts": attempts,
+                "next_attempt_at": datetime.now() + timedelta(seconds=backoff),
+                "last_error": str(e)
+            }}
+        )
+        print(f"Error syncing vector store (attempt {attempts}): {e}")
+        return False
+
+def claim_entry(outbox, entry_id: ObjectId):
+    """
+    Claim a specific pending entry, used to apply a change inline right after recording it
+    """
+    return outbox.find_one_and_update(
+        {"_id": entry_id, "status": "pending"},
+        {"$set": {"status": "processing", "claimed_at": datetime.now()}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def claim_next_entry(outbox):
+    """
+    Atomically claim the oldest due entry so concurrent workers never apply the same one
+    """
+    now = datetime.now()
+    return outbox.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "processing", "claimed_at": {"$lte": now - timedelta(seconds=OUTBOX_LEASE_SECONDS)}}
+        ]},
+        {"$set": {"status": "processing", "claimed_at": now}},
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def drain_outbox(outbox, company_documents_collection, chroma_client, max_entries: int = 100) -> int:
+    """
+    Apply due outbox entries until none are left or max_entries have been tried.
+    Returns the number of entries applied successfully.
+    """
+    processed = 0
+    applied = 0
+    while processed < max_entries:
+        entry = claim_next_entry(outbox)
+        if not entry:
+            break
+        if apply_entry(outbox, company_documents_collection, chroma_client, entry):
+            applied += 1
+        processed += 1
+    return applied
+
+async def run_outbox_worker(
+    outbox,
+    company_documents_collection,
+    chroma_client,
+    interval_seconds: float = OUTBOX_POLL_INTERVAL_SECONDS,
+    on_synced: Optional[Callable[[], Awaitable]] = None
+):
+    """
+    Background loop draining the outbox until cancelled, awaiting on_synced after any entry was applied
+    """
+    while True:
+        try:
+            applied = await run_sync_in_thread(drain_outbox, outbox, company_documents_collection, chroma_client)
+            if applied and on_synced is not None:
+                await on_synced()
+        except Exception as e:
+            print(f"Outbox worker error: {e}")
+        await asyncio.sleep(interval_seconds)
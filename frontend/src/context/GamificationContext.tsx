@@ -85,11 +85,21 @@ export const GamificationProvider: React.FC<{ children: React.ReactNode }> = ({
                 body: JSON.stringify({
                     user_id: user.id,
                     activity_type: activityType,
-                    metadata: metadata || {}
+                    metadata: metadata || {},
+                    // Answer once the event is written, so the refresh below includes it
+                    wait: true
                 })
             });
 
             if (response.ok) {
+                const data = await response.json();
+
+                if (data.queued && !data.flushed) {
+                    // Still being written in the background: show the EXP now, fetching would return the previous state
+                    setStats(prev => prev ? { ...prev, total_exp: prev.total_exp + (data.exp_earned || 0) } : prev);
+                    return;
+                }
+
                 // Refresh stats and badges after tracking
                 await Promise.all([fetchStats(), fetchBadges()]);
             }